@@ -1,17 +1,31 @@
 from django.contrib import admin
+from django.db import transaction
+from django.db.models import F
+from api.leaderboard import rebuild_leaderboard
 from api.models import Collect, Payment, Like, Comment
+from api.tasks import schedule_collect_rebuild
 
 # Register your models here.
 
 
+def add_to_totals(collect_id, amount, count):
+    Collect.objects.filter(id=collect_id).update(
+        collected_amount=F("collected_amount") + amount,
+        payments_count=F("payments_count") + count,
+    )
+
+
 @admin.register(Collect)
 class CollectAdmin(admin.ModelAdmin):
     list_display = (
         "name",
         "author",
+        "collected_amount",
+        "payments_count",
         "is_active",
         "stop_date",
     )
+    list_select_related = ("author",)
     search_fields = ("name", "author")
 
 
@@ -23,8 +37,36 @@ class PaymentAdmin(admin.ModelAdmin):
         "amount",
         "hide_amount",
     )
+    list_select_related = ("author", "collect__author")
     search_fields = ("collect", "author")
 
+    def save_model(self, request, obj, form, change):
+        """
+        Изменить итоги сбора на сумму нового или измененного платежа.
+        При изменении суммы или сбора платежа из итогов прежнего сбора
+        вычитаются прежние значения. Удаление учитывается сигналом
+        remove_payment_from_totals.
+        """
+        old = (
+            Payment.objects.select_for_update()
+            .values_list("collect_id", "amount")
+            .get(pk=obj.pk)
+            if change
+            else None
+        )
+        super().save_model(request, obj, form, change)
+        if old == (obj.collect_id, obj.amount):
+            return
+        if old is not None:
+            old_collect_id, old_amount = old
+            add_to_totals(old_collect_id, -old_amount, -1)
+            if old_collect_id != obj.collect_id:
+                schedule_collect_rebuild(old_collect_id)
+                transaction.on_commit(
+                    lambda: rebuild_leaderboard(old_collect_id)
+                )
+        add_to_totals(obj.collect_id, obj.amount, 1)
+
 
 @admin.register(Like)
 class LikeAdmin(admin.ModelAdmin):
@@ -32,6 +74,7 @@ class LikeAdmin(admin.ModelAdmin):
         "author",
         "payment",
     )
+    list_select_related = ("author", "payment__author")
     search_fields = ("payment", "author")
 
 
@@ -41,4 +84,5 @@ class CommentAdmin(admin.ModelAdmin):
         "author",
         "payment",
     )
+    list_select_related = ("author", "payment__author")
     search_fields = ("payment", "author")
@@ -7,3 +7,10 @@ class ApiConfig(AppConfig):
 
     def ready(self):
         import api.signals
+        from django.db.backends.signals import connection_created
+
+        from api.profiling import install_query_recorder
+
+        connection_created.connect(
+            install_query_recorder, dispatch_uid="install_query_recorder"
+        )
@@ -0,0 +1,482 @@
+import asyncio
+import math
+import random
+import time
+import weakref
+
+from django.conf import settings
+from django.core.cache import cache
+from redis.asyncio import Redis
+
+from api.profiling import current_profile
+
+from proninteam.constants import (
+    COLLECT_CACHE_COUNTER_TIMEOUT,
+    COLLECT_CACHE_EARLY_REFRESH_BETA,
+    COLLECT_CACHE_LOCK_POLL_INTERVAL,
+    COLLECT_CACHE_LOCK_TIMEOUT,
+    COLLECT_CACHE_LOCK_WAIT,
+    COLLECT_CACHE_STALE_TIMEOUT,
+    COLLECT_CACHE_TIMEOUT,
+)
+
+COLLECT_CACHE_HITS_KEY = "collect_cache_hits"
+COLLECT_CACHE_MISSES_KEY = "collect_cache_misses"
+
+# Асинхронные клиенты Redis по циклам событий
+async_clients = weakref.WeakKeyDictionary()
+
+
+def incr_counter(key, delta=1):
+    """Увеличить счетчик в кэше, создав его при первом обращении."""
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        if cache.add(key, delta, timeout=None):
+            return delta
+        return cache.incr(key, delta)
+
+
+def collect_generation_key(collect_id):
+    # Генерации в микросекундах, ключи с генерациями в наносекундах
+    # прежних версий не читаются
+    return f"collect_gen_{collect_id}"
+
+
+def initial_generation():
+    """
+    Начальная генерация в микросекундах: INCR django_redis выполняется
+    Lua-скриптом и возвращает число с точностью double (до 2**53).
+    """
+    return time.time_ns() // 1000
+
+
+def get_counter(key):
+    """
+    Счетчик генерации или версии сбора.
+    Начальное значение берется из времени, поэтому после потери
+    или истечения счетчика новое значение не совпадет со старыми.
+    Счетчик живет COLLECT_CACHE_COUNTER_TIMEOUT: счетчики несуществующих
+    и удаленных сборов не остаются в Redis навсегда.
+    """
+    value = cache.get(key)
+    if value is None:
+        value = initial_generation()
+        if not cache.add(key, value, timeout=COLLECT_CACHE_COUNTER_TIMEOUT):
+            value = cache.get(key, value)
+    return value
+
+
+def get_collect_generation(collect_id):
+    """Текущая генерация кэша сбора (часть ключа тела ответа)."""
+    return get_counter(collect_generation_key(collect_id))
+
+
+def collect_version_key(collect_id):
+    return f"collect_version_{collect_id}"
+
+
+def get_collect_version(collect_id):
+    """
+    Текущая версия данных сбора для ETag. В отличие от генерации
+    она увеличивается сразу после фиксации каждого изменения сбора,
+    его платежей, лайков и комментариев (bump_collect_version).
+    Версия, как и генерация, живет COLLECT_CACHE_COUNTER_TIMEOUT
+    и удаляется вместе со сбором.
+    """
+    return get_counter(collect_version_key(collect_id))
+
+
+def find_collect_version(collect_id):
+    """
+    Версия сбора, если она уже есть в кэше, иначе None.
+    В отличие от get_collect_version версия не создается: для сбора,
+    который еще не читался или не существует, ее нет.
+    """
+    return cache.get(collect_version_key(collect_id))
+
+
+def bump_collect_version(collect_id):
+    try:
+        cache.incr(collect_version_key(collect_id))
+    except ValueError:
+        # Версии нет: при следующем чтении будет создана новая
+        pass
+
+
+def collect_detail_key(collect_id, generation, variant=None):
+    """
+    Ключ тела ответа сбора. variant - копия обложки, отличная
+    от копии по умолчанию (см. get_logo_variant), тела с такими
+    копиями кэшируются отдельно.
+    """
+    key = f"collect_body_{collect_id}_{generation}"
+    return f"{key}_{variant}" if variant else key
+
+
+def collect_lock_key(collect_id, generation, variant=None):
+    key = f"collect_body_lock_{collect_id}_{generation}"
+    return f"{key}_{variant}" if variant else key
+
+
+def collect_stale_key(collect_id):
+    return f"collect_stale_{collect_id}"
+
+
+def collect_etag(collect_id, version, variant=None):
+    """
+    Сильный ETag просмотра сбора по версии данных, из которой
+    построено тело ответа, и копии обложки. Тело из кэша, построенное
+    до изменения, отдается со своей (старой) версией и не дает
+    ответа 304.
+    """
+    if variant:
+        return f'"{collect_id}-{version}-{variant}"'
+    return f'"{collect_id}-{version}"'
+
+
+def invalidate_collect_cache(collect_id):
+    """
+    Сбросить кэш сбора одним INCR генерации.
+    Записи старых генераций больше не читаются и истекают по таймауту.
+    """
+    bump_collect_version(collect_id)
+    try:
+        cache.incr(collect_generation_key(collect_id))
+    except ValueError:
+        # Генерации нет: при следующем чтении будет создана новая
+        pass
+
+
+def invalidate_collect_caches(collect_ids):
+    """
+    Сбросить кэш нескольких сборов одним запросом к кэшу.
+    Генерации и версии удаляются, при следующем чтении будут созданы
+    новые.
+    Устаревшие тела удаляются вместе с ними: сбор, закрытый по дате
+    завершения, не должен отдаваться открытым, пока строится новое тело.
+    Так же удаляются ключи удаленных и несуществующих сборов.
+    """
+    cache.delete_many(
+        [
+            key
+            for collect_id in collect_ids
+            for key in (
+                collect_generation_key(collect_id),
+                collect_version_key(collect_id),
+                collect_stale_key(collect_id),
+            )
+        ]
+    )
+
+
+def should_refresh_early(entry):
+    """
+    Вероятностное обновление записи до истечения таймаута (XFetch).
+    Чем ближе срок истечения и чем дольше строится ответ,
+    тем выше вероятность, что запрос перестроит запись заранее.
+    """
+    return (
+        time.time()
+        - entry["delta"]
+        * COLLECT_CACHE_EARLY_REFRESH_BETA
+        * math.log(1 - random.random())
+        >= entry["expires_at"]
+    )
+
+
+def set_collect_detail(
+    collect_id, generation, version, body, delta=0, variant=None
+):
+    """
+    Записать тело ответа сбора. Устаревшее тело (на время перестроения)
+    хранится только для копии обложки по умолчанию.
+    """
+    cache.set(
+        collect_detail_key(collect_id, generation, variant),
+        {
+            "body": body,
+            "version": version,
+            "delta": delta,
+            "expires_at": time.time() + COLLECT_CACHE_TIMEOUT,
+        },
+        timeout=COLLECT_CACHE_TIMEOUT,
+    )
+    if variant:
+        return
+    cache.set(
+        collect_stale_key(collect_id),
+        {"body": body, "version": version},
+        timeout=COLLECT_CACHE_STALE_TIMEOUT,
+    )
+
+
+def publish_collect_detail(collect_id, generation, version, body, delta=0):
+    """
+    Переключить читателей на новую версию тела ответа сбора.
+    Генерация увеличивается INCR, тело записывается под значение,
+    которое вернул INCR. Если генерацию за время построения тела
+    увеличил кто-то еще (сброс кэша после записи в БД), тело могло
+    устареть и не записывается: его построит следующий читатель.
+    """
+    try:
+        published = cache.incr(collect_generation_key(collect_id))
+    except ValueError:
+        # Генерации нет: при следующем чтении будет создана новая
+        return
+    if published == generation + 1:
+        set_collect_detail(collect_id, published, version, body, delta)
+
+
+def wait_collect_detail(collect_id, generation, variant=None):
+    key = collect_detail_key(collect_id, generation, variant)
+    deadline = time.monotonic() + COLLECT_CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(COLLECT_CACHE_LOCK_POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+    return None
+
+
+def get_or_build_collect_detail(
+    collect_id, generation, version, build, variant=None
+):
+    """
+    Тело ответа просмотра сбора (готовый JSON в байтах) из кэша,
+    при промахе оно строится функцией build. Возвращается тело
+    и версия данных, из которой оно построено (для ETag), либо None
+    для записей без версии.
+    Перестраивает запись только запрос, получивший короткую блокировку,
+    остальные получают текущую или устаревшую запись, либо ждут
+    новую запись не дольше COLLECT_CACHE_LOCK_WAIT.
+    Генерация и версия (get_collect_generation, get_collect_version)
+    читаются до обращения к БД и используются при записи, поэтому
+    данные, устаревшие за время построения ответа, попадут под старый
+    ключ и старую версию.
+    variant - копия обложки, если она отличается от копии по умолчанию.
+    """
+    key = collect_detail_key(collect_id, generation, variant)
+    entry = cache.get(key)
+    if entry is not None and not should_refresh_early(entry):
+        incr_counter(COLLECT_CACHE_HITS_KEY)
+        return entry["body"], entry.get("version")
+
+    lock_key = collect_lock_key(collect_id, generation, variant)
+    if cache.add(lock_key, 1, timeout=COLLECT_CACHE_LOCK_TIMEOUT):
+        try:
+            start = time.monotonic()
+            body = build()
+            # Промах учитывается после построения: 404 промахом не считается
+            incr_counter(COLLECT_CACHE_MISSES_KEY)
+            set_collect_detail(
+                collect_id,
+                generation,
+                version,
+                body,
+                time.monotonic() - start,
+                variant,
+            )
+            return body, version
+        finally:
+            cache.delete(lock_key)
+
+    if entry is None and not variant:
+        entry = cache.get(collect_stale_key(collect_id))
+    if entry is None:
+        entry = wait_collect_detail(collect_id, generation, variant)
+    if entry is not None:
+        incr_counter(COLLECT_CACHE_HITS_KEY)
+        return entry["body"], entry.get("version")
+    # Блокировка не освободилась вовремя: строим ответ без записи в кэш
+    body = build()
+    incr_counter(COLLECT_CACHE_MISSES_KEY)
+    return body, version
+
+
+def get_async_redis():
+    """
+    Асинхронный клиент Redis кэша для текущего цикла событий.
+    Соединения asyncio привязаны к циклу, поэтому клиент свой
+    у каждого цикла (под ASGI цикл один на процесс).
+    """
+    loop = asyncio.get_running_loop()
+    client = async_clients.get(loop)
+    if client is None:
+        client = Redis.from_url(settings.CACHES["default"]["LOCATION"])
+        async_clients[loop] = client
+    return client
+
+
+async def aclose_async_redis():
+    client = async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def acache_call(method, *args, **kwargs):
+    """Команда асинхронного клиента с учетом времени в профиле запроса."""
+    profile = current_profile.get()
+    start = time.perf_counter()
+    try:
+        return await method(*args, **kwargs)
+    finally:
+        if profile is not None:
+            profile.cache_time += time.perf_counter() - start
+
+
+async def acache_get(key, default=None):
+    """
+    Асинхронный аналог cache.get. Ключи и сериализация значений
+    совпадают с django_redis, поэтому записи общие с синхронным кодом.
+    """
+    client = cache.client
+    value = await acache_call(get_async_redis().get, client.make_key(key))
+    profile = current_profile.get()
+    if profile is not None:
+        if value is None:
+            profile.cache_misses += 1
+        else:
+            profile.cache_hits += 1
+    return default if value is None else client.decode(value)
+
+
+async def acache_add(key, value, timeout):
+    client = cache.client
+    return bool(
+        await acache_call(
+            get_async_redis().set,
+            client.make_key(key),
+            client.encode(value),
+            nx=True,
+            ex=timeout,
+        )
+    )
+
+
+async def aincr_counter(key, delta=1):
+    """Асинхронный аналог incr_counter: INCRBY создает счетчик сам."""
+    return await acache_call(
+        get_async_redis().incrby, cache.client.make_key(key), delta
+    )
+
+
+async def aget_counter(key):
+    value = await acache_get(key)
+    if value is None:
+        value = initial_generation()
+        if not await acache_add(key, value, COLLECT_CACHE_COUNTER_TIMEOUT):
+            value = await acache_get(key, value)
+    return value
+
+
+async def aget_collect_generation(collect_id):
+    return await aget_counter(collect_generation_key(collect_id))
+
+
+async def aget_collect_version(collect_id):
+    return await aget_counter(collect_version_key(collect_id))
+
+
+async def afind_collect_version(collect_id):
+    return await acache_get(collect_version_key(collect_id))
+
+
+async def aset_collect_detail(
+    collect_id, generation, version, body, delta=0, variant=None
+):
+    client = cache.client
+    entry = {
+        "body": body,
+        "version": version,
+        "delta": delta,
+        "expires_at": time.time() + COLLECT_CACHE_TIMEOUT,
+    }
+    pipeline = get_async_redis().pipeline(transaction=False)
+    pipeline.set(
+        client.make_key(collect_detail_key(collect_id, generation, variant)),
+        client.encode(entry),
+        ex=COLLECT_CACHE_TIMEOUT,
+    )
+    if not variant:
+        pipeline.set(
+            client.make_key(collect_stale_key(collect_id)),
+            client.encode({"body": body, "version": version}),
+            ex=COLLECT_CACHE_STALE_TIMEOUT,
+        )
+    await acache_call(pipeline.execute)
+
+
+async def await_collect_detail(collect_id, generation, variant=None):
+    key = collect_detail_key(collect_id, generation, variant)
+    deadline = time.monotonic() + COLLECT_CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(COLLECT_CACHE_LOCK_POLL_INTERVAL)
+        entry = await acache_get(key)
+        if entry is not None:
+            return entry
+    return None
+
+
+async def aget_or_build_collect_detail(
+    collect_id, generation, version, build, variant=None
+):
+    """
+    Асинхронный аналог get_or_build_collect_detail для ASGI:
+    обращения к Redis не занимают поток, build - корутина.
+    Ключи, блокировка и счетчики общие с синхронной версией.
+    """
+    key = collect_detail_key(collect_id, generation, variant)
+    entry = await acache_get(key)
+    if entry is not None and not should_refresh_early(entry):
+        await aincr_counter(COLLECT_CACHE_HITS_KEY)
+        return entry["body"], entry.get("version")
+
+    lock_key = collect_lock_key(collect_id, generation, variant)
+    if await acache_add(lock_key, 1, COLLECT_CACHE_LOCK_TIMEOUT):
+        try:
+            start = time.monotonic()
+            body = await build()
+            await aincr_counter(COLLECT_CACHE_MISSES_KEY)
+            await aset_collect_detail(
+                collect_id,
+                generation,
+                version,
+                body,
+                time.monotonic() - start,
+                variant,
+            )
+            return body, version
+        finally:
+            await acache_call(
+                get_async_redis().delete, cache.client.make_key(lock_key)
+            )
+
+    if entry is None and not variant:
+        entry = await acache_get(collect_stale_key(collect_id))
+    if entry is None:
+        entry = await await_collect_detail(collect_id, generation, variant)
+    if entry is not None:
+        await aincr_counter(COLLECT_CACHE_HITS_KEY)
+        return entry["body"], entry.get("version")
+    body = await build()
+    await aincr_counter(COLLECT_CACHE_MISSES_KEY)
+    return body, version
+
+
+def get_collect_cache_stats():
+    counters = cache.get_many(
+        [COLLECT_CACHE_HITS_KEY, COLLECT_CACHE_MISSES_KEY]
+    )
+    hits = counters.get(COLLECT_CACHE_HITS_KEY, 0)
+    misses = counters.get(COLLECT_CACHE_MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": hits / total if total else 0,
+    }
+
+
+def reset_collect_cache_stats():
+    cache.delete_many([COLLECT_CACHE_HITS_KEY, COLLECT_CACHE_MISSES_KEY])
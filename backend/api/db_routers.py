@@ -0,0 +1,121 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.functional import SimpleLazyObject, empty
+from rest_framework.permissions import SAFE_METHODS
+
+from api.metrics import inc
+
+current_db_state = ContextVar("current_db_state", default=None)
+primary_reads = ContextVar("primary_reads", default=False)
+
+
+def primary_sticky_key(user_id):
+    return f"db_primary_{user_id}"
+
+
+def get_request_user(request):
+    """
+    Пользователь запроса, если он уже определен.
+    Ленивый пользователь AuthenticationMiddleware не вычисляется,
+    пользователя JWT DRF записывает в запрос после аутентификации.
+    """
+    user = request.__dict__.get("user")
+    if isinstance(user, SimpleLazyObject):
+        user = None if user._wrapped is empty else user._wrapped
+    return user
+
+
+def pin_primary(user_id):
+    """Читать данные пользователя с основной БД после его записи."""
+    cache.set(
+        primary_sticky_key(user_id),
+        1,
+        timeout=settings.DATABASE_PRIMARY_STICKY_TIMEOUT,
+    )
+    inc("db_primary_pins_total", {})
+
+
+@contextmanager
+def read_from_primary():
+    """
+    Читать с основной БД внутри блока.
+    Общие для всех пользователей данные (тела ответов в кэше) строятся
+    с основной БД: отставшая реплика попала бы в кэш под новую версию,
+    а закрепление за основной БД действует только для одного
+    пользователя.
+    """
+    token = primary_reads.set(True)
+    try:
+        yield
+    finally:
+        primary_reads.reset(token)
+
+
+class RequestDatabaseState:
+    """
+    Выбор БД для чтений в одном запросе.
+    Изменяющие запросы читают с основной БД, как и пользователь,
+    недавно изменявший данные. Реплика выбирается одна на запрос.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.primary = request.method not in SAFE_METHODS
+        self.user_checked = False
+        self.replica = None
+
+    def use_primary(self):
+        if self.primary or self.user_checked:
+            return self.primary
+        user = get_request_user(self.request)
+        if user is None:
+            # Пользователь еще не известен, проверим при следующем чтении
+            return False
+        self.user_checked = True
+        if user.is_authenticated:
+            self.primary = cache.get(primary_sticky_key(user.pk)) is not None
+        return self.primary
+
+    def get_replica(self):
+        if self.replica is None:
+            self.replica = random.choice(settings.DATABASE_REPLICAS)
+        return self.replica
+
+
+class ReplicaRouter:
+    """
+    Чтения в безопасных HTTP-запросах идут на реплики
+    (settings.DATABASE_REPLICAS), все остальное - на основную БД.
+    Вне запроса (Celery, команды), внутри транзакции
+    и в блоке read_from_primary чтения тоже идут на основную БД.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = current_db_state.get()
+        if not settings.DATABASE_REPLICAS or state is None:
+            return DEFAULT_DB_ALIAS
+        if primary_reads.get():
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if state.use_primary():
+            return DEFAULT_DB_ALIAS
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return state.get_replica()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема реплик приходит с основной БД репликацией
+        return db == DEFAULT_DB_ALIAS
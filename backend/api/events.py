@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import weakref
+from collections import defaultdict
+
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from api.cache import get_async_redis
+from api.renderers import render_json
+from proninteam.constants import COLLECT_EVENTS_QUEUE_SIZE
+
+logger = logging.getLogger("api.events")
+
+COLLECT_EVENTS_CHANNEL_PREFIX = "collect_events:"
+
+
+def collect_events_channel(collect_id):
+    return f"{COLLECT_EVENTS_CHANNEL_PREFIX}{collect_id}"
+
+
+def sse_frame(event, data):
+    """Событие в формате Server-Sent Events."""
+    return b"event: %s\ndata: %s\n\n" % (event.encode(), render_json(data))
+
+
+def publish_collect_event(collect_id, event, data):
+    """
+    Опубликовать событие сбора в Redis pub/sub.
+    Событие публикуется готовым кадром SSE, поэтому подписчикам
+    оно раздается без повторного кодирования.
+    """
+    get_redis_connection("default").publish(
+        collect_events_channel(collect_id), sse_frame(event, data)
+    )
+
+
+class CollectEventHub:
+    """
+    Раздача событий сборов подписчикам одного процесса.
+    На процесс (цикл событий) открыта одна подписка Redis pub/sub
+    на каналы сборов, у которых есть подписчики, каждое событие
+    кладется в очереди локальных подписчиков. Подписчик, не успевающий
+    читать события, пропускает их, пока его очередь заполнена.
+    """
+
+    def __init__(self):
+        self.pubsub = get_async_redis().pubsub()
+        self.queues = defaultdict(set)
+        self.listener = None
+
+    async def subscribe(self, collect_id):
+        queue = asyncio.Queue(maxsize=COLLECT_EVENTS_QUEUE_SIZE)
+        queues = self.queues[collect_id]
+        queues.add(queue)
+        if len(queues) == 1:
+            await self.pubsub.subscribe(collect_events_channel(collect_id))
+        if self.listener is None or self.listener.done():
+            self.listener = asyncio.create_task(self.listen())
+        return queue
+
+    async def unsubscribe(self, collect_id, queue):
+        queues = self.queues.get(collect_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self.queues[collect_id]
+            await self.pubsub.unsubscribe(collect_events_channel(collect_id))
+
+    async def close(self):
+        if self.listener is not None:
+            self.listener.cancel()
+        await self.pubsub.aclose()
+
+    async def listen(self):
+        while self.queues:
+            try:
+                message = await self.pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=1.0
+                )
+            except RedisError:
+                # Подписка восстанавливается при переподключении
+                logger.exception("Collect events subscription failed")
+                await asyncio.sleep(1)
+                continue
+            if message is None:
+                continue
+            collect_id = int(
+                message["channel"]
+                .decode()
+                .removeprefix(COLLECT_EVENTS_CHANNEL_PREFIX)
+            )
+            for queue in tuple(self.queues.get(collect_id, ())):
+                try:
+                    queue.put_nowait(message["data"])
+                except asyncio.QueueFull:
+                    logger.debug("Subscriber queue full, event dropped")
+
+
+# Хабы по циклам событий (как и асинхронные клиенты Redis)
+hubs = weakref.WeakKeyDictionary()
+
+
+def get_event_hub():
+    loop = asyncio.get_running_loop()
+    hub = hubs.get(loop)
+    if hub is None:
+        hub = hubs[loop] = CollectEventHub()
+    return hub
+
+
+async def aclose_event_hub():
+    hub = hubs.pop(asyncio.get_running_loop(), None)
+    if hub is not None:
+        await hub.close()
@@ -0,0 +1,61 @@
+from rest_framework import serializers
+from rest_framework.filters import BaseFilterBackend
+
+from proninteam.constants import FORMAT, REASON
+
+
+class CollectFilterSerializer(serializers.Serializer):
+    """Сериализатор для разбора параметров фильтрации списка сборов."""
+
+    is_active = serializers.BooleanField(required=False)
+    event_reason = serializers.ChoiceField(choices=REASON, required=False)
+    event_format = serializers.ChoiceField(choices=FORMAT, required=False)
+    author = serializers.IntegerField(required=False)
+    stop_date_after = serializers.DateTimeField(required=False)
+    stop_date_before = serializers.DateTimeField(required=False)
+    event_date_after = serializers.DateField(required=False)
+    event_date_before = serializers.DateField(required=False)
+
+
+class CollectFilterBackend(BaseFilterBackend):
+    """
+    Фильтрация списка сборов по параметрам запроса.
+    Каждому параметру соответствует условие по полю модели,
+    диапазоны дат задаются включительно.
+    Просмотр и изменение отдельного сбора не фильтруются.
+    """
+
+    lookups = {
+        "is_active": "is_active",
+        "event_reason": "event_reason",
+        "event_format": "event_format",
+        "author": "author_id",
+        "stop_date_after": "stop_date__gte",
+        "stop_date_before": "stop_date__lte",
+        "event_date_after": "event_date__gte",
+        "event_date_before": "event_date__lte",
+    }
+
+    def filter_queryset(self, request, queryset, view):
+        if view.action != "list":
+            return queryset
+        # В QueryDict отсутствующий флаг is_active считался бы False
+        serializer = CollectFilterSerializer(data=request.query_params.dict())
+        serializer.is_valid(raise_exception=True)
+        return queryset.filter(
+            **{
+                self.lookups[name]: value
+                for name, value in serializer.validated_data.items()
+            }
+        )
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": name,
+                "required": False,
+                "in": "query",
+                "schema": {"type": "string"},
+            }
+            for name in self.lookups
+        ]
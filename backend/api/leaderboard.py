@@ -0,0 +1,144 @@
+from django.db.models import Count, Q, Sum
+from django_redis import get_redis_connection
+
+from api.models import Payment
+
+LEADERBOARD_KEY_PREFIX = "leaderboard:"
+
+
+def leaderboard_key(collect_id):
+    """Сумма платежей участников сбора: sorted set автор -> сумма."""
+    return f"{LEADERBOARD_KEY_PREFIX}{collect_id}"
+
+
+def hidden_donors_key(collect_id):
+    """Участники сбора, скрывшие сумму хотя бы одного платежа."""
+    return f"leaderboard_hidden:{collect_id}"
+
+
+def add_payments(collect_id, payments):
+    """Добавить суммы новых платежей к рейтингу сбора."""
+    redis = get_redis_connection("default")
+    pipeline = redis.pipeline(transaction=False)
+    for payment in payments:
+        pipeline.zincrby(
+            leaderboard_key(collect_id),
+            float(payment.amount),
+            payment.author_id,
+        )
+        if payment.hide_amount:
+            pipeline.sadd(hidden_donors_key(collect_id), payment.author_id)
+    pipeline.execute()
+
+
+def remove_payment(payment):
+    """
+    Вычесть сумму удаленного платежа из рейтинга сбора.
+    Отметка о скрытой сумме остается до пересчета рейтинга.
+    """
+    redis = get_redis_connection("default")
+    key = leaderboard_key(payment.collect_id)
+    if redis.zincrby(key, -float(payment.amount), payment.author_id) <= 0:
+        redis.zrem(key, payment.author_id)
+
+
+def delete_leaderboard(collect_id):
+    get_redis_connection("default").delete(
+        leaderboard_key(collect_id), hidden_donors_key(collect_id)
+    )
+
+
+def get_leaderboard(collect_id, limit):
+    """
+    Первые limit участников сбора по сумме платежей:
+    место, id автора, сумма и признак скрытой суммы.
+    """
+    redis = get_redis_connection("default")
+    top = redis.zrevrange(
+        leaderboard_key(collect_id), 0, limit - 1, withscores=True
+    )
+    if not top:
+        return []
+    authors = [author for author, _ in top]
+    hidden = redis.smismember(hidden_donors_key(collect_id), authors)
+    return [
+        {
+            "place": place,
+            "author": int(author),
+            "amount": amount,
+            "hidden": bool(is_hidden),
+        }
+        for place, ((author, amount), is_hidden) in enumerate(
+            zip(top, hidden), start=1
+        )
+    ]
+
+
+def write_leaderboard(pipeline, collect_id, rows):
+    """Заменить рейтинг сбора строками (автор, сумма, число скрытых)."""
+    pipeline.delete(leaderboard_key(collect_id), hidden_donors_key(collect_id))
+    if rows:
+        pipeline.zadd(
+            leaderboard_key(collect_id),
+            {author: float(total) for author, total, _ in rows},
+        )
+    hidden = [author for author, _, hidden in rows if hidden]
+    if hidden:
+        pipeline.sadd(hidden_donors_key(collect_id), *hidden)
+
+
+def leaderboard_rows(payments):
+    return (
+        payments.order_by()
+        .values("collect", "author")
+        .annotate(
+            total=Sum("amount"),
+            hidden=Count("id", filter=Q(hide_amount=True)),
+        )
+    )
+
+
+def rebuild_leaderboard(collect_id):
+    """Пересчитать рейтинг одного сбора по таблице платежей."""
+    rows = [
+        (row["author"], row["total"], row["hidden"])
+        for row in leaderboard_rows(Payment.objects.filter(collect=collect_id))
+    ]
+    pipeline = get_redis_connection("default").pipeline()
+    write_leaderboard(pipeline, collect_id, rows)
+    pipeline.execute()
+
+
+def rebuild_leaderboards():
+    """
+    Пересчитать рейтинги всех сборов одним проходом по платежам,
+    сгруппированным по сбору и автору. Рейтинги сборов без платежей
+    удаляются. Возвращает число пересчитанных сборов.
+    """
+    redis = get_redis_connection("default")
+    rebuilt = set()
+
+    def flush(collect_id, rows):
+        # Рейтинг сбора заменяется атомарно (MULTI/EXEC)
+        pipeline = redis.pipeline()
+        write_leaderboard(pipeline, collect_id, rows)
+        pipeline.execute()
+        rebuilt.add(str(collect_id))
+
+    collect_id, rows = None, []
+    for row in (
+        leaderboard_rows(Payment.objects.all()).order_by("collect").iterator()
+    ):
+        if row["collect"] != collect_id:
+            if collect_id is not None:
+                flush(collect_id, rows)
+            collect_id, rows = row["collect"], []
+        rows.append((row["author"], row["total"], row["hidden"]))
+    if collect_id is not None:
+        flush(collect_id, rows)
+
+    for key in redis.scan_iter(f"{LEADERBOARD_KEY_PREFIX}*"):
+        stale = key.decode().removeprefix(LEADERBOARD_KEY_PREFIX)
+        if stale not in rebuilt:
+            redis.delete(key, hidden_donors_key(stale))
+    return len(rebuilt)
@@ -0,0 +1,109 @@
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django_redis import get_redis_connection
+
+from api.events import publish_collect_event
+from api.models import Like, Payment
+from api.tasks import buffer_write, schedule_collect_rebuild
+from proninteam.constants import WRITE_BUFFER_PENDING_LIKE_TIMEOUT
+
+
+def set_like(author_id, collect_id, payment_id, liked):
+    """
+    Поставить (liked=True) или снять лайк платежа сбора.
+    Лайк записывается одним запросом INSERT ... ON CONFLICT DO NOTHING
+    или DELETE, повторный запрос ничего не меняет. Счетчик лайков
+    платежа обновляется, только если лайк изменился.
+    Сигналы Like не отправляются: перестроение кэша и событие сбора
+    планируются здесь по id сбора из адреса, без загрузки платежа.
+    Возвращает признак изменения лайка и число лайков платежа
+    (None, если платежа нет в сборе).
+    """
+    like_table = connection.ops.quote_name(Like._meta.db_table)
+    payment_table = connection.ops.quote_name(Payment._meta.db_table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        if liked:
+            cursor.execute(
+                f"INSERT INTO {like_table} (author_id, payment_id) "
+                f"SELECT %s, id FROM {payment_table} "
+                "WHERE id = %s AND collect_id = %s "
+                "ON CONFLICT (author_id, payment_id) DO NOTHING",
+                [author_id, payment_id, collect_id],
+            )
+        else:
+            cursor.execute(
+                f"DELETE FROM {like_table} "
+                "WHERE author_id = %s AND payment_id = ("
+                f"SELECT id FROM {payment_table} "
+                "WHERE id = %s AND collect_id = %s)",
+                [author_id, payment_id, collect_id],
+            )
+        changed = cursor.rowcount > 0
+        if changed:
+            cursor.execute(
+                f"UPDATE {payment_table} "
+                "SET like_count = like_count + %s "
+                "WHERE id = %s RETURNING like_count",
+                [1 if liked else -1, payment_id],
+            )
+        else:
+            cursor.execute(
+                f"SELECT like_count FROM {payment_table} "
+                "WHERE id = %s AND collect_id = %s",
+                [payment_id, collect_id],
+            )
+        row = cursor.fetchone()
+        if changed:
+            like_changed(collect_id, payment_id, 1 if liked else -1)
+    return changed, None if row is None else row[0]
+
+
+def like_changed(collect_id, payment_id, delta):
+    schedule_collect_rebuild(collect_id)
+    data = {"payment": payment_id, "delta": delta}
+    transaction.on_commit(
+        lambda: publish_collect_event(collect_id, "like", data)
+    )
+
+
+def pending_like_key(author_id, payment_id):
+    return f"write_buffer_like_{payment_id}_{author_id}"
+
+
+def buffer_like(author_id, collect_id, payment_id, liked):
+    """
+    Поставить или снять лайк через поток записи (WRITE_BUFFER_ENABLED).
+    Состояние лайка, еще не сохраненное из потока, хранится в Redis
+    (pending_like_key) и сменяется одним GETSET: повторный лайк
+    и снятие отсутствующего лайка отклоняются сразу, в том числе
+    для лайков, которые еще в потоке. Принадлежность платежа сбору
+    и сохраненный лайк проверяются одним запросом.
+    Возвращает признак изменения лайка (запись поставлена в поток)
+    или None, если платежа нет в сборе.
+    """
+    persisted = (
+        Payment.objects.filter(id=payment_id, collect_id=collect_id)
+        .annotate(
+            liked=Exists(
+                Like.objects.filter(
+                    author_id=author_id, payment_id=OuterRef("id")
+                )
+            )
+        )
+        .values_list("liked", flat=True)
+        .first()
+    )
+    if persisted is None:
+        return None
+    key = pending_like_key(author_id, payment_id)
+    pipeline = get_redis_connection("default").pipeline()
+    pipeline.getset(key, "like" if liked else "unlike")
+    pipeline.expire(key, WRITE_BUFFER_PENDING_LIKE_TIMEOUT)
+    pending, _ = pipeline.execute()
+    current = persisted if pending is None else pending == b"like"
+    if current == liked:
+        return False
+    buffer_write(
+        "like" if liked else "unlike", author_id, collect_id, payment_id
+    )
+    return True
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import get_collect_cache_stats, reset_collect_cache_stats
+
+
+class Command(BaseCommand):
+    """Статистика попаданий в кэш просмотра сборов."""
+
+    help = "Выводит число попаданий и промахов кэша collect_detail"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Обнулить счетчики после вывода",
+        )
+
+    def handle(self, *args, **options):
+        stats = get_collect_cache_stats()
+        self.stdout.write(
+            f"hits: {stats['hits']}\n"
+            f"misses: {stats['misses']}\n"
+            f"hit ratio: {stats['hit_ratio']:.2%}"
+        )
+        if options["reset"]:
+            reset_collect_cache_stats()
+            self.stdout.write(self.style.SUCCESS("Counters reset."))
@@ -0,0 +1,68 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import APIException
+
+from api.leaderboard import add_payments
+from api.serializers import PaymentBulkCreateSerializer
+from api.tasks import queue_emails, schedule_collect_rebuild
+
+
+class Command(BaseCommand):
+    """Пакетный импорт платежей в сбор из CSV или JSON файла."""
+
+    help = "Импортирует платежи в сбор из CSV или JSON файла"
+
+    def add_arguments(self, parser):
+        parser.add_argument("collect_id", type=int, help="id сбора")
+        parser.add_argument(
+            "path",
+            help="CSV (author,amount,hide_amount) или JSON список платежей",
+        )
+        parser.add_argument(
+            "--format",
+            choices=("csv", "json"),
+            help="Формат файла, по умолчанию определяется по расширению",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or path.rsplit(".", 1)[-1].lower()
+        start = time.monotonic()
+        with open(path, "rb") as file:
+            if file_format == "csv":
+                try:
+                    rows = PaymentBulkCreateSerializer.rows_from_csv(file)
+                except APIException as error:
+                    raise CommandError(error.detail)
+            elif file_format == "json":
+                try:
+                    rows = json.load(file)
+                except ValueError as error:
+                    # JSONDecodeError и UnicodeDecodeError
+                    raise CommandError(f"Invalid JSON: {error}")
+                if not isinstance(rows, list):
+                    raise CommandError("JSON file must contain a list")
+            else:
+                raise CommandError(f"Unsupported file format: {file_format}")
+
+        serializer = PaymentBulkCreateSerializer(data={"payments": rows})
+        if not serializer.is_valid():
+            raise CommandError(serializer.errors)
+        try:
+            payments = serializer.save(collect_id=options["collect_id"])
+        except APIException as error:
+            raise CommandError(error.detail)
+        # bulk_create не вызывает сигналы платежей
+        add_payments(options["collect_id"], payments)
+        schedule_collect_rebuild(options["collect_id"])
+        queue_emails("payment", [payment.id for payment in payments])
+
+        elapsed = time.monotonic() - start
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{len(payments)} payments imported in {elapsed:.2f}s "
+                f"({len(payments) / elapsed:.0f} rows/s)"
+            )
+        )
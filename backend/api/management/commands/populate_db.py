@@ -1,18 +1,254 @@
+import csv
+import io
+import multiprocessing
 import random
-from django.core.management.base import BaseCommand
+from collections import Counter
+from datetime import timedelta
+from itertools import islice
+
 from django.contrib.auth import get_user_model
-from datetime import timedelta, datetime
-import random
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.db import models
+from django.db.models import Case, F, Max, Value, When
+from django.utils import timezone
 from faker import Faker
-from api.models import Collect, Payment, Like, Comment
+
+from api.models import Collect, Comment, Like, Payment
+from proninteam.constants import (
+    FORMAT,
+    POPULATE_BATCH_SIZE,
+    POPULATE_PAYMENTS_PERIOD,
+    REASON,
+)
 
 User = get_user_model()
-fake = Faker()
-stop_date = datetime.now() + timedelta(days=random.randint(1, 30))
+
+COMMENTS_POOL_SIZE = 1000
+
+
+def chunks(iterable, size):
+    """Разбить поток объектов на списки не длиннее size."""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def copy_rows(model, fields, rows):
+    """Загрузить строки в таблицу модели через COPY (только PostgreSQL)."""
+    columns = ", ".join(model._meta.get_field(name).column for name in fields)
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {model._meta.db_table} ({columns}) "
+            "FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+
+
+def reserve_ids(model, count):
+    """Получить из последовательности id для строк, загружаемых COPY."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, %s)) "
+            "FROM generate_series(1, %s)",
+            [model._meta.db_table, model._meta.pk.column, count],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def payment_created_at(now, number, total):
+    """
+    Время платежа с номером number: платежи равномерно распределены
+    по POPULATE_PAYMENTS_PERIOD секундам до now в порядке номеров.
+    """
+    return now - timedelta(
+        seconds=POPULATE_PAYMENTS_PERIOD * (total - number) / total
+    )
+
+
+def add_collect_totals(payments):
+    """
+    Увеличить итоги сборов (собранную сумму и число платежей)
+    на платежи пачки одним UPDATE.
+    """
+    amounts = Counter()
+    counts = Counter()
+    for _, collect_id, amount, *_ in payments:
+        amounts[collect_id] += amount
+        counts[collect_id] += 1
+    Collect.objects.filter(id__in=counts).update(
+        collected_amount=F("collected_amount")
+        + Case(
+            *[
+                When(id=collect_id, then=Value(amount))
+                for collect_id, amount in amounts.items()
+            ],
+            output_field=models.DecimalField(),
+        ),
+        payments_count=F("payments_count")
+        + Case(
+            *[
+                When(id=collect_id, then=Value(count))
+                for collect_id, count in counts.items()
+            ],
+            output_field=models.IntegerField(),
+        ),
+    )
+
+
+def create_payments(seed, start, end, users, collects, options, now):
+    """
+    Создать платежи с номерами [start, end) вместе с их лайками
+    и комментариями. Платежи, лайки и комментарии создаются пачками,
+    у каждого платежа сразу заполнены счетчики лайков и комментариев,
+    итоги сборов увеличиваются в той же транзакции, что и вставка
+    пачки, время платежа задает payment_created_at.
+    Функция выполняется как в основном процессе, так и в воркерах.
+    """
+    rng = random.Random(seed)
+    fake = Faker()
+    fake.seed_instance(seed)
+    comments_pool = [fake.sentence() for _ in range(COMMENTS_POOL_SIZE)]
+    use_copy = connection.vendor == "postgresql"
+    hot = collects["hot"]
+    hot_share = options["hot_share"]
+    total = options["payments"]
+    created = {"payments": 0, "likes": 0, "comments": 0}
+
+    for low in range(start, end, options["batch_size"]):
+        high = min(low + options["batch_size"], end)
+        payments = []
+        for number in range(low, high):
+            if hot and rng.random() < hot_share:
+                collect = rng.choice(hot)
+            else:
+                collect = rng.choice(collects["all"])
+            collect_id, min_payment, target_amount = collect
+            payments.append(
+                [
+                    rng.choice(users),
+                    collect_id,
+                    rng.randint(min_payment, target_amount),
+                    rng.random() < 0.5,
+                    0,
+                    0,
+                    payment_created_at(now, number, total),
+                ]
+            )
+        # Количество лайков и комментариев пропорционально доле платежей
+        likes_count = (
+            options["likes"] * high // total - options["likes"] * low // total
+        )
+        comments_count = (
+            options["comments"] * high // total
+            - options["comments"] * low // total
+        )
+        likes = {
+            (rng.choice(users), rng.randrange(len(payments)))
+            for _ in range(likes_count)
+        }
+        comments = [
+            (rng.choice(users), rng.randrange(len(payments)))
+            for _ in range(comments_count)
+        ]
+        for _, index in likes:
+            payments[index][4] += 1
+        for _, index in comments:
+            payments[index][5] += 1
+
+        with transaction.atomic():
+            if use_copy:
+                ids = reserve_ids(Payment, len(payments))
+                copy_rows(
+                    Payment,
+                    (
+                        "id",
+                        "author",
+                        "collect",
+                        "amount",
+                        "hide_amount",
+                        "like_count",
+                        "comment_count",
+                        "created_at",
+                    ),
+                    (
+                        [payment_id, *payment[:-1], payment[-1].isoformat()]
+                        for payment_id, payment in zip(ids, payments)
+                    ),
+                )
+                copy_rows(
+                    Like,
+                    ("author", "payment"),
+                    ((author, ids[index]) for author, index in likes),
+                )
+                copy_rows(
+                    Comment,
+                    ("author", "payment", "comment", "created_at"),
+                    (
+                        (
+                            author,
+                            ids[index],
+                            rng.choice(comments_pool),
+                            now.isoformat(),
+                        )
+                        for author, index in comments
+                    ),
+                )
+            else:
+                objs = Payment.objects.bulk_create(
+                    Payment(
+                        author_id=author,
+                        collect_id=collect_id,
+                        amount=amount,
+                        hide_amount=hide_amount,
+                        like_count=like_count,
+                        comment_count=comment_count,
+                    )
+                    for (
+                        author,
+                        collect_id,
+                        amount,
+                        hide_amount,
+                        like_count,
+                        comment_count,
+                        _,
+                    ) in payments
+                )
+                # bulk_create заполняет auto_now_add текущим временем
+                for obj, payment in zip(objs, payments):
+                    obj.created_at = payment[-1]
+                Payment.objects.bulk_update(objs, ["created_at"])
+                ids = [payment.id for payment in objs]
+                Like.objects.bulk_create(
+                    Like(author_id=author, payment_id=ids[index])
+                    for author, index in likes
+                )
+                Comment.objects.bulk_create(
+                    Comment(
+                        author_id=author,
+                        payment_id=ids[index],
+                        comment=rng.choice(comments_pool),
+                    )
+                    for author, index in comments
+                )
+            add_collect_totals(payments)
+        created["payments"] += len(payments)
+        created["likes"] += len(likes)
+        created["comments"] += len(comments)
+    return created
 
 
 class Command(BaseCommand):
-    """Заполнение БД тестовыми данными."""
+    """
+    Заполнение БД тестовыми данными.
+    Объекты создаются потоком пачками по --batch-size, на PostgreSQL
+    платежи, лайки и комментарии загружаются через COPY.
+    При одинаковом --seed данные воспроизводятся.
+    Доля --hot-share платежей приходится на --hot-collects сборов.
+    """
 
     help = "Populate DB with mock data for Collect, Payment, Like, Comment"
 
@@ -32,110 +268,150 @@ class Command(BaseCommand):
         parser.add_argument(
             "--likes", type=int, default=500, help="Number of likes"
         )
+        parser.add_argument(
+            "--seed", type=int, default=None, help="Random seed"
+        )
+        parser.add_argument(
+            "--hot-collects",
+            type=float,
+            default=0.01,
+            help="Share of collects receiving the hot share of payments",
+        )
+        parser.add_argument(
+            "--hot-share",
+            type=float,
+            default=0.8,
+            help="Share of payments going to hot collects",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=POPULATE_BATCH_SIZE,
+            help="Objects per insert",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Parallel processes for payments, likes and comments",
+        )
 
     def handle(self, *args, **options):
-        num_users = options["users"]
-        num_collects = options["collects"]
-        num_payments = options["payments"]
-        num_comments = options["comments"]
-        num_likes = options["likes"]
-
-        users = []
-        for _ in range(num_users):
-            users.append(
-                User(
-                    username=fake.unique.user_name(),
-                    email=fake.unique.email(),
-                    first_name=fake.first_name(),
-                    last_name=fake.last_name(),
-                )
+        if options["workers"] > 1 and connection.vendor != "postgresql":
+            raise CommandError(
+                "Параллельная загрузка поддерживается только для PostgreSQL"
             )
-        User.objects.bulk_create(users)
-        users = list(User.objects.all())
-        self.stdout.write(self.style.SUCCESS(f"{num_users} users created"))
+        seed = options["seed"]
+        if seed is None:
+            seed = random.randrange(2**32)
+        rng = random.Random(seed)
+        fake = Faker()
+        fake.seed_instance(seed)
+        self.stdout.write(f"Seed: {seed}")
 
-        collects = []
-        for _ in range(num_collects):
-            min_payment = round(random.uniform(0, 100), 2)
-            target_amount = round(random.uniform(min_payment + 1, 10000), 2)
-            total_amount = round(random.uniform(target_amount + 1, 1000000), 2)
-            author = random.choice(users)
-            collects.append(
-                Collect(
-                    author=author,
-                    name=fake.unique.sentence(nb_words=3),
-                    slug=fake.unique.slug(),
-                    description=fake.text(max_nb_chars=200),
-                    event_format=random.choice(
-                        [
-                            choice[0]
-                            for choice in Collect._meta.get_field(
-                                "event_format"
-                            ).choices
-                        ]
-                    ),
-                    event_reason=random.choice(
-                        [
-                            choice[0]
-                            for choice in Collect._meta.get_field(
-                                "event_reason"
-                            ).choices
-                        ]
-                    ),
-                    event_date=fake.date_this_year(),
-                    event_time=fake.time(),
-                    event_place=fake.address(),
-                    stop_date=stop_date,
-                    min_payment=min_payment,
-                    target_amount=target_amount,
-                    total_amount=total_amount,
-                )
-            )
-        Collect.objects.bulk_create(collects)
-        collects = list(Collect.objects.all())
+        users = self.create_users(fake, options)
+        self.stdout.write(self.style.SUCCESS(f"{len(users)} users created"))
+        collects = self.create_collects(rng, fake, users, options)
         self.stdout.write(
-            self.style.SUCCESS(f"{num_collects} collects created")
+            self.style.SUCCESS(f"{len(collects['all'])} collects created")
         )
+        if not collects["all"] or not options["payments"]:
+            return
 
-        payments = []
-        for _ in range(num_payments):
-            payments.append(
-                Payment(
-                    author=random.choice(users),
-                    collect=random.choice(collects),
-                    amount=round(
-                        random.uniform(min_payment, target_amount), 2
-                    ),
-                    hide_amount=random.choice([True, False]),
-                )
+        workers = max(1, min(options["workers"], options["payments"]))
+        bounds = [
+            options["payments"] * worker // workers
+            for worker in range(workers + 1)
+        ]
+        now = timezone.now()
+        tasks = [
+            (seed + worker + 1, start, end, users, collects, options, now)
+            for worker, (start, end) in enumerate(zip(bounds, bounds[1:]))
+        ]
+        if workers == 1:
+            results = [create_payments(*tasks[0])]
+        else:
+            # Воркеры не должны использовать соединение основного процесса
+            connections.close_all()
+            context = multiprocessing.get_context("fork")
+            with context.Pool(workers) as pool:
+                results = pool.starmap(create_payments, tasks)
+        for name in ("payments", "comments", "likes"):
+            created = sum(result[name] for result in results)
+            self.stdout.write(self.style.SUCCESS(f"{created} {name} created"))
+        closed = self.close_collects(collects)
+        self.stdout.write(self.style.SUCCESS(f"{closed} collects closed"))
+
+    def close_collects(self, collects):
+        """
+        Закрыть созданные сборы, собравшие общую сумму, как при приеме
+        платежа (и как update_collects).
+        """
+        ids = [collect_id for collect_id, *_ in collects["all"]]
+        return Collect.objects.filter(
+            id__range=(min(ids), max(ids)),
+            is_active=True,
+            total_amount__gt=0,
+            total_amount__lte=F("collected_amount"),
+        ).update(is_active=False)
+
+    def create_users(self, fake, options):
+        """Создать пользователей и вернуть их id."""
+        base = User.objects.aggregate(last=Max("id"))["last"] or 0
+        users = (
+            User(
+                username=f"{fake.user_name()}{base + number}",
+                email=f"user{base + number}@{fake.free_email_domain()}",
+                first_name=fake.first_name(),
+                last_name=fake.last_name(),
             )
-        Payment.objects.bulk_create(payments)
-        payments = list(Payment.objects.all())
-        self.stdout.write(
-            self.style.SUCCESS(f"{num_payments} payments created")
+            for number in range(1, options["users"] + 1)
         )
+        return [
+            user.id
+            for chunk in chunks(users, options["batch_size"])
+            for user in User.objects.bulk_create(chunk)
+        ]
 
-        comments = []
-        for _ in range(num_comments):
-            comments.append(
-                Comment(
-                    author=random.choice(users),
-                    payment=random.choice(payments),
-                    comment=fake.sentence(),
+    def create_collects(self, rng, fake, users, options):
+        """
+        Создать сборы и вернуть для каждого id, минимальный платеж
+        и цель сбора, отдельно список горячих сборов.
+        """
+        base = Collect.objects.aggregate(last=Max("id"))["last"] or 0
+        now = timezone.now()
+        collects = []
+        for chunk in chunks(
+            range(base + 1, base + options["collects"] + 1),
+            options["batch_size"],
+        ):
+            objs = []
+            for number in chunk:
+                min_payment = rng.randint(0, 100)
+                target_amount = rng.randint(min_payment + 1, 10000)
+                objs.append(
+                    Collect(
+                        author_id=rng.choice(users),
+                        name=f"{fake.sentence(nb_words=3)} {number}",
+                        slug=f"{fake.slug()}-{number}",
+                        description=fake.text(max_nb_chars=200),
+                        event_format=rng.choice(FORMAT)[0],
+                        event_reason=rng.choice(REASON)[0],
+                        event_date=fake.date_this_year(),
+                        event_time=fake.time(),
+                        event_place=fake.address(),
+                        stop_date=now + timedelta(days=rng.randint(1, 30)),
+                        min_payment=min_payment,
+                        target_amount=target_amount,
+                        total_amount=rng.randint(target_amount + 1, 1000000),
+                    )
                 )
+            collects.extend(
+                (collect.id, collect.min_payment, collect.target_amount)
+                for collect in Collect.objects.bulk_create(objs)
             )
-        Comment.objects.bulk_create(comments)
-        self.stdout.write(
-            self.style.SUCCESS(f"{num_comments} comments created")
-        )
-
-        likes = []
-        seen = set()
-        for _ in range(num_likes):
-            user = random.choice(users)
-            payment = random.choice(payments)
-            if (user.id, payment.id) not in seen:
-                likes.append(Like(author=user, payment=payment))
-                seen.add((user.id, payment.id))
-        Like.objects.bulk_create(likes)
-        self.stdout.write(self.style.SUCCESS(f"{len(likes)} likes created"))
+        hot_count = round(len(collects) * options["hot_collects"])
+        # Ненулевая доля сборов дает хотя бы один горячий сбор
+        if options["hot_collects"] > 0 and options["hot_share"] > 0:
+            hot_count = min(len(collects), max(1, hot_count))
+        return {"all": collects, "hot": rng.sample(collects, hot_count)}
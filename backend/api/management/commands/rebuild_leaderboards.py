@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from api.leaderboard import rebuild_leaderboard, rebuild_leaderboards
+
+
+class Command(BaseCommand):
+    """Пересчет рейтингов участников сборов в Redis по таблице платежей."""
+
+    help = "Пересчитывает рейтинги участников сборов по платежам"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--collect",
+            type=int,
+            default=None,
+            help="Пересчитать рейтинг только этого сбора",
+        )
+
+    def handle(self, *args, **options):
+        if options["collect"] is not None:
+            rebuild_leaderboard(options["collect"])
+            rebuilt = 1
+        else:
+            rebuilt = rebuild_leaderboards()
+        self.stdout.write(
+            self.style.SUCCESS(f"Leaderboards rebuilt: {rebuilt}")
+        )
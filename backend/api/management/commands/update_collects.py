@@ -1,21 +1,229 @@
 from django.core.management.base import BaseCommand
-from django.db.models import Sum
-from api.models import Collect
+from django.db import models
+from django.db.models import (
+    Count,
+    ExpressionWrapper,
+    F,
+    Max,
+    Min,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from api.cache import invalidate_collect_caches
+from api.models import Collect, Comment, Like, Payment
+from proninteam.constants import UPDATE_COLLECTS_CHUNK_SIZE
+
+
+def actual_totals():
+    """Подзапросы фактической суммы и количества платежей сбора."""
+    payments = (
+        Payment.objects.filter(collect=OuterRef("pk"))
+        .order_by()
+        .values("collect")
+    )
+    amount = Coalesce(
+        Subquery(payments.annotate(total=Sum("amount")).values("total")),
+        Value(0),
+        output_field=models.DecimalField(),
+    )
+    count = Coalesce(
+        Subquery(payments.annotate(count=Count("id")).values("count")),
+        Value(0),
+    )
+    return amount, count
+
+
+def actual_counter(model):
+    """Подзапрос фактического числа лайков или комментариев платежа."""
+    return Coalesce(
+        Subquery(
+            model.objects.filter(payment=OuterRef("pk"))
+            .order_by()
+            .values("payment")
+            .annotate(count=Count("id"))
+            .values("count")
+        ),
+        Value(0),
+    )
+
+
+def actual_is_active(amount, now):
+    """
+    Сбор открыт до даты завершения, пока не собрана общая сумма.
+    Команда только закрывает сборы: сбор, остановленный автором,
+    не открывается снова.
+    """
+    return Q(is_active=True, stop_date__gt=now) & (
+        Q(total_amount=0) | Q(total_amount__gt=amount)
+    )
 
 
 class Command(BaseCommand):
-    """Обновление поля is_active для всех сборов после заполнения БД."""
+    """
+    Пересчет итогов и поля is_active сборов по платежам, а также
+    счетчиков лайков и комментариев платежей (они расходятся после
+    удаления лайков и комментариев в админке или вместе с автором).
+    Сборы и платежи обрабатываются диапазонами id: одним SELECT
+    выбираются записи с расхождениями, одним UPDATE по подзапросам
+    они исправляются.
+    """
+
+    help = (
+        "Обновляет итоги и is_active для всех Collect и счетчики лайков "
+        "и комментариев Payment"
+    )
 
-    help = "Обновляет is_active для всех Collect"
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Только вывести расхождения, ничего не изменяя",
+        )
+        parser.add_argument(
+            "--totals-only",
+            action="store_true",
+            help=(
+                "Исправлять только итоги сборов и счетчики платежей, "
+                "не закрывая сборы (без флага исправляется и is_active)"
+            ),
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=UPDATE_COLLECTS_CHUNK_SIZE,
+            help="Количество id сборов или платежей в одном UPDATE",
+        )
 
     def handle(self, *args, **options):
-        collects = Collect.objects.all()
-        for collect in collects:
-            total_payments = (
-                collect.payments.aggregate(total=Sum("amount"))["total"] or 0
+        now = timezone.now()
+        totals_only = options["totals_only"]
+        chunk_size = options["chunk_size"]
+        amount, count = actual_totals()
+        collects = Collect.objects.annotate(
+            actual_amount=amount,
+            actual_count=count,
+            actual_active=ExpressionWrapper(
+                actual_is_active(F("actual_amount"), now),
+                output_field=models.BooleanField(),
+            ),
+        )
+        drift = ~Q(collected_amount=F("actual_amount")) | ~Q(
+            payments_count=F("actual_count")
+        )
+        if not totals_only:
+            drift |= ~Q(is_active=F("actual_active"))
+        values = {"collected_amount": amount, "payments_count": count}
+        if not totals_only:
+            values["is_active"] = ExpressionWrapper(
+                actual_is_active(amount, now),
+                output_field=models.BooleanField(),
+            )
+
+        bounds = Collect.objects.aggregate(low=Min("id"), high=Max("id"))
+        changed = 0
+        if bounds["low"] is not None:
+            for low in range(bounds["low"], bounds["high"] + 1, chunk_size):
+                rows = list(
+                    collects.filter(
+                        drift, id__gte=low, id__lt=low + chunk_size
+                    ).values_list(
+                        "id",
+                        "collected_amount",
+                        "actual_amount",
+                        "payments_count",
+                        "actual_count",
+                        "is_active",
+                        "actual_active",
+                    )
+                )
+                if not rows:
+                    continue
+                changed += len(rows)
+                if options["dry_run"]:
+                    for row in rows:
+                        self.write_diff(row, totals_only)
+                    continue
+                collect_ids = [row[0] for row in rows]
+                Collect.objects.filter(id__in=collect_ids).update(**values)
+                invalidate_collect_caches(collect_ids)
+
+        if options["dry_run"]:
+            self.stdout.write(f"Collects with drift: {changed}")
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(f"Collects updated: {changed}")
             )
-            collect.is_active = total_payments < collect.total_amount
-            collect.save(update_fields=["is_active"])
-        self.stdout.write(
-            self.style.SUCCESS("All collects updated successfully.")
+        self.update_payment_counters(chunk_size, options["dry_run"])
+
+    def update_payment_counters(self, chunk_size, dry_run):
+        """Исправить like_count и comment_count платежей."""
+        likes, comments = actual_counter(Like), actual_counter(Comment)
+        payments = Payment.objects.annotate(
+            actual_likes=likes, actual_comments=comments
+        ).filter(
+            ~Q(like_count=F("actual_likes"))
+            | ~Q(comment_count=F("actual_comments"))
         )
+        bounds = Payment.objects.aggregate(low=Min("id"), high=Max("id"))
+        changed = 0
+        if bounds["low"] is not None:
+            for low in range(bounds["low"], bounds["high"] + 1, chunk_size):
+                rows = list(
+                    payments.filter(
+                        id__gte=low, id__lt=low + chunk_size
+                    ).values_list(
+                        "id",
+                        "collect_id",
+                        "like_count",
+                        "actual_likes",
+                        "comment_count",
+                        "actual_comments",
+                    )
+                )
+                if not rows:
+                    continue
+                changed += len(rows)
+                if dry_run:
+                    for payment_id, _, *pairs in rows:
+                        self.write_counters_diff(payment_id, pairs)
+                    continue
+                Payment.objects.filter(id__in=[row[0] for row in rows]).update(
+                    like_count=likes, comment_count=comments
+                )
+                invalidate_collect_caches({row[1] for row in rows})
+
+        if dry_run:
+            self.stdout.write(f"Payments with drift: {changed}")
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(f"Payments updated: {changed}")
+            )
+
+    def write_counters_diff(self, payment_id, pairs):
+        changes = [
+            f"{name} {stored} -> {actual}"
+            for name, stored, actual in zip(
+                ("like_count", "comment_count"), pairs[::2], pairs[1::2]
+            )
+            if stored != actual
+        ]
+        self.stdout.write(f"payment {payment_id}: {', '.join(changes)}")
+
+    def write_diff(self, row, totals_only):
+        """Вывести расхождение сохраненных значений сбора с фактическими."""
+        collect_id, *pairs = row
+        names = ("collected_amount", "payments_count", "is_active")
+        if totals_only:
+            names = names[:2]
+        changes = [
+            f"{name} {stored} -> {actual}"
+            for name, stored, actual in zip(names, pairs[::2], pairs[1::2])
+            if stored != actual
+        ]
+        self.stdout.write(f"collect {collect_id}: {', '.join(changes)}")
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from api.profiling import get_view_stats, reset_view_stats
+
+
+class Command(BaseCommand):
+    """Средние замеры запросов по представлениям."""
+
+    help = "Выводит среднее время, число SQL-запросов и время кэша по view"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Обнулить замеры после вывода",
+        )
+
+    def handle(self, *args, **options):
+        for name, stats in get_view_stats().items():
+            requests = stats["requests"]
+            self.stdout.write(
+                f"{name}: {requests} requests, "
+                f"total {stats['total_us'] / requests / 1000:.1f} ms, "
+                f"{stats['queries'] / requests:.1f} queries "
+                f"({stats['sql_us'] / requests / 1000:.1f} ms), "
+                f"cache {stats['cache_us'] / requests / 1000:.1f} ms, "
+                f"serializer {stats['serializer_us'] / requests / 1000:.1f} ms"
+            )
+        if options["reset"]:
+            reset_view_stats()
+            self.stdout.write(self.style.SUCCESS("Stats reset."))
@@ -0,0 +1,201 @@
+import hmac
+from ipaddress import ip_address, ip_network
+
+import redis
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from api.cache import get_collect_cache_stats
+from proninteam.constants import EMAIL_LATENCY_BUCKETS, LATENCY_BUCKETS
+
+# Клиенты Redis брокеров Celery по URL
+broker_clients = {}
+
+# Метрики: имя -> (тип, описание, границы бакетов гистограммы)
+METRICS = {
+    "http_request_duration_seconds": (
+        "histogram",
+        "Request latency per view action",
+        LATENCY_BUCKETS,
+    ),
+    "payment_admission_duration_seconds": (
+        "histogram",
+        "Payment admission latency",
+        LATENCY_BUCKETS,
+    ),
+    "payment_rejections_total": (
+        "counter",
+        "Rejected payments per reason",
+        None,
+    ),
+    "celery_task_duration_seconds": (
+        "histogram",
+        "Celery task run time",
+        LATENCY_BUCKETS,
+    ),
+    "db_queries_total": (
+        "counter",
+        "SQL queries per database alias",
+        None,
+    ),
+    "db_connections_created_total": (
+        "counter",
+        "New database connections opened per alias",
+        None,
+    ),
+    "db_primary_pins_total": (
+        "counter",
+        "Writes that pinned the user's reads to the primary database",
+        None,
+    ),
+    "collects_closed_total": (
+        "counter",
+        "Collects closed by close_expired_collects after their stop date",
+        None,
+    ),
+    "email_delivery_latency_seconds": (
+        "histogram",
+        "Time from queueing a notification email to sending it",
+        EMAIL_LATENCY_BUCKETS,
+    ),
+}
+
+
+def metric_key(name):
+    return f"metrics:{name}"
+
+
+def format_labels(labels):
+    return ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value)
+            .replace("\\", "\\\\")
+            .replace('"', '\\"')
+            .replace("\n", "\\n"),
+        )
+        for name, value in sorted(labels.items())
+    )
+
+
+def inc(name, labels, amount=1, pipeline=None):
+    """Увеличить счетчик с набором меток."""
+    if pipeline is None:
+        pipeline = get_redis_connection("default")
+    pipeline.hincrby(metric_key(name), format_labels(labels), amount)
+
+
+def observe(name, labels, values, pipeline=None):
+    """
+    Добавить значения в гистограмму с набором меток.
+    В Redis хранится число значений в каждом бакете, сумма
+    и количество, накопленные значения бакетов считаются при выводе.
+    """
+    buckets = METRICS[name][2]
+    key = metric_key(name)
+    series = format_labels(labels)
+    client = pipeline
+    if client is None:
+        client = get_redis_connection("default").pipeline(transaction=False)
+    for value in values:
+        bucket = next((le for le in buckets if value <= le), "+Inf")
+        client.hincrby(key, f"{series}|{bucket}", 1)
+        client.hincrbyfloat(key, f"{series}|sum", value)
+        client.hincrby(key, f"{series}|count", 1)
+    if pipeline is None:
+        client.execute()
+
+
+def render_histogram(name, buckets, values):
+    series = {}
+    for field, value in values.items():
+        labels, _, part = field.decode().rpartition("|")
+        series.setdefault(labels, {})[part] = float(value)
+    lines = []
+    for labels, parts in sorted(series.items()):
+        prefix = f"{labels}," if labels else ""
+        cumulative = 0
+        for le in (*buckets, "+Inf"):
+            cumulative += parts.get(str(le), 0)
+            lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {cumulative:g}')
+        lines.append(f"{name}_sum{{{labels}}} {parts.get('sum', 0)}")
+        lines.append(f"{name}_count{{{labels}}} {parts.get('count', 0):g}")
+    return lines
+
+
+def get_broker_client(url):
+    """
+    Клиент Redis брокера Celery, один на процесс: клиент на каждый
+    сбор метрик открывал бы новое соединение.
+    """
+    client = broker_clients.get(url)
+    if client is None:
+        client = broker_clients.setdefault(url, redis.Redis.from_url(url))
+    return client
+
+
+def queue_length(url, queue):
+    """Длина очереди брокера Celery (только Redis)."""
+    if not url or not url.startswith("redis"):
+        return None
+    return get_broker_client(url).llen(queue)
+
+
+def render_metrics():
+    """Все метрики в текстовом формате Prometheus."""
+    # api.tasks сам использует этот модуль
+    from api.tasks import EMAIL_QUEUE_KEY
+
+    client = get_redis_connection("default")
+    pipeline = client.pipeline(transaction=False)
+    for name in METRICS:
+        pipeline.hgetall(metric_key(name))
+    lines = []
+    for (name, (kind, help_text, buckets)), values in zip(
+        METRICS.items(), pipeline.execute()
+    ):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        if kind == "histogram":
+            lines += render_histogram(name, buckets, values)
+        else:
+            lines += [
+                f"{name}{{{labels.decode()}}} {int(value)}"
+                for labels, value in sorted(values.items())
+            ]
+
+    stats = get_collect_cache_stats()
+    gauges = [
+        ("collect_cache_hits_total", "counter", stats["hits"]),
+        ("collect_cache_misses_total", "counter", stats["misses"]),
+        ("collect_cache_hit_ratio", "gauge", stats["hit_ratio"]),
+        ("email_queue_length", "gauge", client.llen(EMAIL_QUEUE_KEY)),
+        (
+            "celery_queue_length",
+            "gauge",
+            queue_length(settings.CELERY_BROKER_URL, "celery"),
+        ),
+    ]
+    for name, kind, value in gauges:
+        if value is not None:
+            lines += [f"# TYPE {name} {kind}", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+def metrics_allowed(request):
+    """
+    Доступ к метрикам: адрес клиента из settings.METRICS_ALLOWED_IPS
+    или токен settings.METRICS_TOKEN в заголовке Authorization.
+    """
+    if settings.METRICS_TOKEN and hmac.compare_digest(
+        request.headers.get("Authorization", "").encode(),
+        f"Bearer {settings.METRICS_TOKEN}".encode(),
+    ):
+        return True
+    try:
+        address = ip_address(request.META.get("REMOTE_ADDR", ""))
+    except ValueError:
+        return False
+    return any(
+        address in ip_network(network.strip(), strict=False)
+        for network in settings.METRICS_ALLOWED_IPS
+    )
@@ -0,0 +1,191 @@
+import json
+import logging
+
+from asgiref.sync import (
+    iscoroutinefunction,
+    markcoroutinefunction,
+    sync_to_async,
+)
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from rest_framework.permissions import SAFE_METHODS
+
+from api.cache import get_async_redis
+from api.db_routers import (
+    RequestDatabaseState,
+    current_db_state,
+    get_request_user,
+    pin_primary,
+)
+from api.metrics import inc, observe
+from api.profiling import RequestProfile, current_profile, record_view_stats
+
+logger = logging.getLogger("api.performance")
+
+
+class PerformanceMiddleware:
+    """
+    Профилирование запросов.
+    Для каждого запроса считаются SQL-запросы и их время, обращения
+    к кэшу, время сериализации (serializer_data) и общее время.
+    Замеры пишутся в лог одной JSON-строкой и суммируются
+    по представлениям (команда view_stats), время запроса добавляется
+    в гистограмму метрик. Заголовок Server-Timing получают только
+    сотрудники (is_staff) или все клиенты при SERVER_TIMING_ENABLED.
+    Недоступность Redis не ломает ответ: замеры теряются.
+    Работает и под WSGI, и под ASGI (без перехода в поток).
+    Должен стоять первым в MIDDLEWARE.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        pipeline = get_redis_connection("default").pipeline(transaction=False)
+        self.process_profile(request, response, profile, pipeline)
+        try:
+            pipeline.execute()
+        except RedisError:
+            logger.exception("Request profile was not saved")
+        return response
+
+    async def __acall__(self, request):
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        pipeline = get_async_redis().pipeline(transaction=False)
+        self.process_profile(request, response, profile, pipeline)
+        try:
+            await pipeline.execute()
+        except RedisError:
+            logger.exception("Request profile was not saved")
+        return response
+
+    def process_profile(self, request, response, profile, pipeline):
+        """
+        Заголовок Server-Timing, запись в лог и команды сохранения
+        замеров в конвейере Redis (выполняет вызывающий код).
+        """
+        profile.finish()
+        name = f"{request.method} {self.get_view_name(request)}"
+        if self.server_timing_allowed(request):
+            response["Server-Timing"] = profile.server_timing()
+        logger.info(
+            json.dumps(
+                {
+                    "view": name,
+                    "path": request.path,
+                    "status": response.status_code,
+                    **profile.as_dict(),
+                }
+            )
+        )
+        record_view_stats(name, profile, pipeline)
+        observe(
+            "http_request_duration_seconds",
+            {
+                "view": self.get_view_name(request),
+                "action": self.get_action(request),
+                "method": request.method,
+            },
+            [profile.total],
+            pipeline,
+        )
+        for alias, count in profile.alias_queries.items():
+            inc("db_queries_total", {"alias": alias}, count, pipeline)
+        for alias, count in profile.connections_created.items():
+            inc(
+                "db_connections_created_total",
+                {"alias": alias},
+                count,
+                pipeline,
+            )
+
+    def server_timing_allowed(self, request):
+        if settings.SERVER_TIMING_ENABLED:
+            return True
+        user = get_request_user(request)
+        return user is not None and user.is_staff
+
+    def get_view_name(self, request):
+        match = request.resolver_match
+        if match is None:
+            return "unresolved"
+        return match.view_name
+
+    def get_action(self, request):
+        """Действие вьюсета DRF (list, retrieve, create...) для метода."""
+        match = request.resolver_match
+        actions = getattr(match.func, "actions", None) if match else None
+        if not actions:
+            return ""
+        return actions.get(request.method.lower(), "")
+
+
+class DatabaseRoutingMiddleware:
+    """
+    Состояние выбора БД для ReplicaRouter на время запроса.
+    После успешного изменяющего запроса пользователь читает
+    с основной БД DATABASE_PRIMARY_STICKY_TIMEOUT секунд,
+    чтобы не увидеть устаревшие итоги с реплики.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = current_db_state.set(RequestDatabaseState(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            current_db_state.reset(token)
+        user_id = self.get_pinned_user_id(request, response)
+        if user_id is not None:
+            pin_primary(user_id)
+        return response
+
+    async def __acall__(self, request):
+        token = current_db_state.set(RequestDatabaseState(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_db_state.reset(token)
+        user_id = self.get_pinned_user_id(request, response)
+        if user_id is not None:
+            await sync_to_async(pin_primary)(user_id)
+        return response
+
+    def get_pinned_user_id(self, request, response):
+        """Пользователь, чьи чтения нужно закрепить за основной БД."""
+        if not settings.DATABASE_REPLICAS:
+            return None
+        if request.method in SAFE_METHODS or response.status_code >= 400:
+            return None
+        user = get_request_user(request)
+        if user is None or not user.is_authenticated:
+            return None
+        return user.pk
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0003_alter_collect_logo"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="payment",
+            options={
+                "default_related_name": "payments",
+                "verbose_name": "Платеж",
+                "verbose_name_plural": "Платежи",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                fields=["collect", "-created_at", "-id"],
+                name="payment_collect_feed_idx",
+            ),
+        ),
+    ]
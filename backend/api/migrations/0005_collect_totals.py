@@ -0,0 +1,56 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:40
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_totals(apps, schema_editor):
+    """Заполнить итоги сборов одним UPDATE по подзапросам к платежам."""
+    Collect = apps.get_model("api", "Collect")
+    Payment = apps.get_model("api", "Payment")
+    payments = (
+        Payment.objects.filter(collect=OuterRef("pk"))
+        .order_by()
+        .values("collect")
+    )
+    Collect.objects.update(
+        collected_amount=Coalesce(
+            Subquery(payments.annotate(total=Sum("amount")).values("total")),
+            Value(0),
+            output_field=models.DecimalField(),
+        ),
+        payments_count=Coalesce(
+            Subquery(payments.annotate(count=Count("id")).values("count")),
+            Value(0),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0004_payment_feed_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="collect",
+            name="collected_amount",
+            field=models.DecimalField(
+                decimal_places=0,
+                default=0,
+                editable=False,
+                max_digits=12,
+                verbose_name="Собранная сумма",
+            ),
+        ),
+        migrations.AddField(
+            model_name="collect",
+            name="payments_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="Количество платежей"
+            ),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
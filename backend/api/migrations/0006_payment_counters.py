@@ -0,0 +1,55 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:41
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    """Заполнить счетчики лайков и комментариев платежей одним UPDATE."""
+    Payment = apps.get_model("api", "Payment")
+    Like = apps.get_model("api", "Like")
+    Comment = apps.get_model("api", "Comment")
+
+    def count_of(model):
+        return Coalesce(
+            Subquery(
+                model.objects.filter(payment=OuterRef("pk"))
+                .order_by()
+                .values("payment")
+                .annotate(count=Count("id"))
+                .values("count")
+            ),
+            Value(0),
+        )
+
+    Payment.objects.update(
+        like_count=count_of(Like), comment_count=count_of(Comment)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0005_collect_totals"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="comment_count",
+            field=models.PositiveIntegerField(
+                default=0,
+                editable=False,
+                verbose_name="Количество комментариев",
+            ),
+        ),
+        migrations.AddField(
+            model_name="payment",
+            name="like_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="Количество лайков"
+            ),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0006_payment_counters"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="collect",
+            index=models.Index(
+                fields=["stop_date", "id"], name="collect_stop_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="collect",
+            index=models.Index(
+                condition=models.Q(("is_active", True)),
+                fields=["stop_date", "id"],
+                name="collect_active_stop_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="collect",
+            index=models.Index(
+                fields=["author", "stop_date", "id"],
+                name="collect_author_stop_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="collect",
+            index=models.Index(
+                fields=["event_reason", "event_format", "stop_date", "id"],
+                name="collect_event_stop_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="collect",
+            index=models.Index(
+                fields=["event_date"], name="collect_event_date_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0007_collect_list_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="collect",
+            name="logo_variants",
+            field=models.JSONField(
+                default=dict,
+                editable=False,
+                verbose_name="Уменьшенные копии обложки",
+            ),
+        ),
+    ]
@@ -5,6 +5,7 @@ from django.core.validators import MinValueValidator
 from proninteam.constants import (
     NAME_MAX_LENGTH,
     MAX_DIGITS,
+    TOTAL_MAX_DIGITS,
     DECIMAL_PLACES,
     FORMAT,
     REASON,
@@ -23,6 +24,10 @@ class Collect(models.Model):
     достижения даты окончания сбора или если автор сбора
     самостоятельно деактивирует сбор.
     Возможна повторная активация сбора автором.
+    Поля collected_amount и payments_count хранят текущие итоги сбора,
+    они обновляются при создании и удалении платежей.
+    Поле logo_variants хранит уменьшенные копии обложки в WebP и JPEG,
+    их создает задача generate_logo_variants.
     """
 
     # --- Описание сбора
@@ -48,6 +53,11 @@ class Collect(models.Model):
         blank=True,
         null=True,
     )
+    logo_variants = models.JSONField(
+        default=dict,
+        editable=False,
+        verbose_name="Уменьшенные копии обложки",
+    )
     created_at = models.DateTimeField(
         auto_now_add=True,
         verbose_name="Дата и время создания сбора",
@@ -100,6 +110,18 @@ class Collect(models.Model):
         decimal_places=DECIMAL_PLACES,
         validators=[MinValueValidator(0)],
     )
+    collected_amount = models.DecimalField(
+        default=0,
+        verbose_name="Собранная сумма",
+        max_digits=TOTAL_MAX_DIGITS,
+        decimal_places=DECIMAL_PLACES,
+        editable=False,
+    )
+    payments_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Количество платежей",
+        editable=False,
+    )
 
     def __str__(self):
         return f"{self.author}: {self.name}"
@@ -108,6 +130,31 @@ class Collect(models.Model):
         default_related_name = "collects"
         verbose_name = "Сбор"
         verbose_name_plural = "Сборы"
+        # Индексы повторяют сортировку списка сборов (stop_date, id),
+        # чтобы фильтрация и пагинация не требовали сортировки таблицы
+        indexes = [
+            models.Index(
+                fields=("stop_date", "id"),
+                name="collect_stop_date_idx",
+            ),
+            models.Index(
+                fields=("stop_date", "id"),
+                condition=models.Q(is_active=True),
+                name="collect_active_stop_date_idx",
+            ),
+            models.Index(
+                fields=("author", "stop_date", "id"),
+                name="collect_author_stop_date_idx",
+            ),
+            models.Index(
+                fields=("event_reason", "event_format", "stop_date", "id"),
+                name="collect_event_stop_date_idx",
+            ),
+            models.Index(
+                fields=("event_date",),
+                name="collect_event_date_idx",
+            ),
+        ]
 
 
 class Payment(models.Model):
@@ -117,6 +164,8 @@ class Payment(models.Model):
     платежа, по умолчанию сумма не скрывается.
     Дополнительно предусмотрена возможность пользователю
     оставить комментарий при платеже.
+    Поля like_count и comment_count хранят количество лайков
+    и комментариев платежа.
     """
 
     author = models.ForeignKey(
@@ -140,6 +189,16 @@ class Payment(models.Model):
     created_at = models.DateTimeField(
         auto_now_add=True, verbose_name="Дата и время платежа"
     )
+    like_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Количество лайков",
+        editable=False,
+    )
+    comment_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Количество комментариев",
+        editable=False,
+    )
 
     def __str__(self):
         return f"{self.author.username}"
@@ -148,6 +207,12 @@ class Payment(models.Model):
         default_related_name = "payments"
         verbose_name = "Платеж"
         verbose_name_plural = "Платежи"
+        indexes = [
+            models.Index(
+                fields=("collect", "-created_at", "-id"),
+                name="payment_collect_feed_idx",
+            )
+        ]
 
 
 class Like(models.Model):
@@ -0,0 +1,141 @@
+from base64 import b64decode, b64encode
+from urllib import parse
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from proninteam.constants import COLLECTS_PAGE_SIZE, PAYMENTS_PAGE_SIZE
+
+
+class KeysetPagination(BasePagination):
+    """
+    Пагинация по ключу (keyset) для длинных лент.
+    Вместо OFFSET следующая страница выбирается условием по набору
+    полей сортировки, поэтому стоимость запроса не зависит от номера
+    страницы. Последнее поле сортировки должно быть уникальным,
+    все поля сортируются в одном направлении.
+    """
+
+    page_size = PAYMENTS_PAGE_SIZE
+    ordering = ("-created_at", "-id")
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Некорректный курсор"
+
+    def get_page(self, queryset, position=None):
+        """
+        Вернуть страницу объектов и позицию для следующей страницы.
+        Запрашивается на один объект больше, чтобы без COUNT понять,
+        есть ли следующая страница.
+        """
+        queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            queryset = queryset.filter(self.get_keyset_filter(position))
+        page = list(queryset[: self.page_size + 1])
+        if len(page) <= self.page_size:
+            return page, None
+        page = page[: self.page_size]
+        return page, self.get_position(page[-1])
+
+    def get_keyset_filter(self, position):
+        """
+        Условие следующей страницы - сравнение строк полей сортировки,
+        развернутое в условия OR, например для (created_at, id) <
+        (c, i): created_at < c OR (created_at = c AND id < i).
+        PostgreSQL выбирает его диапазоном по составному индексу
+        этих полей.
+        """
+        lookup = "lt" if self.ordering[0].startswith("-") else "gt"
+        fields = [field.lstrip("-") for field in self.ordering]
+        condition = Q()
+        for index, field in enumerate(fields):
+            condition |= Q(
+                **dict(zip(fields[:index], position[:index])),
+                **{f"{field}__{lookup}": position[index]},
+            )
+        return condition
+
+    def get_position(self, instance):
+        return tuple(
+            getattr(instance, field.lstrip("-")) for field in self.ordering
+        )
+
+    def encode_cursor(self, position):
+        querystring = parse.urlencode(
+            {
+                field.lstrip("-"): (
+                    value.isoformat() if hasattr(value, "isoformat") else value
+                )
+                for field, value in zip(self.ordering, position)
+            }
+        )
+        return b64encode(querystring.encode("ascii")).decode("ascii")
+
+    def decode_cursor(self, cursor, model):
+        try:
+            querystring = b64decode(cursor.encode("ascii")).decode("ascii")
+            tokens = parse.parse_qs(querystring, keep_blank_values=True)
+            position = []
+            for field in self.ordering:
+                name = field.lstrip("-")
+                position.append(
+                    model._meta.get_field(name).to_python(tokens[name][0])
+                )
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+        return tuple(position)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        cursor = request.query_params.get(self.cursor_query_param)
+        position = (
+            self.decode_cursor(cursor, queryset.model) if cursor else None
+        )
+        page, self.next_position = self.get_page(queryset, position)
+        return page
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.next_position),
+        )
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Курсор следующей страницы",
+                "schema": {"type": "string"},
+            }
+        ]
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+
+class PaymentPagination(KeysetPagination):
+    """Лента платежей сбора: новые платежи первыми."""
+
+
+class CollectPagination(KeysetPagination):
+    """Список сборов: первыми сборы, которые раньше завершаются."""
+
+    page_size = COLLECTS_PAGE_SIZE
+    ordering = ("stop_date", "id")
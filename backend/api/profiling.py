@@ -0,0 +1,213 @@
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from django_redis import get_redis_connection
+from django_redis.client import DefaultClient
+
+current_profile = ContextVar("current_profile", default=None)
+
+VIEW_STATS_KEY = "view_stats"
+
+MISSING = object()
+
+
+class RequestProfile:
+    """
+    Замеры одного запроса: SQL-запросы, обращения к кэшу,
+    время сериализации и общее время.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total = 0
+        self.queries = 0
+        self.sql_time = 0
+        self.statements = Counter()
+        self.alias_queries = Counter()
+        self.connections_created = Counter()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_bytes = 0
+        self.cache_time = 0
+        self.serializer_time = 0
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+
+    def record_query(self, sql, duration, alias):
+        self.queries += 1
+        self.sql_time += duration
+        self.statements[sql] += 1
+        self.alias_queries[alias] += 1
+
+    @property
+    def duplicate_queries(self):
+        """Наибольшее число повторов одного SQL (признак N+1)."""
+        return max(self.statements.values(), default=0)
+
+    def server_timing(self):
+        return ", ".join(
+            (
+                f'db;dur={self.sql_time * 1000:.1f};desc="{self.queries} '
+                f'queries, {self.duplicate_queries} max duplicates"',
+                f'cache;dur={self.cache_time * 1000:.1f};desc="'
+                f"{self.cache_hits} hits, {self.cache_misses} misses, "
+                f'{self.cache_bytes} B"',
+                f"serializer;dur={self.serializer_time * 1000:.1f}",
+                f"total;dur={self.total * 1000:.1f}",
+            )
+        )
+
+    def as_dict(self):
+        return {
+            "total_ms": round(self.total * 1000, 2),
+            "queries": self.queries,
+            "sql_ms": round(self.sql_time * 1000, 2),
+            "duplicate_queries": self.duplicate_queries,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "cache_bytes": self.cache_bytes,
+            "cache_ms": round(self.cache_time * 1000, 2),
+            "serializer_ms": round(self.serializer_time * 1000, 2),
+        }
+
+
+def record_queries(execute, sql, params, many, context):
+    """Обертка выполнения SQL (connection.execute_wrapper)."""
+    profile = current_profile.get()
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if profile is not None:
+            profile.record_query(
+                sql, time.perf_counter() - start, context["connection"].alias
+            )
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """
+    Подключить record_queries к новому соединению (connection_created)
+    и учесть соединение в профиле запроса.
+    Обертка стоит на соединении постоянно, а не на время запроса:
+    под ASGI запросы к БД выполняются в потоке sync_to_async
+    со своим соединением, профиль доходит до него через contextvars.
+    """
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
+    profile = current_profile.get()
+    if profile is not None:
+        profile.connections_created[connection.alias] += 1
+
+
+class ProfilingRedisClient(DefaultClient):
+    """
+    Клиент django_redis, учитывающий в профиле запроса попадания,
+    промахи, время обращений и объем прочитанных и записанных данных.
+    """
+
+    def timed(self, method, *args, **kwargs):
+        profile = current_profile.get()
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            if profile is not None:
+                profile.cache_time += time.perf_counter() - start
+
+    def get(self, key, default=None, *args, **kwargs):
+        value = self.timed(super().get, key, MISSING, *args, **kwargs)
+        profile = current_profile.get()
+        if profile is not None:
+            if value is MISSING:
+                profile.cache_misses += 1
+            else:
+                profile.cache_hits += 1
+        return default if value is MISSING else value
+
+    def get_many(self, keys, *args, **kwargs):
+        keys = list(keys)
+        values = self.timed(super().get_many, keys, *args, **kwargs)
+        profile = current_profile.get()
+        if profile is not None:
+            profile.cache_hits += len(values)
+            profile.cache_misses += len(keys) - len(values)
+        return values
+
+    def set(self, *args, **kwargs):
+        return self.timed(super().set, *args, **kwargs)
+
+    def incr(self, *args, **kwargs):
+        return self.timed(super().incr, *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self.timed(super().delete, *args, **kwargs)
+
+    def delete_many(self, *args, **kwargs):
+        return self.timed(super().delete_many, *args, **kwargs)
+
+    def encode(self, value):
+        encoded = super().encode(value)
+        profile = current_profile.get()
+        if profile is not None and isinstance(encoded, bytes):
+            profile.cache_bytes += len(encoded)
+        return encoded
+
+    def decode(self, value):
+        profile = current_profile.get()
+        if profile is not None and isinstance(value, bytes):
+            profile.cache_bytes += len(value)
+        return super().decode(value)
+
+
+def serializer_data(serializer):
+    """
+    Данные сериализатора (serializer.data) с учетом времени
+    сериализации в профиле запроса. Вызывается в представлениях.
+    """
+    profile = current_profile.get()
+    start = time.perf_counter()
+    try:
+        return serializer.data
+    finally:
+        if profile is not None:
+            profile.serializer_time += time.perf_counter() - start
+
+
+def view_stats_key(name):
+    return f"view_stats:{name}"
+
+
+def record_view_stats(name, profile, pipeline):
+    """
+    Добавить замеры запроса к суммам по представлению в Redis,
+    чтобы они складывались по всем процессам.
+    """
+    key = view_stats_key(name)
+    pipeline.sadd(VIEW_STATS_KEY, name)
+    pipeline.hincrby(key, "requests", 1)
+    pipeline.hincrby(key, "queries", profile.queries)
+    pipeline.hincrby(key, "total_us", int(profile.total * 1e6))
+    pipeline.hincrby(key, "sql_us", int(profile.sql_time * 1e6))
+    pipeline.hincrby(key, "cache_us", int(profile.cache_time * 1e6))
+    pipeline.hincrby(key, "serializer_us", int(profile.serializer_time * 1e6))
+
+
+def get_view_stats():
+    """Суммы замеров по представлениям: {имя: {поле: значение}}."""
+    redis = get_redis_connection("default")
+    names = sorted(name.decode() for name in redis.smembers(VIEW_STATS_KEY))
+    pipeline = redis.pipeline(transaction=False)
+    for name in names:
+        pipeline.hgetall(view_stats_key(name))
+    return {
+        name: {field.decode(): int(value) for field, value in stats.items()}
+        for name, stats in zip(names, pipeline.execute())
+    }
+
+
+def reset_view_stats():
+    redis = get_redis_connection("default")
+    names = [name.decode() for name in redis.smembers(VIEW_STATS_KEY)]
+    redis.delete(VIEW_STATS_KEY, *(view_stats_key(name) for name in names))
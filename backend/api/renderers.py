@@ -0,0 +1,36 @@
+import orjson
+from django.utils.http import parse_header_parameters
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# Типы, которые orjson не сериализует сам (Decimal, ленивые строки,
+# QuerySet), и даты приводятся к тому же виду, что в JSONRenderer DRF
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+def render_json(data, indent=False):
+    """Данные ответа в байты JSON через orjson."""
+    options = ORJSON_OPTIONS
+    if indent:
+        options |= orjson.OPT_INDENT_2
+    return orjson.dumps(data, default=JSONEncoder().default, option=options)
+
+
+class ORJSONRenderer(BaseRenderer):
+    """
+    Рендерер JSON на orjson, совместимый по выводу с JSONRenderer DRF.
+    Отступ (параметр indent в Accept) поддерживается только в 2 пробела.
+    """
+
+    media_type = "application/json"
+    format = "json"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        indent = False
+        if accepted_media_type:
+            _, params = parse_header_parameters(accepted_media_type)
+            indent = params.get("indent", "0") != "0"
+        return render_json(data, indent)
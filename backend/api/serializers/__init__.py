@@ -5,18 +5,23 @@ from api.serializers.comment import (
 )
 
 # Модель Like
-from api.serializers.like import LikeSerializer
+from api.serializers.like import LikeSerializer, LikeToggleSerializer
 
 # Модель Payment
 from api.serializers.payment import (
+    LeaderboardEntrySerializer,
     PaymentCreateSerializer,
+    PaymentBulkCreateSerializer,
+    PaymentEventSerializer,
     PaymentShowSerializer,
 )
 
 # Модель Collect
 from api.serializers.collect import (
     CollectShowSerializer,
+    CollectListSerializer,
     CollectCreateSerializer,
+    CollectLogoSerializer,
     CollectReactivateSerializer,
     CollectChangeSerializer,
     CollectDeactivateSerializer,
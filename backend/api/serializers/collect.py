@@ -1,30 +1,81 @@
 import base64
+import binascii
+import tempfile
 import uuid
+from urllib.parse import urljoin
 
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 from rest_framework.serializers import ValidationError
+from rest_framework.utils.urls import replace_query_param
+from django.conf import settings
 from django.utils import timezone
-from django.core.files.base import ContentFile
+from django.core.files import File
 from django.core.validators import MinValueValidator
 
-from api.models import Payment, Collect
+from django.db.models import Prefetch
+
+from api.models import Payment, Collect, Comment
+from api.pagination import PaymentPagination
 from api.serializers import PaymentShowSerializer
-from proninteam.constants import MAX_DIGITS, DECIMAL_PLACES
+from proninteam.constants import (
+    DECIMAL_PLACES,
+    LOGO_BASE64_CHUNK_SIZE,
+    LOGO_DETAIL_WIDTH,
+    LOGO_LIST_WIDTH,
+    LOGO_MAX_SIZE,
+    LOGO_WIDTHS,
+    MAX_DIGITS,
+)
 
 
 class Base64ImageField(serializers.ImageField):
+    """
+    Изображение файлом (multipart) или строкой data:image/...;base64.
+    Строка декодируется частями во временный файл, размер изображения
+    ограничен LOGO_MAX_SIZE. Переводы строк и пробелы (base64 с переносом
+    строк, как в MIME) удаляются до разбиения на части.
+    """
+
+    too_large_message = (
+        "Размер изображения не должен превышать "
+        f"{LOGO_MAX_SIZE // 1024**2} МБ"
+    )
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith("data:image"):
-            try:
-                format, imgstr = data.split(";base64,")
-                ext = format.split("/")[-1]
-                filename = f"{uuid.uuid4()}.{ext}"
-                data = ContentFile(base64.b64decode(imgstr), name=filename)
-            except (ValueError, TypeError, base64.binascii.Error):
-                raise serializers.ValidationError("Некорректное изображение")
-
+            data = self.decode_base64(data)
+        if getattr(data, "size", 0) > LOGO_MAX_SIZE:
+            raise serializers.ValidationError(self.too_large_message)
         return super().to_internal_value(data)
 
+    def decode_base64(self, data):
+        try:
+            format, imgstr = data.split(";base64,")
+        except ValueError:
+            raise serializers.ValidationError("Некорректное изображение")
+        # Части должны начинаться на границе групп из 4 символов
+        imgstr = "".join(imgstr.split())
+        if len(imgstr) // 4 * 3 > LOGO_MAX_SIZE:
+            raise serializers.ValidationError(self.too_large_message)
+        ext = format.split("/")[-1]
+        file = tempfile.SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+        )
+        try:
+            for start in range(0, len(imgstr), LOGO_BASE64_CHUNK_SIZE):
+                file.write(
+                    base64.b64decode(
+                        imgstr[start : start + LOGO_BASE64_CHUNK_SIZE],
+                        validate=True,
+                    )
+                )
+        except (ValueError, binascii.Error):
+            file.close()
+            raise serializers.ValidationError("Некорректное изображение")
+        file.seek(0)
+        return File(file, name=f"{uuid.uuid4()}.{ext}")
+
 
 class CollectCreateSerializer(serializers.ModelSerializer):
     """"Сериализатор для создания сбора."""
@@ -56,18 +107,20 @@ class CollectShowSerializer(serializers.ModelSerializer):
     """"
     Сериализатор для просмотра сбора.
     Дополнительные поля:
-    - платеж;
+    - платеж (первая страница ленты платежей и ссылка на следующую);
+    - собранная сумма и количество платежей;
     - статус.
     """
 
-    payments = PaymentShowSerializer(
-        many=True,
-        read_only=True,
-    )
+    payments = serializers.SerializerMethodField()
     summ = serializers.SerializerMethodField()
     status = serializers.SerializerMethodField()
     logo = serializers.SerializerMethodField()
 
+    # Ширина, под которую подбирается копия обложки, если клиент
+    # не передал logo_width
+    logo_width = LOGO_DETAIL_WIDTH
+
     class Meta:
         model = Collect
         fields = (
@@ -88,29 +141,168 @@ class CollectShowSerializer(serializers.ModelSerializer):
             "stop_date",
             "payments",
             "summ",
+            "payments_count",
             "is_active",
             "status",
         )
 
+    def get_payments(self, obj):
+        paginator = PaymentPagination()
+        page, position = paginator.get_page(
+            Payment.objects.filter(collect=obj).prefetch_related(
+                Prefetch(
+                    "comments",
+                    queryset=Comment.objects.select_related("author"),
+                )
+            )
+        )
+        next_link = None
+        if position is not None:
+            next_link = replace_query_param(
+                self.build_absolute_url(
+                    reverse(
+                        "collect-payments-list",
+                        kwargs={"collect_id": obj.id},
+                    )
+                ),
+                paginator.cursor_query_param,
+                paginator.encode_cursor(position),
+            )
+        return {
+            "next": next_link,
+            "results": PaymentShowSerializer(page, many=True).data,
+        }
+
     def get_summ(self, obj):
-        return obj.payments_sum or 0
+        return obj.collected_amount
+
+    @classmethod
+    def get_logo_variant(cls, request):
+        """
+        Формат и ширина копии обложки для клиента:
+        - WebP, только если клиент явно принимает image/webp (Accept),
+          иначе JPEG, который открывают все клиенты;
+        - ширина из параметра logo_width (с учетом плотности пикселей
+          экрана), округленная вверх до ширины копии из LOGO_WIDTHS,
+          по умолчанию logo_width сериализатора (список или просмотр).
+        """
+        if request is None:
+            return "jpeg", cls.logo_width
+        accept = request.headers.get("Accept", "")
+        format = "webp" if "image/webp" in accept else "jpeg"
+        try:
+            width = int(request.GET.get("logo_width", ""))
+        except ValueError:
+            width = 0
+        if width <= 0:
+            return format, cls.logo_width
+        return format, next(
+            (size for size in LOGO_WIDTHS if size >= width), LOGO_WIDTHS[-1]
+        )
+
+    @classmethod
+    def get_logo_cache_variant(cls, request):
+        """
+        Копия обложки для ключа кэша и ETag: None для копии
+        по умолчанию (она же строится задачей перестроения кэша).
+        """
+        variant = cls.get_logo_variant(request)
+        if variant == cls.get_logo_variant(None):
+            return None
+        return "_".join(map(str, variant))
 
     def get_logo(self, obj):
+        return self.get_logo_url(
+            obj, *self.get_logo_variant(self.context.get("request"))
+        )
+
+    def get_logo_url(self, obj, format, logo_width):
+        """
+        Ссылка на наименьшую копию обложки не уже logo_width
+        (или на наибольшую, если все копии уже).
+        Пока копии не созданы, отдается исходная обложка.
+        """
         if not hasattr(obj, "logo") or not obj.logo:
             return None
-        request = self.context.get("request")
+        variants = obj.logo_variants or {}
         try:
-            url = obj.logo.url
-            return request.build_absolute_uri(url) if request else url
+            if variants.get("source") != obj.logo.name:
+                return self.build_absolute_url(obj.logo.url)
+            widths = sorted(map(int, variants["widths"]))
+            width = next(
+                (width for width in widths if width >= logo_width),
+                widths[-1],
+            )
+            return self.build_absolute_url(
+                obj.logo.storage.url(variants["widths"][str(width)][format])
+            )
         except Exception:
             return None
 
+    def build_absolute_url(self, url):
+        """
+        Абсолютная ссылка относительно запроса, а при сборке ответа
+        вне запроса (в задаче Celery) относительно SITE_URL.
+        """
+        request = self.context.get("request")
+        if request:
+            return request.build_absolute_uri(url)
+        return urljoin(settings.SITE_URL, url)
+
     def get_status(self, obj):
         if not obj.is_active:
             return "Сбор завершен"
         return "Сбор открыт"
 
 
+class CollectListSerializer(CollectShowSerializer):
+    """
+    Облегченный сериализатор для списка сборов.
+    Платежи и текстовые поля сбора в список не попадают.
+    """
+
+    payments = None
+    logo_width = LOGO_LIST_WIDTH
+
+    class Meta(CollectShowSerializer.Meta):
+        fields = (
+            "id",
+            "author",
+            "name",
+            "slug",
+            "event_format",
+            "event_reason",
+            "event_date",
+            "target_amount",
+            "total_amount",
+            "logo",
+            "stop_date",
+            "summ",
+            "payments_count",
+            "is_active",
+            "status",
+        )
+
+
+class CollectLogoSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор замены обложки сбора.
+    Копии прежней обложки сбрасываются, новые создаются в Celery.
+    """
+
+    logo = Base64ImageField()
+
+    class Meta:
+        model = Collect
+        fields = ("id", "logo")
+
+    def update(self, instance, validated_data):
+        instance.logo = validated_data["logo"]
+        instance.logo_variants = {}
+        instance.save()
+        return instance
+
+
 class CollectReactivateSerializer(serializers.ModelSerializer):
     """"Сериализатор активации сбора."""
 
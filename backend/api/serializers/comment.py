@@ -39,4 +39,4 @@ class CommentShowSerializer(serializers.ModelSerializer):
 
     def get_username(self, obj):
         full_name = f"{obj.author.first_name} {obj.author.last_name}".strip()
-        return full_name or obj.username
+        return full_name or obj.author.username
@@ -20,3 +20,12 @@ class LikeSerializer(serializers.ModelSerializer):
         if Like.objects.filter(author=author, payment=payment).exists():
             raise ValidationError("Лайк уже создан")
         return data
+
+
+class LikeToggleSerializer(serializers.Serializer):
+    """
+    Сериализатор состояния лайка: liked=true ставит лайк,
+    liked=false снимает его.
+    """
+
+    liked = serializers.BooleanField()
@@ -1,20 +1,45 @@
+import csv
+import io
+import time
+from itertools import islice
+
 from rest_framework import serializers
+from rest_framework.exceptions import NotFound
 from rest_framework.serializers import ValidationError
+from rest_framework.settings import api_settings
+from django.contrib.auth import get_user_model
 from django.utils import timezone
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
 
+from api.cache import invalidate_collect_caches
+from api.metrics import inc, observe
 from api.models import Payment, Collect
 from api.serializers import CommentShowSerializer
+from proninteam.constants import (
+    BULK_PAYMENTS_BATCH_SIZE,
+    BULK_PAYMENTS_MAX_ROWS,
+    DECIMAL_PLACES,
+    MAX_DIGITS,
+)
+
+User = get_user_model()
 
 
 class PaymentCreateSerializer(serializers.ModelSerializer):
     """
     Сериализатор для создания платежей пользователями.
-    Валидация сериализатора проверяет следующее:
+    Платеж принимается одним условным UPDATE строки сбора, который
+    проверяет следующее и в той же операции увеличивает итоги сбора:
     - статус сбора;
-    - достижение до момента платежа максимальной суммы сбора;
     - достижение даты завершения сбора;
-    - достигает ли сумма платежа минимальной суммы платежа сбора.
+    - достигает ли сумма платежа минимальной суммы платежа сбора;
+    - не превысит ли платеж общую сумму сбора.
+    Сбор закрывается тем же UPDATE, как только общая сумма достигнута:
+    платеж сверх общей суммы не принимается, поэтому ждать ее превышения
+    нельзя.
+    Причина отказа определяется отдельным запросом только для
+    отклоненных платежей.
     """
 
     class Meta:
@@ -22,33 +47,201 @@ class PaymentCreateSerializer(serializers.ModelSerializer):
         fields = ("author", "collect", "amount", "hide_amount")
         read_only_fields = ("author", "collect")
 
-    def validate(self, data):
-        collect = self.context["collect"]
-        if not collect.is_active:
-            raise ValidationError(
-                "Сбор завершен, платежи более не принимаются"
+    def create(self, validated_data):
+        collect_id = validated_data["collect_id"]
+        amount = validated_data["amount"]
+        start = time.perf_counter()
+        with transaction.atomic():
+            admitted = self.admit(collect_id, amount)
+            if admitted:
+                payment = super().create(validated_data)
+        observe(
+            "payment_admission_duration_seconds",
+            {"result": "accepted" if admitted else "rejected"},
+            [time.perf_counter() - start],
+        )
+        if admitted:
+            return payment
+        self.reject(collect_id, amount)
+
+    def admit(self, collect_id, amount):
+        collected_after = F("collected_amount") + amount
+        return (
+            Collect.objects.filter(
+                Q(total_amount=0) | Q(total_amount__gte=collected_after),
+                id=collect_id,
+                is_active=True,
+                stop_date__gt=timezone.now(),
+                min_payment__lte=amount,
+            ).update(
+                collected_amount=collected_after,
+                payments_count=F("payments_count") + 1,
+                is_active=Case(
+                    When(
+                        Q(total_amount__gt=0)
+                        & Q(total_amount__lte=collected_after),
+                        then=Value(False),
+                    ),
+                    default=Value(True),
+                ),
             )
-        if collect.total_amount:
-            current_sum = (
-                collect.payments.aggregate(Sum("amount"))["amount__sum"] or 0
+            == 1
+        )
+
+    def reject(self, collect_id, amount):
+        collect = Collect.objects.filter(id=collect_id).first()
+        if collect is None:
+            inc("payment_rejections_total", {"reason": "not_found"})
+            raise NotFound("Сбор не найден")
+        if not collect.is_active:
+            reason = "inactive"
+            message = "Сбор завершен, платежи более не принимаются"
+        elif collect.stop_date <= timezone.now():
+            Collect.objects.filter(id=collect_id).update(is_active=False)
+            # UPDATE не вызывает сигналы сбора
+            invalidate_collect_caches([collect_id])
+            reason = "expired"
+            message = "Сбор завершен по достижению даты завершения сбора"
+        elif collect.min_payment > amount:
+            reason = "min_payment"
+            message = f"Минимальная сумма платежа {collect.min_payment}"
+        else:
+            reason = "total_exceeded"
+            message = (
+                "Сумма платежа превышает остаток сбора "
+                f"{collect.total_amount - collect.collected_amount} р."
             )
-            if current_sum > collect.total_amount:
-                collect.is_active = False
-                collect.save(update_fields=["is_active"])
-                raise ValidationError(
-                    "Сбор завершен, платежи более не принимаются"
+        inc("payment_rejections_total", {"reason": reason})
+        raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]})
+
+
+class PaymentImportRowSerializer(serializers.Serializer):
+    """Строка импорта платежей: username плательщика, сумма и флаг скрытия."""
+
+    author = serializers.CharField()
+    amount = serializers.DecimalField(
+        max_digits=MAX_DIGITS, decimal_places=DECIMAL_PLACES, min_value=0
+    )
+    hide_amount = serializers.BooleanField(default=False)
+
+
+class PaymentBulkCreateSerializer(serializers.Serializer):
+    """
+    Сериализатор для пакетного импорта платежей в сбор.
+    Пакет проверяется целиком под блокировкой строки сбора:
+    - статус сбора и дата завершения сбора;
+    - минимальная сумма платежа для каждой строки;
+    - не превысит ли сумма пакета общую сумму сбора.
+    Платежи создаются через bulk_create частями, итоги сбора
+    обновляются одним UPDATE. Сигналы платежей при этом не вызываются.
+    """
+
+    payments = PaymentImportRowSerializer(
+        many=True, allow_empty=False, max_length=BULK_PAYMENTS_MAX_ROWS
+    )
+
+    @staticmethod
+    def rows_from_csv(file):
+        """
+        Строки платежей из CSV в UTF-8 с колонками author, amount,
+        hide_amount. Файл читается потоком и только до строки
+        BULK_PAYMENTS_MAX_ROWS + 1, целиком в память он не загружается.
+        """
+        text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+        try:
+            # Пустые ячейки отбрасываются для значений по умолчанию
+            rows = [
+                {key: value for key, value in row.items() if key and value}
+                for row in islice(
+                    csv.DictReader(text), BULK_PAYMENTS_MAX_ROWS + 1
                 )
-        if collect.stop_date <= timezone.now():
-            collect.is_active = False
-            collect.save(update_fields=["is_active"])
+            ]
+        except UnicodeDecodeError:
+            raise ValidationError(
+                {"file": ["Файл должен быть в кодировке UTF-8"]}
+            )
+        except csv.Error as error:
+            raise ValidationError({"file": [f"Ошибка чтения CSV: {error}"]})
+        finally:
+            # Файл закрывает владелец, а не обертка
+            text.detach()
+        if len(rows) > BULK_PAYMENTS_MAX_ROWS:
             raise ValidationError(
-                "Сбор завершен по достижению даты завершения сбора"
+                {
+                    "file": [
+                        "Не более "
+                        f"{BULK_PAYMENTS_MAX_ROWS} платежей в одном пакете"
+                    ]
+                }
             )
-        if collect.min_payment > data.get("amount"):
+        return rows
+
+    def validate_payments(self, rows):
+        usernames = {row["author"] for row in rows}
+        users = dict(
+            User.objects.filter(username__in=usernames).values_list(
+                "username", "id"
+            )
+        )
+        missing = usernames - users.keys()
+        if missing:
             raise ValidationError(
-                f"Минимальная сумма платежа {collect.min_payment}"
+                f"Пользователи не найдены: {', '.join(sorted(missing))}"
             )
-        return data
+        for row in rows:
+            row["author_id"] = users[row.pop("author")]
+        return rows
+
+    def create(self, validated_data):
+        collect_id = validated_data["collect_id"]
+        rows = validated_data["payments"]
+        total = sum(row["amount"] for row in rows)
+        with transaction.atomic():
+            collect = (
+                Collect.objects.select_for_update()
+                .filter(id=collect_id)
+                .first()
+            )
+            if collect is None:
+                raise NotFound("Сбор не найден")
+            self.check_collect(collect, rows, total)
+            payments = Payment.objects.bulk_create(
+                [Payment(collect_id=collect_id, **row) for row in rows],
+                batch_size=BULK_PAYMENTS_BATCH_SIZE,
+            )
+            collected_after = F("collected_amount") + total
+            Collect.objects.filter(id=collect_id).update(
+                collected_amount=collected_after,
+                payments_count=F("payments_count") + len(payments),
+                is_active=Case(
+                    When(
+                        Q(total_amount__gt=0)
+                        & Q(total_amount__lte=collected_after),
+                        then=Value(False),
+                    ),
+                    default=Value(True),
+                ),
+            )
+        return payments
+
+    def check_collect(self, collect, rows, total):
+        if not collect.is_active:
+            message = "Сбор завершен, платежи более не принимаются"
+        elif collect.stop_date <= timezone.now():
+            message = "Сбор завершен по достижению даты завершения сбора"
+        elif any(row["amount"] < collect.min_payment for row in rows):
+            message = f"Минимальная сумма платежа {collect.min_payment}"
+        elif (
+            collect.total_amount
+            and collect.collected_amount + total > collect.total_amount
+        ):
+            message = (
+                "Сумма пакета превышает остаток сбора "
+                f"{collect.total_amount - collect.collected_amount} р."
+            )
+        else:
+            return
+        raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]})
 
 
 class PaymentShowSerializer(serializers.ModelSerializer):
@@ -66,9 +259,9 @@ class PaymentShowSerializer(serializers.ModelSerializer):
 
     show_amount = serializers.SerializerMethodField()
     comments = serializers.SerializerMethodField()
-    likes = serializers.IntegerField(source="likes.count", read_only=True)
+    likes = serializers.IntegerField(source="like_count", read_only=True)
     comments_count = serializers.IntegerField(
-        source="comments.count", read_only=True
+        source="comment_count", read_only=True
     )
 
     class Meta:
@@ -93,3 +286,27 @@ class PaymentShowSerializer(serializers.ModelSerializer):
 
     def get_comments(self, obj):
         return CommentShowSerializer(obj.comments, many=True).data
+
+
+class PaymentEventSerializer(PaymentShowSerializer):
+    """Новый платеж в потоке событий сбора (без комментариев)."""
+
+    class Meta(PaymentShowSerializer.Meta):
+        fields = ("id", "author", "collect", "show_amount", "created_at")
+
+
+class LeaderboardEntrySerializer(serializers.Serializer):
+    """
+    Место участника в рейтинге сбора.
+    Если участник скрыл сумму хотя бы одного платежа,
+    вместо суммы указано "Сумма скрыта".
+    """
+
+    place = serializers.IntegerField()
+    author = serializers.IntegerField()
+    show_amount = serializers.SerializerMethodField()
+
+    def get_show_amount(self, obj):
+        if obj["hidden"]:
+            return "Сумма скрыта"
+        return f"{obj['amount']:.{DECIMAL_PLACES}f} р."
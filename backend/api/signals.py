@@ -1,52 +1,146 @@
 from typing import Any
 
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import F
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.core.cache import cache
 
+from .cache import invalidate_collect_cache, invalidate_collect_caches
+from .events import publish_collect_event
+from .leaderboard import (
+    add_payments,
+    delete_leaderboard,
+    rebuild_leaderboard,
+    remove_payment,
+)
+from .likes import like_changed
 from .models import Payment, Like, Comment, Collect
-from .tasks import send_collect_created_email, send_payment_created_email
-
-
-def clear_collect_cache(collect_id):
-    cache_key = f"collect_detail_{collect_id}"
-    cache.delete(cache_key)
+from .serializers import CommentShowSerializer, PaymentEventSerializer
+from .tasks import (
+    generate_logo_variants,
+    queue_emails,
+    schedule_collect_rebuild,
+)
+
+
+@receiver(post_delete, sender=Payment)
+def remove_payment_from_totals(sender, instance, **kwargs):
+    """
+    Уменьшить итоги сбора при удалении платежа.
+    Увеличение итогов выполняется при приеме платежа
+    в PaymentCreateSerializer.
+    """
+    Collect.objects.filter(id=instance.collect_id).update(
+        collected_amount=F("collected_amount") - instance.amount,
+        payments_count=F("payments_count") - 1,
+    )
 
 
 @receiver([post_save, post_delete], sender=Payment)
 def payment_changed(sender, instance, **kwargs):
-    clear_collect_cache(instance.collect.id)
+    schedule_collect_rebuild(instance.collect_id)
+
+
+@receiver(post_save, sender=Payment)
+def update_leaderboard(sender, instance, created, **kwargs):
+    """
+    Добавить платеж в рейтинг сбора после фиксации транзакции.
+    Измененный платеж (например, в админке) пересчитывает рейтинг сбора.
+    """
+    if created:
+        transaction.on_commit(
+            lambda: add_payments(instance.collect_id, [instance])
+        )
+    else:
+        transaction.on_commit(lambda: rebuild_leaderboard(instance.collect_id))
+
+
+@receiver(post_delete, sender=Payment)
+def remove_from_leaderboard(sender, instance, **kwargs):
+    transaction.on_commit(lambda: remove_payment(instance))
+
+
+@receiver(post_save, sender=Payment)
+def publish_payment_event(sender, instance, created, **kwargs):
+    if created:
+        data = PaymentEventSerializer(instance).data
+        transaction.on_commit(
+            lambda: publish_collect_event(instance.collect_id, "payment", data)
+        )
+
+
+@receiver(post_save, sender=Comment)
+def publish_comment_event(sender, instance, created, **kwargs):
+    if created:
+        data = {
+            "payment": instance.payment_id,
+            **CommentShowSerializer(instance).data,
+        }
+        transaction.on_commit(
+            lambda: publish_collect_event(
+                instance.payment.collect_id, "comment", data
+            )
+        )
 
 
 @receiver([post_save, post_delete], sender=Like)
-def like_changed(sender, instance, **kwargs):
-    clear_collect_cache(instance.payment.collect.id)
+def like_saved_or_deleted(sender, instance, signal, **kwargs):
+    """Лайк, созданный или удаленный через ORM."""
+    like_changed(
+        instance.payment.collect_id,
+        instance.payment_id,
+        -1 if signal is post_delete else 1,
+    )
 
 
 @receiver([post_save, post_delete], sender=Comment)
 def comment_changed(sender, instance, **kwargs):
-    clear_collect_cache(instance.payment.collect.id)
+    schedule_collect_rebuild(instance.payment.collect_id)
+
+
+@receiver(post_save, sender=Collect)
+def collect_changed(sender, instance, created, **kwargs):
+    """
+    Сбросить кэш сбора после фиксации транзакции: иначе читатель успел бы
+    закэшировать строку до изменения под новой генерацией и версией.
+    """
+    if not created:
+        transaction.on_commit(lambda: invalidate_collect_cache(instance.id))
+
+
+@receiver(post_delete, sender=Collect)
+def collect_deleted(sender, instance, **kwargs):
+    """
+    Удаленный сбор не должен отдаваться из кэша и по ETag.
+    Генерация, версия и устаревшее тело удаляются сразу и еще раз после
+    фиксации: чтение во время транзакции могло создать их заново.
+    """
+    invalidate_collect_caches([instance.id])
+    transaction.on_commit(lambda: invalidate_collect_caches([instance.id]))
+    transaction.on_commit(lambda: delete_leaderboard(instance.id))
+
+
+@receiver(post_save, sender=Collect)
+def logo_changed(sender, instance, **kwargs):
+    """Создать копии новой обложки после сохранения сбора."""
+    if instance.logo and (
+        instance.logo_variants.get("source") != instance.logo.name
+    ):
+        transaction.on_commit(
+            lambda: generate_logo_variants.delay(instance.id)
+        )
 
 
 @receiver(post_save, sender=Collect)
 def send_email_to_author(sender, instance, created, **kwargs):
 
     if created:
-        send_collect_created_email.delay(collect_id=instance.id)
+        transaction.on_commit(lambda: queue_emails("collect", [instance.id]))
 
 
 @receiver(post_save, sender=Payment)
 def send_email_to_payment_author(sender, instance, created, **kwargs):
 
     if created:
-        send_payment_created_email.delay(payment_id=instance.id)
-
-
-@receiver(post_save, sender=Payment)
-def make_inactive_collect(sender, instance, **kwargs):
-    collect = instance.collect
-    current_sum = collect.payments.aggregate(Sum("amount"))["amount__sum"] or 0
-    if current_sum > collect.total_amount:
-        collect.is_active = False
-        collect.save(update_fields=["is_active"])
+        # Платеж создается в транзакции, задача должна увидеть его в БД
+        transaction.on_commit(lambda: queue_emails("payment", [instance.id]))
@@ -1,52 +1,572 @@
+import hashlib
+import io
+import logging
+import time
+import uuid
+
 from celery import shared_task
+from celery.signals import task_postrun, task_prerun
+from django.core.cache import cache
+from django.core.files.base import ContentFile
 from django.core.mail import send_mail
 from django.conf import settings
-from django.core.mail import EmailMessage
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+from django_redis import get_redis_connection
+from PIL import Image, ImageOps
+from redis.exceptions import ResponseError
 
+from api.cache import (
+    bump_collect_version,
+    get_collect_generation,
+    get_collect_version,
+    invalidate_collect_cache,
+    invalidate_collect_caches,
+    publish_collect_detail,
+)
+from api.events import publish_collect_event
+from api.metrics import inc, observe
 from api.models import Collect, Payment
+from api.renderers import render_json
+from api.serializers import CollectShowSerializer
+from api.write_buffer import (
+    WRITE_BUFFER_GROUP,
+    WRITE_BUFFER_STREAM,
+    decode_entry,
+    persist_buffered_writes,
+)
+from proninteam.constants import (
+    COLLECT_CACHE_LOCK_TIMEOUT,
+    COLLECT_REBUILD_DEBOUNCE,
+    EMAIL_BATCH_SIZE,
+    EMAIL_BATCH_WINDOW,
+    EMAIL_DRAIN_TIMEOUT,
+    EMAIL_SEND_TIMEOUT,
+    EXPIRED_COLLECTS_BATCH_SIZE,
+    LOGO_JPEG_QUALITY,
+    LOGO_WEBP_QUALITY,
+    LOGO_WIDTHS,
+    WRITE_BUFFER_BATCH_SIZE,
+    WRITE_BUFFER_CLAIM_IDLE,
+    WRITE_BUFFER_FLUSH_TIMEOUT,
+    WRITE_BUFFER_FLUSH_WINDOW,
+)
 
+logger = logging.getLogger(__name__)
 
-@shared_task(
-    retry_kwargs={"max_retries": 5, "countdown": 60},
-    retry_backoff=True,
-    retry_jitter=True,
-)
-def send_collect_created_email(collect_id):
-    """Отправить письмо автору о создании сбора"""
+EMAIL_QUEUE_KEY = "email_queue"
+EMAIL_PROCESSING_KEY = "email_queue_processing"
+EMAIL_DRAIN_SCHEDULED_KEY = "email_drain_scheduled"
+EMAIL_DRAIN_LOCK_KEY = "email_drain_lock"
+# Продление и снятие блокировки разбора очереди писем только задачей,
+# которая ее получила (значение - токен задачи)
+EMAIL_DRAIN_RENEW_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("expire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+EMAIL_DRAIN_RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+WRITE_BUFFER_FLUSH_SCHEDULED_KEY = "write_buffer_flush_scheduled"
+
+# Время начала выполняемых задач для метрики длительности
+task_started = {}
+
+
+@task_prerun.connect
+def start_task_timer(task_id=None, task=None, **kwargs):
+    if task.name.startswith("api.tasks."):
+        task_started[task_id] = time.monotonic()
 
-    request = Collect.objects.get(id=collect_id)
+
+@task_postrun.connect
+def record_task_duration(task_id=None, task=None, **kwargs):
+    start = task_started.pop(task_id, None)
+    if start is not None:
+        observe(
+            "celery_task_duration_seconds",
+            {"task": task.name},
+            [time.monotonic() - start],
+        )
+
+
+def build_collect_created_email(collect):
     subject = "Ваш сбор успешно создан!"
     message = (
         f"Здравствуйте!\n\n"
-        f"Ваш сбор «{request.name}» (ID: {collect_id}) успешно создан.\n"
+        f"Ваш сбор «{collect.name}» (ID: {collect.id}) успешно создан.\n"
         f"Теперь вы можете принимать платежи.\n\n"
         f"С уважением, команда {getattr(settings, 'PROJECT_NAME')}"
     )
-    email = EmailMessage(
+    return EmailMessage(
         subject=subject,
         body=message,
         from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[request.author.email],
+        to=[collect.author.email],
     )
-    email.send()
 
 
-@shared_task
-def send_payment_created_email(payment_id):
-    """Отправить письмо автору сбора о новом платеже"""
+@shared_task(ignore_result=True)
+def send_collect_created_email(collect_id):
+    """
+    Поставить письмо о создании сбора в очередь рассылки.
+    Задача оставлена для сообщений брокера, поставленных до перехода
+    на queue_emails, новые письма ставятся в очередь напрямую.
+    """
+    queue_emails("collect", [collect_id])
+
 
-    request = Payment.objects.get(id=payment_id)
+def build_payment_created_email(payment):
     subject = "Ваш платеж успешно создан!"
     message = (
         f"Здравствуйте!\n\n"
-        f"Ваш платеж для сбора «{request.collect.name}»"
-        f"на сумму  {request.amount}. Успешно создан\n\n"
+        f"Ваш платеж для сбора «{payment.collect.name}»"
+        f"на сумму  {payment.amount}. Успешно создан\n\n"
         f"С уважением, команда {getattr(settings, 'PROJECT_NAME')}"
     )
-    email = EmailMessage(
+    return EmailMessage(
         subject=subject,
         body=message,
         from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[request.author.email],
+        to=[payment.author.email],
+    )
+
+
+@shared_task(ignore_result=True)
+def send_payment_created_email(payment_id):
+    """Поставить письмо о платеже в очередь (для старых сообщений)."""
+    queue_emails("payment", [payment_id])
+
+
+def queue_emails(kind, object_ids):
+    """
+    Поставить письма в очередь рассылки.
+    kind - тип письма ("collect" или "payment"), object_ids - id объектов.
+    Элемент очереди хранит время постановки для метрики задержки писем.
+    Очередь разбирается задачей drain_email_queue пакетами.
+    """
+    if not object_ids:
+        return
+    queued_at = time.time()
+    get_redis_connection("default").rpush(
+        EMAIL_QUEUE_KEY,
+        *[f"{kind}:{object_id}:{queued_at}" for object_id in object_ids],
+    )
+    if cache.add(EMAIL_DRAIN_SCHEDULED_KEY, 1, timeout=EMAIL_DRAIN_TIMEOUT):
+        drain_email_queue.apply_async(countdown=EMAIL_BATCH_WINDOW)
+
+
+def build_queued_emails(items):
+    """
+    Письма для элементов очереди в том же порядке, связанные объекты
+    читаются пакетно. Для удаленных объектов вместо письма None.
+    """
+    ids = {"collect": [], "payment": []}
+    for item in items:
+        kind, object_id, *_ = item.decode().split(":")
+        ids[kind].append(int(object_id))
+    collects = Collect.objects.filter(id__in=ids["collect"]).select_related(
+        "author"
+    )
+    payments = Payment.objects.filter(id__in=ids["payment"]).select_related(
+        "author", "collect"
+    )
+    messages = {
+        **{
+            ("collect", collect.id): build_collect_created_email(collect)
+            for collect in collects
+        },
+        **{
+            ("payment", payment.id): build_payment_created_email(payment)
+            for payment in payments
+        },
+    }
+    return [
+        messages.get((kind, int(object_id)))
+        for kind, object_id, *_ in (item.decode().split(":") for item in items)
+    ]
+
+
+def take_queued_emails(redis, count=EMAIL_BATCH_SIZE):
+    """
+    Перенести пакет писем из очереди в список обработки (LMOVE).
+    Элемент удаляется из списка обработки только после отправки,
+    поэтому при падении воркера письма не теряются.
+    """
+    pipeline = redis.pipeline()
+    for _ in range(count):
+        pipeline.lmove(EMAIL_QUEUE_KEY, EMAIL_PROCESSING_KEY, "LEFT", "RIGHT")
+    return [item for item in pipeline.execute() if item is not None]
+
+
+def requeue_processing_emails(redis):
+    """Вернуть неотправленные письма в начало очереди в прежнем порядке."""
+    while redis.lmove(EMAIL_PROCESSING_KEY, EMAIL_QUEUE_KEY, "RIGHT", "LEFT"):
+        pass
+
+
+def email_batch_size():
+    """
+    Размер пакета - письма за одну секунду при settings.EMAIL_RATE_LIMIT.
+    Пакет отправляется без пауз, скорость ограничивается отсрочкой
+    следующего разбора очереди.
+    """
+    return int(max(1, min(EMAIL_BATCH_SIZE, settings.EMAIL_RATE_LIMIT)))
+
+
+def renew_email_drain_lock(redis, token):
+    """
+    Продлить блокировку разбора очереди, если она еще у этой задачи.
+    False - блокировка истекла, и список обработки может разбирать
+    другая задача.
+    """
+    return bool(
+        redis.eval(
+            EMAIL_DRAIN_RENEW_SCRIPT,
+            1,
+            EMAIL_DRAIN_LOCK_KEY,
+            token,
+            EMAIL_DRAIN_TIMEOUT,
+        )
+    )
+
+
+def send_queued_emails(redis, items, token):
+    """
+    Отправить письма пакета через одно SMTP-соединение. Каждое
+    отправленное письмо сразу удаляется из списка обработки.
+    Перед каждым письмом продлевается блокировка разбора: если она
+    истекла, отправка прекращается, неотправленные письма вернет
+    в очередь следующий разбор. Ожидание ответа SMTP ограничено
+    EMAIL_SEND_TIMEOUT, это меньше времени жизни блокировки.
+    Возвращает количество отправленных писем и признак того,
+    что блокировка сохранена.
+    """
+    sent = 0
+    with get_connection(timeout=EMAIL_SEND_TIMEOUT) as connection:
+        for item, message in zip(items, build_queued_emails(items)):
+            if message is not None:
+                if not renew_email_drain_lock(redis, token):
+                    logger.warning(
+                        "Email drain lock expired after %d emails", sent
+                    )
+                    return sent, False
+                connection.send_messages([message])
+                sent += 1
+                if item.count(b":") == 2:
+                    observe(
+                        "email_delivery_latency_seconds",
+                        {},
+                        [time.time() - float(item.decode().split(":")[2])],
+                    )
+            redis.lrem(EMAIL_PROCESSING_KEY, 1, item)
+    return sent, True
+
+
+@shared_task(bind=True, ignore_result=True, max_retries=5)
+def drain_email_queue(self):
+    """
+    Отправить пакет писем из очереди через одно SMTP-соединение.
+    Пакет переносится в список обработки и отправляется без пауз,
+    следующий разбор откладывается так, чтобы писем уходило не больше
+    settings.EMAIL_RATE_LIMIT в секунду. При ошибке отправки в начало
+    очереди возвращаются только неотправленные письма.
+    Одновременно очередь разбирает одна задача (блокировка с токеном
+    задачи продлевается на время отправки), она же возвращает
+    в очередь письма, оставшиеся в списке обработки после падения.
+    Если в очереди остались письма, задача перезапускается.
+    """
+    cache.delete(EMAIL_DRAIN_SCHEDULED_KEY)
+    redis = get_redis_connection("default")
+    token = uuid.uuid4().hex
+    if not redis.set(
+        EMAIL_DRAIN_LOCK_KEY, token, nx=True, ex=EMAIL_DRAIN_TIMEOUT
+    ):
+        return
+    start = time.monotonic()
+    try:
+        requeue_processing_emails(redis)
+        items = take_queued_emails(redis, email_batch_size())
+        if not items:
+            return
+        try:
+            sent, locked = send_queued_emails(redis, items, token)
+        except Exception as error:
+            if renew_email_drain_lock(redis, token):
+                requeue_processing_emails(redis)
+            raise self.retry(exc=error, countdown=60)
+    finally:
+        redis.eval(EMAIL_DRAIN_RELEASE_SCRIPT, 1, EMAIL_DRAIN_LOCK_KEY, token)
+    if not locked:
+        # Очередь разбирает задача, получившая блокировку
+        return
+    if redis.llen(EMAIL_QUEUE_KEY) and cache.add(
+        EMAIL_DRAIN_SCHEDULED_KEY, 1, timeout=EMAIL_DRAIN_TIMEOUT
+    ):
+        elapsed = time.monotonic() - start
+        self.apply_async(
+            countdown=max(0, sent / settings.EMAIL_RATE_LIMIT - elapsed)
+        )
+
+
+@shared_task(ignore_result=True)
+def sweep_email_queue():
+    """
+    Запланировать разбор очереди писем, если в ней или в списке
+    обработки остались письма, а разбор не запланирован
+    (например, воркер упал до перезапуска задачи).
+    """
+    redis = get_redis_connection("default")
+    if (
+        redis.llen(EMAIL_QUEUE_KEY) or redis.llen(EMAIL_PROCESSING_KEY)
+    ) and cache.add(EMAIL_DRAIN_SCHEDULED_KEY, 1, timeout=EMAIL_DRAIN_TIMEOUT):
+        drain_email_queue.delay()
+
+
+def buffer_write(kind, author_id, collect_id, payment_id, **fields):
+    """
+    Поставить лайк, снятие лайка или комментарий (kind - "like",
+    "unlike" или "comment")
+    в поток записи Redis. Поток разбирается задачей flush_write_buffer
+    пакетами, записи одного окна сохраняются вместе.
+    """
+    get_redis_connection("default").xadd(
+        WRITE_BUFFER_STREAM,
+        {
+            "kind": kind,
+            "author": author_id,
+            "collect": collect_id,
+            "payment": payment_id,
+            **fields,
+        },
+    )
+    if cache.add(
+        WRITE_BUFFER_FLUSH_SCHEDULED_KEY,
+        1,
+        timeout=WRITE_BUFFER_FLUSH_TIMEOUT,
+    ):
+        flush_write_buffer.apply_async(countdown=WRITE_BUFFER_FLUSH_WINDOW)
+
+
+def read_write_buffer(redis, consumer):
+    """
+    Следующий пакет записей потока для группы WRITE_BUFFER_GROUP.
+    Сначала берутся записи, не подтвержденные дольше
+    WRITE_BUFFER_CLAIM_IDLE секунд (пакет упавшей задачи), затем новые.
+    """
+    try:
+        redis.xgroup_create(
+            WRITE_BUFFER_STREAM, WRITE_BUFFER_GROUP, id="0", mkstream=True
+        )
+    except ResponseError as error:
+        # Группа уже создана
+        if "BUSYGROUP" not in str(error):
+            raise
+    claimed = redis.xautoclaim(
+        WRITE_BUFFER_STREAM,
+        WRITE_BUFFER_GROUP,
+        consumer,
+        min_idle_time=WRITE_BUFFER_CLAIM_IDLE * 1000,
+        count=WRITE_BUFFER_BATCH_SIZE,
+    )[1]
+    if claimed:
+        return claimed
+    streams = redis.xreadgroup(
+        WRITE_BUFFER_GROUP,
+        consumer,
+        {WRITE_BUFFER_STREAM: ">"},
+        count=WRITE_BUFFER_BATCH_SIZE,
+    )
+    return streams[0][1] if streams else []
+
+
+@shared_task(bind=True, ignore_result=True)
+def flush_write_buffer(self):
+    """
+    Сохранить пакет лайков, снятий лайков и комментариев из потока записи.
+    Записи подтверждаются и удаляются из потока после фиксации
+    транзакции, при ошибке пакет будет взят повторно. Если в потоке
+    остались записи, задача перезапускается сразу.
+    """
+    cache.delete(WRITE_BUFFER_FLUSH_SCHEDULED_KEY)
+    redis = get_redis_connection("default")
+    messages = read_write_buffer(redis, self.request.hostname or "flush")
+    if not messages:
+        return
+    ids = [message_id for message_id, _ in messages]
+    likes, unlikes, comments, skipped = persist_buffered_writes(
+        [decode_entry(fields) for _, fields in messages]
+    )
+    pipeline = redis.pipeline()
+    pipeline.xack(WRITE_BUFFER_STREAM, WRITE_BUFFER_GROUP, *ids)
+    pipeline.xdel(WRITE_BUFFER_STREAM, *ids)
+    pipeline.execute()
+    logger.info(
+        "Flushed %d buffered writes: %d likes, %d unlikes, %d comments, "
+        "%d skipped (cancelled or duplicate likes, missing payments "
+        "or authors)",
+        len(ids),
+        likes,
+        unlikes,
+        comments,
+        skipped,
+    )
+    if redis.xlen(WRITE_BUFFER_STREAM) and cache.add(
+        WRITE_BUFFER_FLUSH_SCHEDULED_KEY,
+        1,
+        timeout=WRITE_BUFFER_FLUSH_TIMEOUT,
+    ):
+        self.apply_async()
+
+
+@shared_task(ignore_result=True)
+def rebuild_collect_detail(collect_id):
+    """
+    Перестроить кэш просмотра сбора после изменений.
+    Флаг планирования снимается до чтения сбора, поэтому изменения,
+    сделанные во время перестроения, запланируют следующий запуск.
+    """
+    cache.delete(f"collect_rebuild_scheduled_{collect_id}")
+    generation = get_collect_generation(collect_id)
+    version = get_collect_version(collect_id)
+    collect = Collect.objects.filter(id=collect_id).first()
+    if collect is None:
+        # Сбор удален: созданные для него счетчики не сохраняются
+        invalidate_collect_caches([collect_id])
+        return
+    start = time.monotonic()
+    body = render_json(CollectShowSerializer(collect).data)
+    publish_collect_detail(
+        collect_id, generation, version, body, time.monotonic() - start
+    )
+    publish_collect_event(
+        collect_id,
+        "progress",
+        {
+            "collected_amount": collect.collected_amount,
+            "payments_count": collect.payments_count,
+            "is_active": collect.is_active,
+        },
+    )
+
+
+def schedule_collect_rebuild(collect_id):
+    """
+    Запланировать перестроение кэша сбора в Celery после фиксации
+    транзакции, версия сбора для ETag увеличивается сразу.
+    Изменения, пришедшие за COLLECT_REBUILD_DEBOUNCE секунд,
+    объединяются в одно перестроение.
+    """
+    transaction.on_commit(lambda: enqueue_collect_rebuild(collect_id))
+
+
+def enqueue_collect_rebuild(collect_id):
+    # Версия для ETag меняется сразу, тело ответа - после перестроения
+    bump_collect_version(collect_id)
+    # Флаг ставится только после фиксации: после отката транзакции
+    # он не помешает запланировать перестроение следующим изменениям
+    if cache.add(
+        f"collect_rebuild_scheduled_{collect_id}",
+        1,
+        timeout=COLLECT_CACHE_LOCK_TIMEOUT,
+    ):
+        rebuild_collect_detail.apply_async(
+            (collect_id,), countdown=COLLECT_REBUILD_DEBOUNCE
+        )
+
+
+@shared_task(ignore_result=True)
+def close_expired_collects():
+    """
+    Закрыть активные сборы, у которых наступила дата завершения.
+    Сборы закрываются пакетами: id выбираются по частичному индексу
+    активных сборов, затем закрываются одним UPDATE, кэш закрытых
+    сборов сбрасывается одним запросом на пакет.
+    """
+    now = timezone.now()
+    closed = 0
+    while True:
+        with transaction.atomic():
+            collect_ids = list(
+                Collect.objects.select_for_update(skip_locked=True)
+                .filter(is_active=True, stop_date__lte=now)
+                .order_by("stop_date", "id")
+                .values_list("id", flat=True)[:EXPIRED_COLLECTS_BATCH_SIZE]
+            )
+            if not collect_ids:
+                break
+            Collect.objects.filter(id__in=collect_ids).update(is_active=False)
+        invalidate_collect_caches(collect_ids)
+        closed += len(collect_ids)
+    inc("collects_closed_total", {}, closed)
+    logger.info("close_expired_collects closed=%s", closed)
+    return closed
+
+
+def save_logo_variant(storage, name, image, format, **options):
+    """Сохранить копию обложки, если копии с таким именем еще нет."""
+    if not storage.exists(name):
+        buffer = io.BytesIO()
+        image.save(buffer, format, **options)
+        storage.save(name, ContentFile(buffer.getvalue()))
+    return name
+
+
+@shared_task(ignore_result=True)
+def generate_logo_variants(collect_id):
+    """
+    Создать уменьшенные копии обложки сбора в WebP и JPEG.
+    Имена копий содержат хэш исходного файла, поэтому повторный запуск
+    для той же обложки не создает файлы заново, а ссылки на копии
+    можно кэшировать без ограничения срока.
+    Копии записываются в сбор, только если обложка не сменилась.
+    """
+    collect = Collect.objects.filter(id=collect_id).only("logo").first()
+    if collect is None or not collect.logo:
+        return
+    source = collect.logo.name
+    storage = collect.logo.storage
+    digest = hashlib.sha256()
+    with collect.logo.open("rb") as file:
+        for chunk in file.chunks():
+            digest.update(chunk)
+        file.seek(0)
+        image = ImageOps.exif_transpose(Image.open(file))
+        image.load()
+    prefix = f"collect/variants/{digest.hexdigest()[:16]}"
+
+    widths = {}
+    for width in LOGO_WIDTHS:
+        # Копии шире исходного изображения не создаются
+        if widths and width > max(image.size):
+            break
+        variant = image.copy()
+        variant.thumbnail((width, width))
+        widths[str(width)] = {
+            "webp": save_logo_variant(
+                storage,
+                f"{prefix}_{width}.webp",
+                variant,
+                "WEBP",
+                quality=LOGO_WEBP_QUALITY,
+            ),
+            "jpeg": save_logo_variant(
+                storage,
+                f"{prefix}_{width}.jpg",
+                variant.convert("RGB"),
+                "JPEG",
+                quality=LOGO_JPEG_QUALITY,
+                optimize=True,
+            ),
+        }
+    updated = Collect.objects.filter(id=collect_id, logo=source).update(
+        logo_variants={"source": source, "widths": widths}
     )
-    email.send()
+    if updated:
+        invalidate_collect_cache(collect_id)
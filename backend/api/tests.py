@@ -1,3 +1,1971 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import multiprocessing
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.db.models import Count, Sum
+from asgiref.sync import sync_to_async
+from django.test import (
+    AsyncClient,
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+from django_redis import get_redis_connection
+from faker import Faker
+from PIL import Image
+from redis.exceptions import ConnectionError as RedisConnectionError
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from api.admin import PaymentAdmin
+from api.cache import (
+    aclose_async_redis,
+    aget_or_build_collect_detail,
+    collect_detail_key,
+    collect_generation_key,
+    collect_stale_key,
+    collect_version_key,
+    get_collect_cache_stats,
+    get_collect_generation,
+    get_or_build_collect_detail,
+    invalidate_collect_cache,
+    publish_collect_detail,
+    set_collect_detail,
+)
+from api.db_routers import (
+    ReplicaRouter,
+    RequestDatabaseState,
+    current_db_state,
+    pin_primary,
+    read_from_primary,
+)
+from api.events import aclose_event_hub, publish_collect_event
+from api.leaderboard import delete_leaderboard, get_leaderboard
+from api.likes import set_like
+from api.management.commands import populate_db
+from api.metrics import broker_clients, queue_length, render_metrics
+from api.models import Collect, Comment, Like, Payment
+from api.renderers import ORJSONRenderer
+from api.serializers import (
+    CollectShowSerializer,
+    PaymentBulkCreateSerializer,
+)
+from api.views import CommentViewSet
+from api.write_buffer import WRITE_BUFFER_STREAM
+from api.tasks import (
+    EMAIL_DRAIN_LOCK_KEY,
+    EMAIL_DRAIN_SCHEDULED_KEY,
+    EMAIL_PROCESSING_KEY,
+    EMAIL_QUEUE_KEY,
+    close_expired_collects,
+    drain_email_queue,
+    flush_write_buffer,
+    generate_logo_variants,
+    queue_emails,
+    rebuild_collect_detail,
+    schedule_collect_rebuild,
+    send_collect_created_email,
+    send_payment_created_email,
+    sweep_email_queue,
+    take_queued_emails,
+)
+from proninteam.constants import (
+    COLLECT_CACHE_STALE_TIMEOUT,
+    COLLECTS_PAGE_SIZE,
+    PAYMENTS_PAGE_SIZE,
+)
+
+User = get_user_model()
+
+STRESS_PROCESSES = 8
+STRESS_PAYMENTS_PER_PROCESS = 25
+
+# Бюджеты бенчмарков: число SQL-запросов, время в секундах,
+# пиковая выделенная память в байтах. Время - медиана BENCHMARK_RUNS
+# запусков, бюджеты времени с большим запасом: они ловят регрессии
+# на порядок, а не колебания времени на CI
+BENCHMARK_RUNS = 5
+BENCHMARK_BUDGETS = {
+    "collect_retrieve_cold": (3, 0.5, 1024**2),
+    "collect_retrieve_warm": (0, 0.1, 512 * 1024),
+    "payment_create": (4, 0.25, 512 * 1024),
+    "like_create": (6, 0.25, 512 * 1024),
+    "like_toggle": (4, 0.25, 512 * 1024),
+    "comment_create": (5, 0.25, 512 * 1024),
+    "admin_collect_changelist": (5, 2.0, 4 * 1024**2),
+    "admin_payment_changelist": (5, 2.0, 4 * 1024**2),
+    "admin_like_changelist": (5, 2.0, 4 * 1024**2),
+    "admin_comment_changelist": (5, 2.0, 4 * 1024**2),
+}
+
+
+def make_payments(user_id, collect_id, amount, count):
+    """Отправить платежи в сбор из отдельного процесса."""
+    # Соединение родительского процесса нельзя использовать после fork
+    connections.close_all()
+    client = APIClient()
+    client.force_authenticate(User.objects.get(id=user_id))
+    statuses = [
+        client.post(
+            f"/api/v1/collects/{collect_id}/payments/",
+            {"amount": amount},
+            format="json",
+        ).status_code
+        for _ in range(count)
+    ]
+    connections.close_all()
+    return statuses
+
+
+class RedisIsolationMixin:
+    """
+    Очистка тестовой БД Redis перед тестом: кэш сборов, рейтинги,
+    метрики и потоки не переходят из теста в тест.
+    Тесты используют отдельную БД Redis (proninteam.test_runner).
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+
+def make_collect(author, slug, **fields):
+    """Открытый сбор с датой завершения через сутки."""
+    return Collect.objects.create(
+        **{
+            "author": author,
+            "name": slug,
+            "slug": slug,
+            "description": "Сбор для тестов",
+            "stop_date": timezone.now() + timedelta(days=1),
+            "event_format": "online",
+            "event_reason": "company_party",
+            "event_date": timezone.now().date(),
+            "event_time": "12:00",
+            "event_place": "Офис",
+            **fields,
+        }
+    )
+
+
+@skipUnless(
+    connection.vendor == "postgresql",
+    "Для нагрузочного теста нужна БД с конкурентным доступом (PostgreSQL)",
+)
+class PaymentAdmissionStressTest(RedisIsolationMixin, TransactionTestCase):
+    """
+    Нагрузочный тест приема платежей.
+    Несколько процессов одновременно платят в сбор с ограниченной
+    общей суммой, итоги сбора не должны превысить общую цель сбора
+    и должны совпадать с суммой принятых платежей.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            username="payer", email="payer@example.com", password="pass"
+        )
+        self.collect = make_collect(
+            self.user, "stress-test", total_amount=1000
+        )
+
+    def test_totals_never_overshoot(self):
+        amount = 7
+        context = multiprocessing.get_context("fork")
+        connections.close_all()
+        with context.Pool(STRESS_PROCESSES) as pool:
+            results = pool.starmap(
+                make_payments,
+                [
+                    (
+                        self.user.id,
+                        self.collect.id,
+                        amount,
+                        STRESS_PAYMENTS_PER_PROCESS,
+                    )
+                ]
+                * STRESS_PROCESSES,
+            )
+        statuses = [status for result in results for status in result]
+        accepted = statuses.count(201)
+
+        self.collect.refresh_from_db()
+        totals = self.collect.payments.aggregate(
+            total=Sum("amount"), count=Count("id")
+        )
+        self.assertEqual(set(statuses), {201, 400})
+        self.assertEqual(accepted, self.collect.total_amount // amount)
+        self.assertLessEqual(
+            self.collect.collected_amount, self.collect.total_amount
+        )
+        self.assertEqual(self.collect.collected_amount, totals["total"])
+        self.assertEqual(self.collect.payments_count, totals["count"])
+        self.assertEqual(self.collect.payments_count, accepted)
+
+
+class PaymentAdmissionTest(RedisIsolationMixin, TestCase):
+    """Закрытие сбора при приеме платежа."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            username="payer", email="payer@example.com", password="pass"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def pay(self, collect, amount):
+        return self.client.post(
+            f"/api/v1/collects/{collect.id}/payments/",
+            {"amount": amount},
+            format="json",
+        )
+
+    def test_target_reached(self):
+        collect = make_collect(self.user, "target", total_amount=100)
+        self.assertEqual(self.pay(collect, 60).status_code, 201)
+        self.assertEqual(self.pay(collect, 50).status_code, 400)
+        # Платеж, которым общая сумма достигнута ровно, закрывает сбор
+        self.assertEqual(self.pay(collect, 40).status_code, 201)
+        collect.refresh_from_db()
+        self.assertFalse(collect.is_active)
+        self.assertEqual(collect.collected_amount, 100)
+
+    def test_expired(self):
+        collect = make_collect(self.user, "expired")
+        url = f"/api/v1/collects/{collect.id}/"
+        self.assertTrue(self.client.get(url).json()["is_active"])
+        Collect.objects.filter(id=collect.id).update(
+            stop_date=timezone.now() - timedelta(minutes=1)
+        )
+        self.assertEqual(self.pay(collect, 10).status_code, 400)
+        collect.refresh_from_db()
+        self.assertFalse(collect.is_active)
+        # Сбор, закрытый при отказе, не отдается из кэша открытым
+        self.assertFalse(self.client.get(url).json()["is_active"])
+
+
+class PerformanceBudgetTest(RedisIsolationMixin, TestCase):
+    """
+    Бенчмарки основных запросов.
+    Данные заполняются командой populate_db с фиксированным seed,
+    для каждого запроса измеряются время, число SQL-запросов и пиковая
+    выделенная память, превышение бюджета из BENCHMARK_BUDGETS
+    считается регрессией. Нужны БД (SQLite или PostgreSQL) и Redis.
+    """
+
+    results = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            "populate_db",
+            seed=1,
+            users=50,
+            collects=10,
+            payments=2000,
+            comments=2000,
+            likes=2000,
+            stdout=StringIO(),
+        )
+        call_command("update_collects", stdout=StringIO())
+        cls.admin = User.objects.create_superuser(
+            username="admin", email="admin@example.com", password="pass"
+        )
+        cls.user = User.objects.create_user(
+            username="bench", email="bench@example.com", password="pass"
+        )
+        cls.collect = (
+            Collect.objects.annotate(count=Count("payments"))
+            .order_by("-count")
+            .first()
+        )
+        Collect.objects.filter(id=cls.collect.id).update(
+            is_active=True,
+            total_amount=0,
+            min_payment=0,
+            stop_date=timezone.now() + timedelta(days=1),
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        for name, (queries, seconds, memory) in cls.results.items():
+            sys.stderr.write(
+                f"\n{name}: {queries} queries, {seconds * 1000:.1f} ms, "
+                f"{memory / 1024:.0f} KiB"
+            )
+        sys.stderr.write("\n")
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.payments = iter(
+            Payment.objects.filter(collect=self.collect).order_by("id")
+        )
+
+    def measure(self, name, action, prepare=None):
+        """
+        Выполнить действие BENCHMARK_RUNS раз для замера времени
+        (медиана) и запросов (наибольшее число) и еще раз для замера
+        памяти (tracemalloc замедляет выполнение).
+        """
+        budget_queries, budget_seconds, budget_memory = BENCHMARK_BUDGETS[name]
+        timings, queries = [], 0
+        for _ in range(BENCHMARK_RUNS):
+            if prepare:
+                prepare()
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = action()
+                timings.append(time.perf_counter() - started)
+            self.assertLess(response.status_code, 400, response.content)
+            queries = max(queries, len(context.captured_queries))
+        seconds = statistics.median(timings)
+        if prepare:
+            prepare()
+        tracemalloc.start()
+        try:
+            action()
+            memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.results[name] = (queries, seconds, memory)
+        self.assertLessEqual(queries, budget_queries, name)
+        self.assertLessEqual(seconds, budget_seconds, name)
+        self.assertLessEqual(memory, budget_memory, name)
+
+    def collect_url(self):
+        return f"/api/v1/collects/{self.collect.id}/"
+
+    def payment_url(self, payment, action):
+        return f"{self.collect_url()}payments/{payment.id}/{action}/"
+
+    def test_collect_retrieve_cold(self):
+        self.measure(
+            "collect_retrieve_cold",
+            lambda: self.client.get(self.collect_url()),
+            prepare=lambda: invalidate_collect_cache(self.collect.id),
+        )
+
+    def test_collect_retrieve_warm(self):
+        self.client.get(self.collect_url())
+        self.measure(
+            "collect_retrieve_warm",
+            lambda: self.client.get(self.collect_url()),
+        )
+
+    def test_payment_create(self):
+        self.measure(
+            "payment_create",
+            lambda: self.client.post(
+                f"{self.collect_url()}payments/",
+                {"amount": 100},
+                format="json",
+            ),
+        )
+
+    def test_like_create(self):
+        self.measure(
+            "like_create",
+            lambda: self.client.post(
+                self.payment_url(next(self.payments), "like")
+            ),
+        )
+
+    def test_like_toggle(self):
+        payment = next(self.payments)
+        self.measure(
+            "like_toggle",
+            lambda: self.client.put(
+                self.payment_url(payment, "like/toggle"),
+                {"liked": True},
+                format="json",
+            ),
+        )
+
+    def test_comment_create(self):
+        self.measure(
+            "comment_create",
+            lambda: self.client.post(
+                self.payment_url(next(self.payments), "comment"),
+                {"comment": "Бенчмарк"},
+                format="json",
+            ),
+        )
+
+    def test_admin_changelists(self):
+        self.client.force_login(self.admin)
+        for model in ("collect", "payment", "like", "comment"):
+            with self.subTest(model=model):
+                self.measure(
+                    f"admin_{model}_changelist",
+                    lambda: self.client.get(f"/admin/api/{model}/"),
+                )
+
+
+class PerformanceMiddlewareTest(RedisIsolationMixin, TestCase):
+    """Замеры запроса в заголовке Server-Timing и в логе."""
+
+    def test_server_timing_and_log(self):
+        user = User.objects.create_user(
+            username="viewer", email="viewer@example.com", password="pass"
+        )
+        collect = make_collect(user, "profiling")
+        url = f"/api/v1/collects/{collect.id}/"
+        with self.assertLogs("api.performance", level="INFO") as logs:
+            response = APIClient().get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Server-Timing", response)
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record["view"], "GET collect-detail")
+        self.assertGreater(record["queries"], 0)
+        self.assertGreater(record["cache_misses"], 0)
+        self.assertIn("serializer_ms", record)
+
+        user.is_staff = True
+        user.save()
+        client = APIClient()
+        client.force_authenticate(user)
+        with self.assertLogs("api.performance", level="INFO"):
+            response = client.get(url)
+        timing = response["Server-Timing"]
+        for metric in ("db;dur=", "cache;dur=", "serializer;dur=", "total;"):
+            self.assertIn(metric, timing)
+
+    @patch(
+        "redis.client.Pipeline.execute",
+        side_effect=RedisConnectionError("down"),
+    )
+    def test_redis_unavailable(self, execute):
+        with self.assertLogs("api.performance", level="ERROR") as logs:
+            response = APIClient().get("/api/v1/collects/")
+        self.assertEqual(response.status_code, 200)
+        execute.assert_called_once()
+        self.assertIn("Request profile was not saved", logs.output[-1])
+
+
+class MetricsTest(RedisIsolationMixin, TestCase):
+    """Метрики в формате Prometheus собираются из общего хранилища."""
+
+    def test_metrics_endpoint(self):
+        user = User.objects.create_user(
+            username="metrics", email="metrics@example.com", password="pass"
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.post(
+            "/api/v1/collects/0/payments/", {"amount": 1}, format="json"
+        )
+        self.assertEqual(response.status_code, 404)
+        response = client.get("/metrics/")
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        for line in (
+            "# TYPE http_request_duration_seconds histogram",
+            'payment_rejections_total{reason="not_found"}',
+            'payment_admission_duration_seconds_count{result="rejected"}',
+            "collect_cache_hit_ratio",
+            "email_queue_length",
+        ):
+            self.assertIn(line, body)
+        self.assertIn(
+            'http_request_duration_seconds_bucket{action="create",'
+            'method="POST",view="collect-payments-list",le="+Inf"}',
+            body,
+        )
+
+    def test_broker_client_reused(self):
+        url = settings.CACHES["default"]["LOCATION"]
+        self.assertEqual(queue_length(url, "metrics_test_queue"), 0)
+        client = broker_clients[url]
+        self.assertEqual(queue_length(url, "metrics_test_queue"), 0)
+        self.assertIs(broker_clients[url], client)
+
+    @override_settings(METRICS_ALLOWED_IPS=["127.0.0.1", "10.1.0.0/16"])
+    def test_metrics_access(self):
+        client = APIClient()
+        for address, status in (
+            ("127.0.0.1", 200),
+            ("10.1.2.3", 200),
+            ("203.0.113.7", 403),
+        ):
+            response = client.get("/metrics/", REMOTE_ADDR=address)
+            self.assertEqual(response.status_code, status)
+        with override_settings(METRICS_TOKEN="secret"):
+            for header, status in (
+                ("Bearer secret", 200),
+                ("Bearer wrong", 403),
+            ):
+                response = client.get(
+                    "/metrics/",
+                    REMOTE_ADDR="203.0.113.7",
+                    HTTP_AUTHORIZATION=header,
+                )
+                self.assertEqual(response.status_code, status)
+
+
+class AsyncCollectDetailTest(RedisIsolationMixin, TestCase):
+    """Асинхронный просмотр сбора делит кэш с синхронным."""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(
+            username="async", email="async@example.com", password="pass"
+        )
+        cls.collect = make_collect(user, "async")
+
+    async def test_async_retrieve(self):
+        url = f"/api/v1/collects/{self.collect.id}/"
+        client = AsyncClient()
+        try:
+            built = await client.get(url)
+            stats = await sync_to_async(get_collect_cache_stats)()
+            cached = await client.get(url)
+            not_modified = await client.get(
+                url, headers={"if-none-match": built["ETag"]}
+            )
+            missing = await client.get("/api/v1/collects/0/")
+        finally:
+            await aclose_async_redis()
+        self.assertEqual(built.status_code, 200)
+        self.assertEqual(cached.json(), built.json())
+        self.assertNotIn("Server-Timing", cached)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(missing.status_code, 404)
+        after = await sync_to_async(get_collect_cache_stats)()
+        self.assertEqual(after["hits"], stats["hits"] + 1)
+        # Синхронный просмотр читает запись, построенную асинхронно
+        response = await sync_to_async(APIClient().get)(url)
+        self.assertEqual(response.json(), built.json())
+        final = await sync_to_async(get_collect_cache_stats)()
+        self.assertEqual(final["hits"], after["hits"] + 1)
+
+
+class CollectEventsTest(RedisIsolationMixin, TestCase):
+    """Поток событий сбора через SSE с раздачей из Redis pub/sub."""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(
+            username="events", email="events@example.com", password="pass"
+        )
+        cls.collect = make_collect(user, "events")
+
+    async def test_stream(self):
+        client = AsyncClient()
+        try:
+            response = await client.get(
+                f"/api/v1/collects/{self.collect.id}/events/"
+            )
+            self.assertEqual(response["Content-Type"], "text/event-stream")
+            events = aiter(response.streaming_content)
+            self.assertEqual(
+                await anext(events),
+                b"event: progress\ndata: "
+                b'{"collected_amount":0.0,"payments_count":0,'
+                b'"is_active":true}\n\n',
+            )
+            await sync_to_async(publish_collect_event)(
+                self.collect.id, "payment", {"id": 1}
+            )
+            self.assertEqual(
+                await anext(events), b'event: payment\ndata: {"id":1}\n\n'
+            )
+            await events.aclose()
+            missing = await client.get("/api/v1/collects/0/events/")
+            self.assertEqual(missing.status_code, 404)
+        finally:
+            await aclose_event_hub()
+            await aclose_async_redis()
+        response = await sync_to_async(APIClient().get)(
+            f"/api/v1/collects/{self.collect.id}/events/"
+        )
+        self.assertEqual(response.status_code, 501)
+
+
+class CollectCacheTest(RedisIsolationMixin, TestCase):
+    """Кэш просмотра сбора с ключами по генерации."""
+
+    def test_generation(self):
+        user = User.objects.create_user(
+            username="cached", email="cached@example.com", password="pass"
+        )
+        collect = make_collect(user, "cached")
+        client = APIClient()
+        url = f"/api/v1/collects/{collect.id}/"
+        generation = get_collect_generation(collect.id)
+        self.assertEqual(client.get(url).status_code, 200)
+        self.assertIsNotNone(
+            cache.get(collect_detail_key(collect.id, generation))
+        )
+        hits = get_collect_cache_stats()["hits"]
+        self.assertEqual(client.get(url).status_code, 200)
+        self.assertEqual(get_collect_cache_stats()["hits"], hits + 1)
+
+        # Изменение сбора переключает чтение на следующую генерацию
+        collect.name = "renamed"
+        with self.captureOnCommitCallbacks(execute=True):
+            collect.save()
+        self.assertEqual(get_collect_generation(collect.id), generation + 1)
+        self.assertEqual(client.get(url).json()["name"], "renamed")
+
+
+class CollectETagTest(RedisIsolationMixin, TestCase):
+    """Условный GET просмотра сбора по ETag."""
+
+    def test_not_modified(self):
+        user = User.objects.create_user(
+            username="etag", email="etag@example.com", password="pass"
+        )
+        collect = make_collect(user, "etag")
+        url = f"/api/v1/collects/{collect.id}/"
+        client = APIClient()
+        etag = client.get(url)["ETag"]
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(len(queries), 0)
+
+        collect.name = "ETag изменен"
+        with self.captureOnCommitCallbacks(execute=True):
+            collect.save()
+            # До фиксации транзакции кэш и ETag сбора прежние
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()["name"], "ETag изменен")
+
+        etag = response["ETag"]
+        collect.delete()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 404)
+
+    def test_counter_keys(self):
+        keys = (collect_generation_key(0), collect_version_key(0))
+        stats = get_collect_cache_stats()
+        response = APIClient().get("/api/v1/collects/0/")
+        self.assertEqual(response.status_code, 404)
+        # If-None-Match: * без версии не дает 304 несуществующему сбору
+        response = APIClient().get(
+            "/api/v1/collects/0/", HTTP_IF_NONE_MATCH="*"
+        )
+        self.assertEqual(response.status_code, 404)
+        # Для несуществующего сбора ключи не остаются и промах не считается
+        self.assertEqual(cache.get_many(keys), {})
+        self.assertEqual(get_collect_cache_stats(), stats)
+
+        user = User.objects.create_user(
+            username="etag", email="etag@example.com", password="pass"
+        )
+        collect = make_collect(user, "etag")
+        APIClient().get(f"/api/v1/collects/{collect.id}/")
+        keys = (
+            collect_generation_key(collect.id),
+            collect_version_key(collect.id),
+        )
+        for key in keys:
+            self.assertGreater(cache.ttl(key), COLLECT_CACHE_STALE_TIMEOUT)
+        with self.captureOnCommitCallbacks(execute=True):
+            collect.delete()
+        self.assertEqual(cache.get_many(keys), {})
+        self.assertIsNone(cache.get(collect_stale_key(collect.id)))
+
+    @patch("api.tasks.rebuild_collect_detail.apply_async")
+    def test_payment_changes_etag(self, apply_async):
+        user = User.objects.create_user(
+            username="etag", email="etag@example.com", password="pass"
+        )
+        collect = make_collect(user, "etag")
+        url = f"/api/v1/collects/{collect.id}/"
+        client = APIClient()
+        etag = client.get(url)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            Payment.objects.create(author=user, collect=collect, amount=100)
+        # Перестроение еще не выполнено: отдается прежнее тело
+        # со своим ETag, но не 304
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.json()["payments"]["results"], [])
+
+        apply_async.assert_called_once()
+        rebuild_collect_detail(collect.id)
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(len(response.json()["payments"]["results"]), 1)
+        response = client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+
+class CollectCacheStampedeTest(RedisIsolationMixin, TestCase):
+    """Защита кэша просмотра сбора от одновременных промахов."""
+
+    def build_counter(self, delay=0):
+        calls = []
+
+        def build():
+            calls.append(1)
+            time.sleep(delay)
+            return f"body {len(calls)}".encode()
+
+        return build, calls
+
+    def test_single_flight(self):
+        build, calls = self.build_counter(delay=0.2)
+        generation = get_collect_generation(1)
+        results = []
+
+        def read():
+            results.append(
+                get_or_build_collect_detail(1, generation, 7, build)
+            )
+
+        threads = [threading.Thread(target=read) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [(b"body 1", 7)] * 10)
+
+    def test_stale_while_locked(self):
+        user = User.objects.create_user(
+            username="stampede", email="stampede@example.com", password="pass"
+        )
+        collect = make_collect(user, "stampede")
+        url = f"/api/v1/collects/{collect.id}/"
+        client = APIClient()
+        cached = client.get(url)
+        invalidate_collect_cache(collect.id)
+        generation = get_collect_generation(collect.id)
+        # Тело новой генерации строит другой запрос
+        cache.add(f"collect_body_lock_{collect.id}_{generation}", 1)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(response.content, cached.content)
+        self.assertEqual(response["ETag"], cached["ETag"])
+
+    @patch("api.cache.COLLECT_CACHE_LOCK_WAIT", 0.05)
+    def test_wait_timeout(self):
+        build, calls = self.build_counter()
+        generation = get_collect_generation(1)
+        cache.add(f"collect_body_lock_1_{generation}", 1)
+        self.assertEqual(
+            get_or_build_collect_detail(1, generation, 7, build),
+            (b"body 1", 7),
+        )
+        # Ответ построен без блокировки и в кэш не записан
+        self.assertIsNone(cache.get(collect_detail_key(1, generation)))
+
+        # Запись появилась во время ожидания: ответ не строится
+        timer = threading.Timer(
+            0.01, set_collect_detail, (1, generation, 6, b"written")
+        )
+        timer.start()
+        with patch("api.cache.COLLECT_CACHE_LOCK_WAIT", 1):
+            result = get_or_build_collect_detail(1, generation, 7, build)
+        timer.join()
+        self.assertEqual(result, (b"written", 6))
+        self.assertEqual(len(calls), 1)
+
+    def test_early_refresh(self):
+        build, calls = self.build_counter()
+        generation = get_collect_generation(1)
+        set_collect_detail(1, generation, 6, b"cached")
+        with patch("api.cache.should_refresh_early", return_value=False):
+            self.assertEqual(
+                get_or_build_collect_detail(1, generation, 7, build),
+                (b"cached", 6),
+            )
+        self.assertEqual(calls, [])
+        with patch("api.cache.should_refresh_early", return_value=True):
+            lock_key = f"collect_body_lock_1_{generation}"
+            cache.add(lock_key, 1)
+            # Обновляет запись только владелец блокировки
+            self.assertEqual(
+                get_or_build_collect_detail(1, generation, 7, build),
+                (b"cached", 6),
+            )
+            cache.delete(lock_key)
+            self.assertEqual(
+                get_or_build_collect_detail(1, generation, 7, build),
+                (b"body 1", 7),
+            )
+        self.assertEqual(
+            cache.get(collect_detail_key(1, generation))["body"], b"body 1"
+        )
+
+    async def test_async_single_flight(self):
+        calls = []
+
+        async def build():
+            calls.append(1)
+            await asyncio.sleep(0.2)
+            return b"body"
+
+        generation = await sync_to_async(get_collect_generation)(1)
+        try:
+            results = await asyncio.gather(
+                *(
+                    aget_or_build_collect_detail(1, generation, 7, build)
+                    for _ in range(10)
+                )
+            )
+        finally:
+            await aclose_async_redis()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [(b"body", 7)] * 10)
+
+
+class LeaderboardTest(RedisIsolationMixin, TestCase):
+    """Рейтинг участников сбора из Redis и его пересчет командой."""
+
+    def test_leaderboard(self):
+        users = [
+            User.objects.create_user(
+                username=f"donor{number}",
+                email=f"donor{number}@example.com",
+                password="pass",
+            )
+            for number in range(3)
+        ]
+        collect = make_collect(users[0], "leaderboard")
+        url = f"/api/v1/collects/{collect.id}/payments/"
+        with self.captureOnCommitCallbacks(execute=True):
+            for user, amount, hide_amount in (
+                (users[0], 100, False),
+                (users[1], 300, True),
+                (users[2], 50, False),
+                (users[0], 150, False),
+            ):
+                client = APIClient()
+                client.force_authenticate(user)
+                response = client.post(
+                    url,
+                    {"amount": amount, "hide_amount": hide_amount},
+                    format="json",
+                )
+                self.assertEqual(response.status_code, 201)
+        expected = [
+            {"place": 1, "author": users[1].id, "show_amount": "Сумма скрыта"},
+            {"place": 2, "author": users[0].id, "show_amount": "250 р."},
+        ]
+        leaderboard = f"/api/v1/collects/{collect.id}/leaderboard/?limit=2"
+        response = APIClient().get(leaderboard)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), expected)
+
+        delete_leaderboard(collect.id)
+        call_command("rebuild_leaderboards", stdout=StringIO())
+        self.assertEqual(APIClient().get(leaderboard).json(), expected)
+        response = APIClient().get("/api/v1/collects/0/leaderboard/")
+        self.assertEqual(response.status_code, 404)
+        # Рейтинг есть только у сбора
+        with self.assertRaises(Resolver404):
+            resolve(
+                f"/api/v1/collects/{collect.id}/payments/1/comment/1"
+                "/leaderboard/"
+            )
+
+
+class LikeToggleTest(RedisIsolationMixin, TestCase):
+    """Идемпотентная установка и снятие лайка одним запросом."""
+
+    def test_toggle(self):
+        user = User.objects.create_user(
+            username="liker", email="liker@example.com", password="pass"
+        )
+        collect = make_collect(user, "likes")
+        payment = Payment.objects.create(
+            author=user, collect=collect, amount=100
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        url = (
+            f"/api/v1/collects/{collect.id}/payments/{payment.id}"
+            "/like/toggle/"
+        )
+        for liked, like_count in ((True, 1), (True, 1), (False, 0)):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = client.put(url, {"liked": liked}, format="json")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                response.json()["Data"],
+                {"liked": liked, "like_count": like_count},
+            )
+            self.assertEqual(
+                Like.objects.filter(payment=payment).count(), like_count
+            )
+        payment.refresh_from_db()
+        self.assertEqual(payment.like_count, 0)
+        response = client.put(
+            f"/api/v1/collects/0/payments/{payment.id}/like/toggle/",
+            {"liked": True},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class PaymentCountersTest(RedisIsolationMixin, TestCase):
+    """Счетчики лайков и комментариев платежа."""
+
+    def test_counters(self):
+        user = User.objects.create_user(
+            username="counter", email="counter@example.com", password="pass"
+        )
+        payment = Payment.objects.create(
+            author=user, collect=make_collect(user, "counters"), amount=100
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        url = f"/api/v1/collects/{payment.collect_id}/payments/{payment.id}/"
+        self.assertEqual(client.post(f"{url}like/").status_code, 201)
+        self.assertEqual(client.post(f"{url}like/").status_code, 400)
+        response = client.post(
+            f"{url}comment/", {"comment": "Ура"}, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+        payment.refresh_from_db()
+        self.assertEqual((payment.like_count, payment.comment_count), (1, 1))
+
+        self.assertEqual(client.delete(f"{url}like/delete/").status_code, 200)
+        # Повторное удаление не уменьшает счетчик
+        self.assertEqual(client.delete(f"{url}like/delete/").status_code, 400)
+        self.assertEqual(
+            set_like(user.id, payment.collect_id, payment.id, False),
+            (False, 0),
+        )
+        comment_id = response.json()["Data"]["id"]
+        response = client.delete(f"{url}comment/{comment_id}/")
+        self.assertEqual(response.status_code, 204)
+        payment.refresh_from_db()
+        self.assertEqual((payment.like_count, payment.comment_count), (0, 0))
+        response = client.delete(
+            f"/api/v1/collects/0/payments/{payment.id}/like/delete/"
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_concurrent_comment_delete(self):
+        user = User.objects.create_user(
+            username="deleter", email="deleter@example.com", password="pass"
+        )
+        payment = Payment.objects.create(
+            author=user,
+            collect=make_collect(user, "deleter"),
+            amount=100,
+            comment_count=1,
+        )
+        comment = Comment.objects.create(
+            author=user, payment=payment, comment="Ура"
+        )
+        # Два запроса загрузили комментарий до удаления
+        first, second = (Comment.objects.get(id=comment.id) for _ in "ab")
+        CommentViewSet().perform_destroy(first)
+        CommentViewSet().perform_destroy(second)
+        payment.refresh_from_db()
+        self.assertEqual(payment.comment_count, 0)
+
+
+@override_settings(WRITE_BUFFER_ENABLED=True)
+class WriteBufferTest(RedisIsolationMixin, TestCase):
+    """Лайки и комментарии через поток записи с пакетным сохранением."""
+
+    def test_flush(self):
+        users = [
+            User.objects.create_user(
+                username=f"buffer{number}",
+                email=f"buffer{number}@example.com",
+                password="pass",
+            )
+            for number in range(3)
+        ]
+        payment = Payment.objects.create(
+            author=users[0],
+            collect=make_collect(users[0], "buffer"),
+            amount=100,
+        )
+        url = f"/api/v1/collects/{payment.collect_id}/payments/{payment.id}/"
+        with patch("api.tasks.flush_write_buffer.apply_async"):
+            for user in users:
+                client = APIClient()
+                client.force_authenticate(user)
+                response = client.post(f"{url}like/")
+                self.assertEqual(response.status_code, 202)
+                response = client.post(
+                    f"{url}comment/", {"comment": "Ура"}, format="json"
+                )
+                self.assertEqual(response.status_code, 202)
+            client = APIClient()
+            client.force_authenticate(users[0])
+            # Повторный лайк отклоняется до сохранения из потока
+            response = client.post(f"{url}like/")
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(
+                response.json(), {"non_field_errors": ["Лайк уже создан"]}
+            )
+            client.post(f"{url}comment/", {"comment": "Ура"}, format="json")
+            # Платеж другого сбора не принимается
+            other = f"/api/v1/collects/0/payments/{payment.id}/"
+            self.assertEqual(client.post(f"{other}like/").status_code, 404)
+            response = client.post(
+                f"{other}comment/", {"comment": "Ура"}, format="json"
+            )
+            self.assertEqual(response.status_code, 404)
+        # Записи удаленного пользователя не мешают сохранить пакет
+        users[2].delete()
+        self.assertFalse(Like.objects.exists())
+
+        with self.assertLogs("api.tasks", level="INFO") as logs:
+            flush_write_buffer.apply()
+        self.assertIn(
+            "Flushed 7 buffered writes: 2 likes, 0 unlikes, 3 comments, "
+            "2 skipped",
+            logs.output[0],
+        )
+        payment.refresh_from_db()
+        self.assertEqual(payment.like_count, 2)
+        self.assertEqual(payment.comment_count, 3)
+        self.assertEqual(Like.objects.filter(payment=payment).count(), 2)
+        self.assertEqual(
+            get_redis_connection("default").xlen(WRITE_BUFFER_STREAM), 0
+        )
+
+    @patch("api.tasks.flush_write_buffer.apply_async")
+    def test_unlike_pending(self, apply_async):
+        user = User.objects.create_user(
+            username="unlike", email="unlike@example.com", password="pass"
+        )
+        payment = Payment.objects.create(
+            author=user, collect=make_collect(user, "unlike"), amount=100
+        )
+        url = f"/api/v1/collects/{payment.collect_id}/payments/{payment.id}/"
+        client = APIClient()
+        client.force_authenticate(user)
+
+        def flush():
+            with self.assertLogs("api.tasks", level="INFO") as logs:
+                flush_write_buffer.apply()
+            payment.refresh_from_db()
+            return logs.output[0]
+
+        # Лайк снимается до сохранения из потока
+        self.assertEqual(client.post(f"{url}like/").status_code, 202)
+        self.assertEqual(client.delete(f"{url}like/delete/").status_code, 202)
+        self.assertEqual(client.delete(f"{url}like/delete/").status_code, 400)
+        self.assertIn("0 likes, 0 unlikes", flush())
+        self.assertEqual(payment.like_count, 0)
+        self.assertFalse(Like.objects.exists())
+
+        self.assertEqual(client.post(f"{url}like/").status_code, 202)
+        self.assertIn("1 likes, 0 unlikes", flush())
+        self.assertEqual(payment.like_count, 1)
+        # Сохраненный лайк снимается через поток
+        self.assertEqual(client.post(f"{url}like/").status_code, 400)
+        self.assertEqual(client.delete(f"{url}like/delete/").status_code, 202)
+        self.assertIn("0 likes, 1 unlikes", flush())
+        self.assertEqual(payment.like_count, 0)
+        self.assertFalse(Like.objects.exists())
+
+    @patch("api.tasks.rebuild_collect_detail.apply_async")
+    def test_flush_keeps_cache(self, apply_async):
+        user = User.objects.create_user(
+            username="burst", email="burst@example.com", password="pass"
+        )
+        payment = Payment.objects.create(
+            author=user, collect=make_collect(user, "burst"), amount=100
+        )
+        collect_id = payment.collect_id
+        response = APIClient().get(f"/api/v1/collects/{collect_id}/")
+        generation = get_collect_generation(collect_id)
+        stale = cache.get(collect_stale_key(collect_id))
+        self.assertEqual(stale["body"], response.content)
+        client = APIClient()
+        client.force_authenticate(user)
+        with patch("api.tasks.flush_write_buffer.apply_async"):
+            client.post(
+                f"/api/v1/collects/{collect_id}/payments/{payment.id}/like/"
+            )
+        with self.captureOnCommitCallbacks(execute=True), self.assertLogs(
+            "api.tasks", level="INFO"
+        ):
+            flush_write_buffer.apply()
+        # Пакет планирует перестроение, текущее тело остается в кэше
+        apply_async.assert_called_once()
+        self.assertEqual(apply_async.call_args.args[0], (collect_id,))
+        self.assertEqual(get_collect_generation(collect_id), generation)
+        self.assertEqual(cache.get(collect_stale_key(collect_id)), stale)
+
+
+class PaymentBulkImportTest(RedisIsolationMixin, TestCase):
+    """Пакетный импорт платежей через API и командой import_payments."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user(
+            username="importer", email="importer@example.com", password="pass"
+        )
+        self.payer = User.objects.create_user(
+            username="payer", email="payer@example.com", password="pass"
+        )
+        self.collect = make_collect(self.author, "import")
+        self.url = f"/api/v1/collects/{self.collect.id}/payments/bulk/"
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def csv_file(self, text, encoding="utf-8"):
+        return SimpleUploadedFile(
+            "payments.csv", text.encode(encoding), content_type="text/csv"
+        )
+
+    def test_import(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                self.url,
+                [
+                    {"author": "payer", "amount": "100"},
+                    {"author": "importer", "amount": "50"},
+                ],
+                format="json",
+            )
+            self.assertEqual(response.status_code, 201, response.content)
+            response = self.client.post(
+                self.url,
+                {
+                    "file": self.csv_file(
+                        "author,amount,hide_amount\npayer,25,true\n"
+                    )
+                },
+                format="multipart",
+            )
+            self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()["Data"], {"created": 1})
+        self.collect.refresh_from_db()
+        self.assertEqual(self.collect.collected_amount, 175)
+        self.assertEqual(self.collect.payments_count, 3)
+
+    def test_rejected(self):
+        # Выгрузка Excel в cp1251
+        response = self.client.post(
+            self.url,
+            {
+                "file": self.csv_file(
+                    "author,amount\nплательщик,10\n", encoding="cp1251"
+                )
+            },
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("file", response.json())
+        with patch("api.serializers.payment.BULK_PAYMENTS_MAX_ROWS", 1):
+            response = self.client.post(
+                self.url,
+                {"file": self.csv_file("author,amount\npayer,1\npayer,2\n")},
+                format="multipart",
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("file", response.json())
+        response = self.client.post(
+            self.url, [{"author": "nobody", "amount": "1"}], format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+        stranger = APIClient()
+        stranger.force_authenticate(self.payer)
+        response = stranger.post(
+            self.url, [{"author": "payer", "amount": "1"}], format="json"
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Payment.objects.exists())
+
+    @patch("api.serializers.payment.BULK_PAYMENTS_MAX_ROWS", 2)
+    def test_csv_stops_at_limit(self):
+        data = "author,amount\n".encode() + b"payer,1\n" * 100000
+        file = BytesIO(data)
+        with self.assertRaises(ValidationError):
+            PaymentBulkCreateSerializer.rows_from_csv(file)
+        # Файл прочитан только до лишней строки и не закрыт
+        self.assertLess(file.tell(), len(data) // 10)
+        self.assertFalse(file.closed)
+
+    @patch("api.uploads.LOGO_MAX_SIZE", 1024)
+    def test_size_limit_only_for_logo(self):
+        rows = "".join("payer,1\n" for _ in range(200))
+        response = self.client.post(
+            self.url,
+            {"file": self.csv_file(f"author,amount\n{rows}")},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/payments.csv"
+            with open(path, "w", encoding="utf-8") as file:
+                file.write("author,amount\npayer,10\npayer,20\n")
+            out = StringIO()
+            call_command("import_payments", self.collect.id, path, stdout=out)
+            self.assertIn("2 payments imported", out.getvalue())
+            with open(path, "w", encoding="cp1251") as file:
+                file.write("author,amount\nплательщик,10\n")
+            with self.assertRaises(CommandError):
+                call_command(
+                    "import_payments", self.collect.id, path, stdout=out
+                )
+            path = f"{directory}/payments.json"
+            for content in ("[{", '{"author": "payer", "amount": 10}'):
+                with open(path, "w", encoding="utf-8") as file:
+                    file.write(content)
+                with self.assertRaises(CommandError):
+                    call_command(
+                        "import_payments", self.collect.id, path, stdout=out
+                    )
+        self.collect.refresh_from_db()
+        self.assertEqual(self.collect.collected_amount, 30)
+        # Импорт из командной строки попадает в рейтинг сбора
+        self.assertEqual(
+            get_leaderboard(self.collect.id, 10),
+            [
+                {
+                    "place": 1,
+                    "author": self.payer.id,
+                    "amount": 30.0,
+                    "hidden": False,
+                }
+            ],
+        )
+
+
+class CollectRebuildTest(RedisIsolationMixin, TestCase):
+    """Планирование перестроения кэша сбора и публикация новой версии."""
+
+    @patch("api.tasks.rebuild_collect_detail.apply_async")
+    def test_schedule_after_commit(self, apply_async):
+        flag = "collect_rebuild_scheduled_1"
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    schedule_collect_rebuild(1)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        # Откат не оставляет флаг, следующее изменение планирует задачу
+        self.assertIsNone(cache.get(flag))
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule_collect_rebuild(1)
+            schedule_collect_rebuild(1)
+        self.assertEqual(cache.get(flag), 1)
+        apply_async.assert_called_once()
+
+    def test_publish(self):
+        generation = get_collect_generation(1)
+        publish_collect_detail(1, generation, 1, b"fresh")
+        self.assertEqual(get_collect_generation(1), generation + 1)
+        self.assertEqual(
+            cache.get(collect_detail_key(1, generation + 1))["body"], b"fresh"
+        )
+        # Сброс кэша во время построения: тело могло устареть
+        generation = get_collect_generation(1)
+        invalidate_collect_cache(1)
+        publish_collect_detail(1, generation, 1, b"stale")
+        self.assertIsNone(cache.get(collect_detail_key(1, generation + 1)))
+        self.assertIsNone(cache.get(collect_detail_key(1, generation + 2)))
+
+    @patch("api.tasks.rebuild_collect_detail.apply_async")
+    def test_rebuild(self, apply_async):
+        user = User.objects.create_user(
+            username="builder", email="builder@example.com", password="pass"
+        )
+        collect = make_collect(user, "rebuilt")
+        # Изменения за COLLECT_REBUILD_DEBOUNCE дают одно перестроение
+        with self.captureOnCommitCallbacks(execute=True):
+            for amount in (100, 50):
+                Payment.objects.create(
+                    author=user, collect=collect, amount=amount
+                )
+        apply_async.assert_called_once()
+        rebuild_collect_detail(collect.id)
+        # Перестроенное тело отдается из кэша без промаха
+        misses = get_collect_cache_stats()["misses"]
+        response = APIClient().get(f"/api/v1/collects/{collect.id}/")
+        self.assertEqual(len(response.json()["payments"]["results"]), 2)
+        self.assertEqual(get_collect_cache_stats()["misses"], misses)
+
+
+class EmailQueueTest(RedisIsolationMixin, TestCase):
+    """
+    Разбор очереди писем: лимит скорости, сбои SMTP, истекшая
+    блокировка, зависшие письма.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.redis = get_redis_connection("default")
+        self.redis.delete(EMAIL_QUEUE_KEY, EMAIL_PROCESSING_KEY)
+        user = User.objects.create_user(
+            username="mailer", email="mailer@example.com", password="pass"
+        )
+        collect = make_collect(user, "mailer")
+        self.payments = [
+            Payment.objects.create(author=user, collect=collect, amount=10)
+            for _ in range(3)
+        ]
+        with patch("api.tasks.drain_email_queue.apply_async"):
+            queue_emails("payment", [payment.id for payment in self.payments])
+
+    @override_settings(EMAIL_RATE_LIMIT=2)
+    @patch("api.tasks.drain_email_queue.apply_async")
+    def test_drain(self, apply_async):
+        drain_email_queue()
+        # Пакет - письма за секунду, следующий разбор отложен
+        # до конца этой секунды
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(self.redis.llen(EMAIL_QUEUE_KEY), 1)
+        apply_async.assert_called_once()
+        self.assertGreater(apply_async.call_args.kwargs["countdown"], 0.5)
+        drain_email_queue()
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(self.redis.llen(EMAIL_QUEUE_KEY), 0)
+        self.assertEqual(self.redis.llen(EMAIL_PROCESSING_KEY), 0)
+        self.assertIsNone(self.redis.get(EMAIL_DRAIN_LOCK_KEY))
+        apply_async.assert_called_once()
+
+    @patch("api.tasks.drain_email_queue.apply_async")
+    def test_lock_expired(self, apply_async):
+        sent = []
+
+        def send_messages(messages):
+            sent.extend(messages)
+            # Блокировка истекла во время отправки, разбор начала
+            # другая задача
+            self.redis.set(EMAIL_DRAIN_LOCK_KEY, "other")
+            return len(messages)
+
+        with patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=send_messages,
+        ), self.assertLogs("api.tasks", level="WARNING"):
+            drain_email_queue()
+        # Отправка прекращена, список обработки и чужая блокировка
+        # не тронуты
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(self.redis.llen(EMAIL_PROCESSING_KEY), 2)
+        self.assertEqual(self.redis.get(EMAIL_DRAIN_LOCK_KEY), b"other")
+        apply_async.assert_not_called()
+
+    @patch("api.tasks.drain_email_queue.apply_async")
+    def test_legacy_tasks(self, apply_async):
+        # Задачи из брокера, поставленные до очереди писем
+        payment = self.payments[0]
+        send_payment_created_email.delay(payment.id)
+        send_collect_created_email.delay(payment.collect_id)
+        self.assertEqual(
+            self.redis.lrange(EMAIL_QUEUE_KEY, -2, -1)[0].split(b":")[:2],
+            [b"payment", str(payment.id).encode()],
+        )
+        self.assertEqual(
+            self.redis.lrange(EMAIL_QUEUE_KEY, -1, -1)[0].split(b":")[:2],
+            [b"collect", str(payment.collect_id).encode()],
+        )
+        self.assertEqual(len(mail.outbox), 0)
+
+    @patch("api.tasks.drain_email_queue.retry", return_value=OSError())
+    def test_partial_failure(self, retry):
+        sent = []
+
+        def send_messages(messages):
+            if len(sent) == 1:
+                raise OSError("SMTP")
+            sent.extend(messages)
+            return len(messages)
+
+        with patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=send_messages,
+        ), self.assertRaises(OSError):
+            drain_email_queue()
+        # В очередь возвращаются только неотправленные письма
+        self.assertEqual(len(sent), 1)
+        queued = self.redis.lrange(EMAIL_QUEUE_KEY, 0, -1)
+        self.assertEqual(
+            [int(item.split(b":")[1]) for item in queued],
+            [payment.id for payment in self.payments[1:]],
+        )
+        self.assertEqual(self.redis.llen(EMAIL_PROCESSING_KEY), 0)
+
+    def test_sweep_stranded(self):
+        # Воркер упал после переноса пакета в список обработки
+        take_queued_emails(self.redis)
+        self.assertEqual(self.redis.llen(EMAIL_QUEUE_KEY), 0)
+        # Флаг запланированного разбора истек вместе с задачей
+        cache.delete(EMAIL_DRAIN_SCHEDULED_KEY)
+        with patch("api.tasks.drain_email_queue.delay") as delay:
+            sweep_email_queue()
+            sweep_email_queue()
+        delay.assert_called_once()
+        drain_email_queue()
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(self.redis.llen(EMAIL_PROCESSING_KEY), 0)
+
+
+class CollectTotalsTest(RedisIsolationMixin, TestCase):
+    """Итоги сбора при создании и удалении платежа."""
+
+    def test_totals(self):
+        user = User.objects.create_user(
+            username="donor", email="donor@example.com", password="pass"
+        )
+        collect = make_collect(user, "totals")
+        client = APIClient()
+        client.force_authenticate(user)
+        for amount in (100, 50):
+            response = client.post(
+                f"/api/v1/collects/{collect.id}/payments/",
+                {"amount": amount},
+                format="json",
+            )
+            self.assertEqual(response.status_code, 201)
+        collect.refresh_from_db()
+        self.assertEqual(
+            (collect.collected_amount, collect.payments_count), (150, 2)
+        )
+
+        Payment.objects.get(collect=collect, amount=50).delete()
+        collect.refresh_from_db()
+        self.assertEqual(
+            (collect.collected_amount, collect.payments_count), (100, 1)
+        )
+
+
+class PaymentAdminTotalsTest(RedisIsolationMixin, TestCase):
+    """Итоги сбора при создании, изменении и удалении платежа в админке."""
+
+    def assert_totals(self, collect, amount, count):
+        collect.refresh_from_db()
+        self.assertEqual(
+            (collect.collected_amount, collect.payments_count),
+            (amount, count),
+        )
+
+    def test_totals(self):
+        user = User.objects.create_superuser(
+            username="cashier", email="cashier@example.com", password="pass"
+        )
+        first = make_collect(user, "first")
+        second = make_collect(user, "second")
+        model_admin = PaymentAdmin(Payment, admin.site)
+        request = RequestFactory().post("/admin/")
+        request.user = user
+
+        payment = Payment(author=user, collect=first, amount=100)
+        model_admin.save_model(request, payment, None, False)
+        self.assert_totals(first, 100, 1)
+
+        payment.amount = 150
+        model_admin.save_model(request, payment, None, True)
+        self.assert_totals(first, 150, 1)
+
+        payment.collect = second
+        model_admin.save_model(request, payment, None, True)
+        self.assert_totals(first, 0, 0)
+        self.assert_totals(second, 150, 1)
+
+        model_admin.delete_model(request, payment)
+        self.assert_totals(second, 0, 0)
+
+
+class PopulateDbTest(RedisIsolationMixin, TestCase):
+    """Заполнение БД командой populate_db."""
+
+    def test_populate(self):
+        call_command(
+            "populate_db",
+            seed=1,
+            users=5,
+            collects=4,
+            payments=30,
+            comments=10,
+            likes=10,
+            hot_collects=0,
+            batch_size=7,
+            stdout=StringIO(),
+        )
+        self.assertEqual(Collect.objects.count(), 4)
+        self.assertEqual(Payment.objects.count(), 30)
+        self.assertEqual(Comment.objects.count(), 10)
+        # Счетчики платежей заполнены вместе с лайками и комментариями
+        self.assertEqual(
+            Payment.objects.aggregate(total=Sum("like_count"))["total"],
+            Like.objects.count(),
+        )
+        self.assertEqual(
+            Payment.objects.aggregate(total=Sum("comment_count"))["total"], 10
+        )
+        # Платежи распределены по времени в порядке создания
+        created = list(
+            Payment.objects.order_by("id").values_list("created_at", flat=True)
+        )
+        self.assertEqual(len(set(created)), 30)
+        self.assertEqual(created, sorted(created))
+        self.assertGreater(created[-1] - created[0], timedelta(days=20))
+        # Итоги и счетчики заполнены вместе с данными
+        out = StringIO()
+        call_command("update_collects", dry_run=True, stdout=out)
+        self.assertIn("Collects with drift: 0", out.getvalue())
+        self.assertIn("Payments with drift: 0", out.getvalue())
+        totals = Payment.objects.aggregate(total=Sum("amount"))["total"]
+        self.assertEqual(
+            Collect.objects.aggregate(total=Sum("collected_amount"))["total"],
+            totals,
+        )
+
+    def test_hot_collects(self):
+        command = populate_db.Command()
+        user = User.objects.create_user(username="hot", password="pass")
+        options = {"collects": 4, "batch_size": 10, "hot_share": 0.8}
+        for hot_collects, count in ((0, 0), (0.01, 1), (0.5, 2)):
+            collects = command.create_collects(
+                random.Random(1),
+                Faker(),
+                [user.id],
+                {**options, "hot_collects": hot_collects},
+            )
+            self.assertEqual(len(collects["hot"]), count)
+
+
+class PaymentFeedPaginationTest(RedisIsolationMixin, TestCase):
+    """Курсорная пагинация ленты платежей сбора."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            username="feed", email="feed@example.com", password="pass"
+        )
+        self.collect = make_collect(self.user, "feed")
+        self.client = APIClient()
+        self.url = f"/api/v1/collects/{self.collect.id}/payments/"
+        payments = [
+            Payment.objects.create(
+                author=self.user, collect=self.collect, amount=10
+            )
+            for _ in range(PAYMENTS_PAGE_SIZE * 2 + 5)
+        ]
+        # Платежи пачки с одинаковым временем, граница страницы
+        # приходится на середину такой пачки
+        moment = timezone.now() - timedelta(hours=1)
+        Payment.objects.filter(
+            id__in=[payment.id for payment in payments[10:30]]
+        ).update(created_at=moment)
+
+    def read_feed(self, on_page=None):
+        ids = []
+        url = self.url
+        while url:
+            data = self.client.get(url).json()
+            ids.extend(payment["id"] for payment in data["results"])
+            url = data["next"]
+            if on_page is not None:
+                on_page()
+        return ids
+
+    def expected_ids(self):
+        return list(
+            Payment.objects.filter(collect=self.collect)
+            .order_by("-created_at", "-id")
+            .values_list("id", flat=True)
+        )
+
+    def test_ties(self):
+        expected = self.expected_ids()
+        self.assertEqual(self.read_feed(), expected)
+
+    def test_stable_cursor(self):
+        expected = self.expected_ids()
+
+        # Новые платежи во время чтения ленты не сдвигают курсор
+        def add_payment():
+            Payment.objects.create(
+                author=self.user, collect=self.collect, amount=10
+            )
+
+        self.assertEqual(self.read_feed(add_payment), expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {"cursor": "broken"})
+        self.assertEqual(response.status_code, 404)
+
+
+class CollectListTest(RedisIsolationMixin, TestCase):
+    """Фильтры и курсорная пагинация списка сборов."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user(
+            username="lister", email="lister@example.com", password="pass"
+        )
+        other = User.objects.create_user(
+            username="other", email="other@example.com", password="pass"
+        )
+        stop_date = timezone.now() + timedelta(days=2)
+        # Сборы с одинаковой датой завершения на границе страниц
+        self.collects = [
+            make_collect(
+                self.author if number % 2 else other,
+                f"list-{number}",
+                stop_date=stop_date + timedelta(days=number // 10),
+                event_reason="wedding" if number % 3 else "date_birth",
+            )
+            for number in range(COLLECTS_PAGE_SIZE + 5)
+        ]
+        self.closed = make_collect(
+            self.author,
+            "closed",
+            is_active=False,
+            event_format="offline",
+            event_date=timezone.now().date() - timedelta(days=10),
+        )
+        self.client = APIClient()
+
+    def list_ids(self, **params):
+        ids = []
+        response = self.client.get("/api/v1/collects/", params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            ids.extend(collect["id"] for collect in data["results"])
+            if data["next"] is None:
+                return ids
+            response = self.client.get(data["next"])
+
+    def expected_ids(self, **lookups):
+        return list(
+            Collect.objects.filter(**lookups)
+            .order_by("stop_date", "id")
+            .values_list("id", flat=True)
+        )
+
+    def test_keyset(self):
+        self.assertEqual(self.list_ids(), self.expected_ids())
+
+    def test_filters(self):
+        self.assertEqual(self.list_ids(is_active="false"), [self.closed.id])
+        self.assertEqual(
+            self.list_ids(is_active="true", event_reason="wedding"),
+            self.expected_ids(is_active=True, event_reason="wedding"),
+        )
+        self.assertEqual(
+            self.list_ids(author=self.author.id),
+            self.expected_ids(author=self.author),
+        )
+        self.assertEqual(
+            self.list_ids(event_format="offline"), [self.closed.id]
+        )
+        last = self.collects[-1].stop_date
+        self.assertEqual(
+            self.list_ids(stop_date_after=last.isoformat()),
+            self.expected_ids(stop_date__gte=last),
+        )
+        self.assertEqual(
+            self.list_ids(
+                event_date_before=(
+                    timezone.now().date() - timedelta(days=1)
+                ).isoformat()
+            ),
+            [self.closed.id],
+        )
+
+    def test_invalid_filter(self):
+        for params in (
+            {"is_active": "maybe"},
+            {"event_reason": "unknown"},
+            {"stop_date_after": "yesterday"},
+        ):
+            response = self.client.get("/api/v1/collects/", params)
+            self.assertEqual(response.status_code, 400)
+
+
+class UpdateCollectsTest(RedisIsolationMixin, TestCase):
+    """Пересчет итогов и is_active сборов командой update_collects."""
+
+    def test_update(self):
+        user = User.objects.create_user(
+            username="updater", email="updater@example.com", password="pass"
+        )
+        stopped = make_collect(user, "stopped")
+        expired = make_collect(user, "expired")
+        Payment.objects.create(author=user, collect=stopped, amount=100)
+        Collect.objects.filter(id=stopped.id).update(
+            is_active=False, collected_amount=0, payments_count=0
+        )
+        Collect.objects.filter(id=expired.id).update(
+            stop_date=timezone.now() - timedelta(days=1)
+        )
+        out = StringIO()
+        call_command("update_collects", "--dry-run", stdout=out)
+        lines = dict(
+            line.split(": ", 1) for line in out.getvalue().splitlines()
+        )
+        # Итоги исправляются, is_active остановленного сбора не меняется
+        self.assertRegex(
+            lines[f"collect {stopped.id}"],
+            r"^collected_amount 0(\.00)? -> 100(\.00)?, "
+            r"payments_count 0 -> 1$",
+        )
+        self.assertEqual(
+            lines[f"collect {expired.id}"], "is_active True -> False"
+        )
+
+        # С --totals-only сборы не закрываются
+        call_command("update_collects", "--totals-only", stdout=StringIO())
+        stopped.refresh_from_db()
+        expired.refresh_from_db()
+        self.assertEqual(stopped.payments_count, 1)
+        self.assertTrue(expired.is_active)
+
+        call_command("update_collects", stdout=StringIO())
+        stopped.refresh_from_db()
+        expired.refresh_from_db()
+        # Сбор, остановленный автором, не открывается снова
+        self.assertFalse(stopped.is_active)
+        self.assertEqual(stopped.collected_amount, 100)
+        self.assertEqual(stopped.payments_count, 1)
+        self.assertFalse(expired.is_active)
+
+    def test_payment_counters(self):
+        user = User.objects.create_user(
+            username="liker", email="liker@example.com", password="pass"
+        )
+        payment = Payment.objects.create(
+            author=user, collect=make_collect(user, "counted"), amount=10
+        )
+        Like.objects.create(author=user, payment=payment)
+        Comment.objects.create(author=user, payment=payment, comment="Ура")
+        Payment.objects.filter(id=payment.id).update(
+            like_count=1, comment_count=1
+        )
+        # Удаление в админке и вместе с автором не меняет счетчики
+        Like.objects.filter(payment=payment).delete()
+        Payment.objects.filter(id=payment.id).update(comment_count=3)
+        out = StringIO()
+        call_command("update_collects", "--dry-run", stdout=out)
+        self.assertIn(
+            f"payment {payment.id}: like_count 1 -> 0, comment_count 3 -> 1",
+            out.getvalue(),
+        )
+        self.assertIn("Payments with drift: 1", out.getvalue())
+        out = StringIO()
+        call_command("update_collects", "--totals-only", stdout=out)
+        self.assertIn("Payments updated: 1", out.getvalue())
+        payment.refresh_from_db()
+        self.assertEqual((payment.like_count, payment.comment_count), (0, 1))
+
+
+class CloseExpiredCollectsTest(RedisIsolationMixin, TestCase):
+    """Закрытие сборов по дате завершения задачей close_expired_collects."""
+
+    def test_close(self):
+        user = User.objects.create_user(
+            username="closer", email="closer@example.com", password="pass"
+        )
+        expired = make_collect(user, "expired")
+        opened = make_collect(user, "opened")
+        client = APIClient()
+        url = f"/api/v1/collects/{expired.id}/"
+        self.assertEqual(client.get(url).json()["status"], "Сбор открыт")
+        Collect.objects.filter(id=expired.id).update(
+            stop_date=timezone.now() - timedelta(minutes=1)
+        )
+
+        with self.assertLogs("api.tasks", level="INFO") as logs:
+            self.assertEqual(close_expired_collects(), 1)
+        self.assertIn("closed=1", logs.output[0])
+        expired.refresh_from_db()
+        opened.refresh_from_db()
+        self.assertFalse(expired.is_active)
+        self.assertTrue(opened.is_active)
+        self.assertIn("collects_closed_total{} 1\n", render_metrics())
+        # Устаревшее тело открытого сбора не отдается во время перестроения
+        self.assertIsNone(cache.get(collect_stale_key(expired.id)))
+        self.assertEqual(client.get(url).json()["status"], "Сбор завершен")
+        with self.assertLogs("api.tasks", level="INFO"):
+            self.assertEqual(close_expired_collects(), 0)
+
+
+class ORJSONRendererTest(RedisIsolationMixin, TestCase):
+    """Рендерер на orjson выводит то же, что JSONRenderer DRF."""
+
+    def test_same_output(self):
+        user = User.objects.create_user(
+            username="render", email="render@example.com", password="pass"
+        )
+        collect = make_collect(
+            user, "render", name="Рендеринг «JSON»", collected_amount="10.50"
+        )
+        data = {
+            **CollectShowSerializer(collect).data,
+            "created_at": timezone.now(),
+            "amount": Decimal("1.25"),
+            1: "ключ-число",
+        }
+        self.assertEqual(
+            ORJSONRenderer().render(data), JSONRenderer().render(data)
+        )
+        response = APIClient().get(f"/api/v1/collects/{collect.id}/")
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(response.json()["name"], "Рендеринг «JSON»")
+
+
+@override_settings(DATABASE_REPLICAS=["replica1"])
+class ReplicaRouterTest(RedisIsolationMixin, TransactionTestCase):
+    """Чтения на реплике, после записи пользователь читает с основной БД."""
+
+    def read_db(self, request):
+        token = current_db_state.set(RequestDatabaseState(request))
+        try:
+            return ReplicaRouter().db_for_read(Collect)
+        finally:
+            current_db_state.reset(token)
+
+    def test_read_your_writes(self):
+        user = User.objects.create_user(
+            username="replica", email="replica@example.com", password="pass"
+        )
+        factory = RequestFactory()
+        request = factory.get("/api/v1/collects/")
+        request.user = user
+        self.assertEqual(self.read_db(request), "replica1")
+        write = factory.post("/api/v1/collects/")
+        write.user = user
+        self.assertEqual(self.read_db(write), "default")
+
+        pin_primary(user.pk)
+        self.assertEqual(self.read_db(request), "default")
+        anonymous = factory.get("/api/v1/collects/")
+        anonymous.user = AnonymousUser()
+        self.assertEqual(self.read_db(anonymous), "replica1")
+        # Тела ответов для общего кэша читаются с основной БД
+        with read_from_primary():
+            self.assertEqual(self.read_db(anonymous), "default")
+        # Вне запроса (Celery, команды) чтения идут на основную БД
+        self.assertEqual(ReplicaRouter().db_for_read(Collect), "default")
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class CollectLogoTest(RedisIsolationMixin, TestCase):
+    """Загрузка обложки с ограничением размера и ее уменьшенные копии."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            username="author", email="author@example.com", password="pass"
+        )
+        self.collect = make_collect(self.user, "logo")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f"/api/v1/collects/{self.collect.id}/logo/"
+
+    def image(self, size=(800, 400)):
+        buffer = BytesIO()
+        Image.new("RGB", size, "red").save(buffer, "PNG")
+        return SimpleUploadedFile(
+            "logo.png", buffer.getvalue(), content_type="image/png"
+        )
+
+    def test_upload_and_variants(self):
+        response = self.client.put(
+            self.url, {"logo": self.image()}, format="multipart"
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        generate_logo_variants(self.collect.id)
+        self.collect.refresh_from_db()
+        variants = self.collect.logo_variants
+        self.assertEqual(variants["source"], self.collect.logo.name)
+        self.assertEqual(set(variants["widths"]), {"160", "480"})
+
+        # JPEG по умолчанию, WebP только по Accept, ширина из logo_width
+        for query, accept, suffix in (
+            ("", "application/json", "_160.jpg"),
+            ("", "application/json, image/webp", "_160.webp"),
+            ("?logo_width=320", "application/json", "_480.jpg"),
+        ):
+            response = self.client.get(
+                f"/api/v1/collects/{query}", HTTP_ACCEPT=accept
+            )
+            logo = response.data["results"][0]["logo"]
+            self.assertTrue(logo.endswith(suffix), logo)
+        detail = CollectShowSerializer(self.collect).data
+        self.assertTrue(detail["logo"].endswith("_480.jpg"))
+        self.assertNotIn("logo_jpeg", detail)
+
+        url = f"/api/v1/collects/{self.collect.id}/"
+        jpeg = self.client.get(url)
+        webp = self.client.get(url, HTTP_ACCEPT="application/json, image/webp")
+        self.assertTrue(jpeg.json()["logo"].endswith("_480.jpg"))
+        self.assertTrue(webp.json()["logo"].endswith("_480.webp"))
+        self.assertIn("Accept", webp["Vary"])
+        self.assertNotEqual(webp["ETag"], jpeg["ETag"])
+        # Тело с другой копией обложки кэшируется отдельно
+        response = self.client.get(
+            url,
+            HTTP_ACCEPT="application/json, image/webp",
+            HTTP_IF_NONE_MATCH=webp["ETag"],
+        )
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=webp["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, jpeg.content)
+
+    def test_wrapped_base64(self):
+        encoded = base64.encodebytes(self.image().read()).decode()
+        self.assertIn("\n", encoded)
+        with patch("api.serializers.collect.LOGO_BASE64_CHUNK_SIZE", 64):
+            response = self.client.put(
+                self.url,
+                {"logo": f"data:image/png;base64,{encoded}"},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.collect.refresh_from_db()
+        with self.collect.logo.open("rb") as file:
+            self.assertEqual(Image.open(file).size, (800, 400))
+
+    @patch("api.uploads.LOGO_MAX_SIZE", 1024)
+    def test_upload_size_limit(self):
+        response = self.client.put(
+            self.url, {"logo": self.image((2000, 2000))}, format="multipart"
+        )
+        self.assertEqual(response.status_code, 413)
+        self.collect.refresh_from_db()
+        self.assertFalse(self.collect.logo)
@@ -0,0 +1,36 @@
+from django.core.files.uploadhandler import FileUploadHandler
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from proninteam.constants import LOGO_MAX_SIZE
+
+
+class FileTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = (
+        f"Размер файла не должен превышать {LOGO_MAX_SIZE // 1024**2} МБ"
+    )
+    default_code = "file_too_large"
+
+
+class MaxSizeUploadHandler(FileUploadHandler):
+    """
+    Обработчик загрузки, прерывающий прием файла, как только его размер
+    превысил LOGO_MAX_SIZE, не дочитывая тело запроса.
+    Данные передаются следующим обработчикам без изменений.
+    Ставится первым только в запросах загрузки обложки
+    (CollectViewSet.logo), остальные загрузки его не используют.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > LOGO_MAX_SIZE:
+            raise FileTooLarge()
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
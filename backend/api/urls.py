@@ -2,6 +2,8 @@ from django.urls import path, include
 from rest_framework_nested import routers
 
 from api.views import (
+    collect_detail,
+    collect_events,
     LikeViewSet,
     CommentViewSet,
     PaymentViewSet,
@@ -26,6 +28,9 @@ payment_router.register(r"comment", CommentViewSet, basename="payment-comment")
 
 
 urlpatterns = [
+    # Просмотр сбора асинхронный, стоит перед маршрутами вьюсета
+    path("collects/<int:id>/", collect_detail, name="collect-detail"),
+    path("collects/<int:id>/events/", collect_events, name="collect-events"),
     path("", include(router.urls)),
     path("", include(collect_router.urls)),
     path("", include(payment_router.urls)),
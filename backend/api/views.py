@@ -1,34 +1,102 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseForbidden,
+    StreamingHttpResponse,
+)
 from django.shortcuts import render
-from django.core.cache import cache
-from django.db.models import Prefetch, Sum
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET
+from django.db import transaction
+from django.db.models import F, Prefetch
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 from rest_framework.mixins import (
     CreateModelMixin,
+    ListModelMixin,
     RetrieveModelMixin,
     DestroyModelMixin,
 )
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.generics import get_object_or_404
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
 from api.models import Collect, Payment, Comment, Like
 from api.serializers import (
+    LeaderboardEntrySerializer,
     LikeSerializer,
+    LikeToggleSerializer,
     CommentCreateSerializer,
     PaymentCreateSerializer,
+    PaymentBulkCreateSerializer,
+    PaymentShowSerializer,
     CollectShowSerializer,
+    CollectListSerializer,
     CollectCreateSerializer,
+    CollectLogoSerializer,
     CollectReactivateSerializer,
     CollectChangeSerializer,
     CollectDeactivateSerializer,
 )
+from api.cache import (
+    afind_collect_version,
+    aget_collect_generation,
+    aget_collect_version,
+    aget_or_build_collect_detail,
+    collect_etag,
+    find_collect_version,
+    get_collect_generation,
+    get_collect_version,
+    get_or_build_collect_detail,
+    invalidate_collect_caches,
+)
+from api.db_routers import read_from_primary
+from api.events import get_event_hub, sse_frame
+from api.filters import CollectFilterBackend
+from api.leaderboard import add_payments, get_leaderboard
+from api.likes import buffer_like, set_like
+from api.metrics import metrics_allowed, render_metrics
+from api.pagination import CollectPagination, PaymentPagination
+from api.parsers import ORJSONParser
 from api.permissions import AuthorPermission
+from api.profiling import serializer_data
+from api.renderers import render_json
+from api.uploads import MaxSizeUploadHandler
+from api.tasks import buffer_write, queue_emails, schedule_collect_rebuild
+from proninteam.constants import (
+    COLLECT_EVENTS_KEEPALIVE,
+    LEADERBOARD_MAX_SIZE,
+    LEADERBOARD_SIZE,
+)
 
 # Create your views here.
 
 
+class ProfiledListModelMixin(ListModelMixin):
+    """Список с учетом времени сериализации в профиле запроса."""
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(
+                serializer_data(self.get_serializer(page, many=True))
+            )
+        return Response(
+            serializer_data(self.get_serializer(queryset, many=True))
+        )
+
+
 class LikeViewSet(CreateModelMixin, GenericViewSet):
     """Вьюсет для создания и удаление лайков."""
 
@@ -36,7 +104,7 @@ class LikeViewSet(CreateModelMixin, GenericViewSet):
     serializer_class = LikeSerializer
 
     def get_permissions(self):
-        if self.action == "create":
+        if self.action in ("create", "toggle"):
             return [IsAuthenticated()]
         return [
             AuthorPermission(),
@@ -52,10 +120,35 @@ class LikeViewSet(CreateModelMixin, GenericViewSet):
 
     def perform_create(self, serializer):
         user = self.request.user
-        payment = get_object_or_404(Payment, id=self.kwargs.get("payment_id"))
-        serializer.save(author=user, payment=payment)
+        payment = serializer.context["payment"]
+        with transaction.atomic():
+            serializer.save(author=user, payment=payment)
+            Payment.objects.filter(id=payment.id).update(
+                like_count=F("like_count") + 1
+            )
 
     def create(self, request, *args, **kwargs):
+        if settings.WRITE_BUFFER_ENABLED:
+            changed = buffer_like(
+                request.user.id,
+                int(self.kwargs.get("collect_id")),
+                int(self.kwargs.get("payment_id")),
+                True,
+            )
+            if changed is None:
+                raise NotFound("Платеж не найден")
+            if not changed:
+                # Ответ как у LikeSerializer.validate без буфера
+                raise ValidationError(
+                    {api_settings.NON_FIELD_ERRORS_KEY: ["Лайк уже создан"]}
+                )
+            return Response(
+                {
+                    "Succes": True,
+                    "Message": "Лайк принят",
+                },
+                status=status.HTTP_202_ACCEPTED,
+            )
         response = super().create(request, *args, **kwargs)
         return Response(
             {
@@ -66,13 +159,76 @@ class LikeViewSet(CreateModelMixin, GenericViewSet):
             status=status.HTTP_201_CREATED,
         )
 
+    @action(detail=False, methods=["PUT"])
+    def toggle(self, request, *args, **kwargs):
+        """
+        Поставить или снять лайк: {"liked": true} или {"liked": false}.
+        Повторный запрос с тем же состоянием ничего не меняет.
+        """
+        serializer = LikeToggleSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        liked = serializer.validated_data["liked"]
+        if settings.WRITE_BUFFER_ENABLED:
+            # Число лайков станет известно после сохранения из потока
+            changed = buffer_like(
+                request.user.id,
+                int(self.kwargs.get("collect_id")),
+                int(self.kwargs.get("payment_id")),
+                liked,
+            )
+            if changed is None:
+                raise NotFound("Платеж не найден")
+            return Response(
+                {
+                    "Succes": True,
+                    "Message": (
+                        "Лайк принят" if liked else "Снятие лайка принято"
+                    ),
+                    "Data": {"liked": liked},
+                },
+                status=status.HTTP_202_ACCEPTED,
+            )
+        _, like_count = set_like(
+            request.user.id,
+            int(self.kwargs.get("collect_id")),
+            int(self.kwargs.get("payment_id")),
+            liked,
+        )
+        if like_count is None:
+            raise NotFound("Платеж не найден")
+        return Response(
+            {
+                "Succes": True,
+                "Message": "Лайк поставлен" if liked else "Лайк снят",
+                "Data": {"liked": liked, "like_count": like_count},
+            },
+            status=status.HTTP_200_OK,
+        )
+
     @action(detail=False, url_path=("delete"), methods=["DELETE"])
     def delete_like(self, request, *args, **kwargs):
-        payment = get_object_or_404(Payment, id=self.kwargs.get("payment_id"))
-        like = Like.objects.filter(
-            author=self.request.user, payment=payment
-        ).first()
-        if not like:
+        if settings.WRITE_BUFFER_ENABLED:
+            # Лайк, еще не сохраненный из потока, тоже снимается
+            deleted = buffer_like(
+                request.user.id,
+                int(self.kwargs.get("collect_id")),
+                int(self.kwargs.get("payment_id")),
+                False,
+            )
+            if deleted is None:
+                raise NotFound("Платеж не найден")
+        else:
+            # Счетчик уменьшается, только если DELETE удалил строку:
+            # одновременные запросы не уменьшат его дважды
+            deleted, like_count = set_like(
+                request.user.id,
+                int(self.kwargs.get("collect_id")),
+                int(self.kwargs.get("payment_id")),
+                False,
+            )
+            if like_count is None:
+                raise NotFound("Платеж не найден")
+        if not deleted:
             return Response(
                 {
                     "Succes": False,
@@ -80,7 +236,14 @@ class LikeViewSet(CreateModelMixin, GenericViewSet):
                 },
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        like.delete()
+        if settings.WRITE_BUFFER_ENABLED:
+            return Response(
+                {
+                    "Succes": True,
+                    "Message": "Снятие лайка принято",
+                },
+                status=status.HTTP_202_ACCEPTED,
+            )
         return Response(
             {
                 "Succes": True,
@@ -106,9 +269,45 @@ class CommentViewSet(CreateModelMixin, DestroyModelMixin, GenericViewSet):
     def perform_create(self, serializer):
         user = self.request.user
         payment = get_object_or_404(Payment, id=self.kwargs.get("payment_id"))
-        serializer.save(author=user, payment=payment)
+        with transaction.atomic():
+            serializer.save(author=user, payment=payment)
+            Payment.objects.filter(id=payment.id).update(
+                comment_count=F("comment_count") + 1
+            )
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            # Комментарий мог удалить параллельный запрос
+            deleted, _ = instance.delete()
+            if deleted:
+                Payment.objects.filter(id=instance.payment_id).update(
+                    comment_count=F("comment_count") - 1
+                )
 
     def create(self, request, *args, **kwargs):
+        if settings.WRITE_BUFFER_ENABLED:
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            collect_id = int(self.kwargs.get("collect_id"))
+            payment_id = int(self.kwargs.get("payment_id"))
+            if not Payment.objects.filter(
+                id=payment_id, collect_id=collect_id
+            ).exists():
+                raise NotFound("Платеж не найден")
+            buffer_write(
+                "comment",
+                request.user.id,
+                collect_id,
+                payment_id,
+                comment=serializer.validated_data["comment"],
+            )
+            return Response(
+                {
+                    "Succes": True,
+                    "Message": "Комментарий принят",
+                },
+                status=status.HTTP_202_ACCEPTED,
+            )
         response = super().create(request, *args, **kwargs)
         return Response(
             {
@@ -126,59 +325,143 @@ class CommentViewSet(CreateModelMixin, DestroyModelMixin, GenericViewSet):
         )
         serializer.is_valid(raise_exception=True)
         serializer.save()
-        return Response(serializer.data)
+        return Response(serializer_data(serializer))
 
 
-class PaymentViewSet(CreateModelMixin, GenericViewSet):
-    """Вьюсет для создания платежей."""
+class PaymentViewSet(CreateModelMixin, ProfiledListModelMixin, GenericViewSet):
+    """
+    Вьюсет для создания платежей и просмотра ленты платежей сбора.
+    Лента отдается постранично с пагинацией по (created_at, id).
+    """
 
     queryset = Payment.objects.all()
     serializer_class = PaymentCreateSerializer
+    pagination_class = PaymentPagination
     permission_classes = [IsAuthenticated]
     lookup_field = "id"
+    lookup_value_regex = r"\d+"
 
-    def get_serializer_context(self):
-        context = super().get_serializer_context()
-        context["collect"] = get_object_or_404(
-            Collect, id=self.kwargs.get("collect_id")
+    def get_queryset(self):
+        if self.action == "list":
+            return Payment.objects.filter(
+                collect_id=self.kwargs.get("collect_id")
+            ).prefetch_related(
+                Prefetch(
+                    "comments",
+                    queryset=Comment.objects.select_related("author"),
+                )
+            )
+        return super().get_queryset()
+
+    def get_serializer_class(self):
+        if self.action == "list":
+            return PaymentShowSerializer
+        if self.action == "bulk":
+            return PaymentBulkCreateSerializer
+        return PaymentCreateSerializer
+
+    def get_permissions(self):
+        if self.action == "list":
+            return [AllowAny()]
+        if self.action == "bulk":
+            return [IsAuthenticated(), AuthorPermission()]
+        return [IsAuthenticated()]
+
+    def list(self, request, *args, **kwargs):
+        get_object_or_404(
+            Collect.objects.only("id"), id=self.kwargs.get("collect_id")
+        )
+        return super().list(request, *args, **kwargs)
+
+    @action(
+        detail=False,
+        methods=["POST"],
+        url_path="bulk",
+        parser_classes=[ORJSONParser, MultiPartParser],
+    )
+    def bulk(self, request, *args, **kwargs):
+        """
+        Пакетный импорт платежей автором сбора.
+        Принимает список платежей в JSON или CSV-файл в поле file.
+        """
+        collect = get_object_or_404(
+            Collect.objects.select_related("author"),
+            id=self.kwargs.get("collect_id"),
+        )
+        self.check_object_permissions(request, collect)
+        if "file" in request.FILES:
+            data = {
+                "payments": PaymentBulkCreateSerializer.rows_from_csv(
+                    request.FILES["file"]
+                )
+            }
+        elif isinstance(request.data, list):
+            data = {"payments": request.data}
+        else:
+            data = request.data
+        serializer = PaymentBulkCreateSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        payments = serializer.save(collect_id=collect.id)
+        # bulk_create не вызывает сигналы платежей
+        add_payments(collect.id, payments)
+        schedule_collect_rebuild(collect.id)
+        queue_emails("payment", [payment.id for payment in payments])
+        return Response(
+            {
+                "Succes": True,
+                "Message": "Платежи успешно импортированы",
+                "Data": {"created": len(payments)},
+            },
+            status=status.HTTP_201_CREATED,
         )
-        return context
 
     def perform_create(self, serializer):
-        collect = get_object_or_404(Collect, id=self.kwargs.get("collect_id"))
-        serializer.save(author=self.request.user, collect=collect)
+        # Сбор не загружается: проверки и блокировка строки сбора
+        # выполняются одним UPDATE в PaymentCreateSerializer
+        serializer.save(
+            author=self.request.user,
+            collect_id=int(self.kwargs.get("collect_id")),
+        )
 
 
 class CollectViewSet(
-    CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet
+    CreateModelMixin,
+    ProfiledListModelMixin,
+    RetrieveModelMixin,
+    DestroyModelMixin,
+    GenericViewSet,
 ):
     """Вьюсет для создания, просмотря, редактирования, активации/деактивации, а также удаления сборов."""
 
     queryset = Collect.objects.all()
     permission_classes = [AuthorPermission]
+    filter_backends = [CollectFilterBackend]
+    pagination_class = CollectPagination
     lookup_field = "id"
+    lookup_value_regex = r"\d+"
 
     def get_queryset(self):
-        return Collect.objects.annotate(
-            payments_sum=Sum("payments__amount")
-        ).prefetch_related(
-            Prefetch(
-                "payments",
-                queryset=Payment.objects.prefetch_related("comments", "likes"),
-            )
-        )
+        if self.action == "list":
+            return Collect.objects.defer("description", "event_place")
+        return super().get_queryset()
 
     def get_serializer_class(self):
         if self.action == "create":
             return CollectCreateSerializer
         if self.action == "retrieve":
             return CollectShowSerializer
+        if self.action == "list":
+            return CollectListSerializer
         if self.action == "activate":
             return CollectReactivateSerializer
         if self.action == "partial_update":
             return CollectChangeSerializer
         if self.action == "deactivate":
             return CollectDeactivateSerializer
+        if self.action == "logo":
+            return CollectLogoSerializer
+        if self.action == "leaderboard":
+            return LeaderboardEntrySerializer
         return CollectShowSerializer
 
     def get_permissions(self):
@@ -190,14 +473,37 @@ class CollectViewSet(
 
     def retrieve(self, request, *args, **kwargs):
         collect_id = kwargs["id"]
-        cache_key = f"collect_detail_{collect_id}"
-        data = cache.get(cache_key)
-        if not data:
-            instance = self.get_object()
-            serializer = self.get_serializer(instance)
-            data = serializer.data
-            cache.set(cache_key, data, timeout=60 * 5)
-        return Response(data)
+        variant = CollectShowSerializer.get_logo_cache_variant(request)
+        version = find_collect_version(collect_id)
+        not_modified = collect_not_modified(
+            request, collect_id, version, variant
+        )
+        if not_modified is not None:
+            return not_modified
+        if version is None:
+            version = get_collect_version(collect_id)
+        # В кэше хранится готовое тело ответа, оно отдается без повторного
+        # рендеринга
+        try:
+            body, version = get_or_build_collect_detail(
+                collect_id,
+                get_collect_generation(collect_id),
+                version,
+                self.build_detail,
+                variant,
+            )
+        except Http404:
+            # Счетчики, созданные для несуществующего сбора, удаляются
+            invalidate_collect_caches([collect_id])
+            raise
+        return collect_detail_response(collect_id, body, version, variant)
+
+    def build_detail(self):
+        # Тело попадает в общий кэш, поэтому читается с основной БД
+        with read_from_primary():
+            return render_json(
+                serializer_data(self.get_serializer(self.get_object()))
+            )
 
     def create(self, request):
         serializer = CollectCreateSerializer(data=request.data)
@@ -217,7 +523,7 @@ class CollectViewSet(
                 {
                     "Succes": True,
                     "Message": "Сбор успешно создан",
-                    "Data": serializer.data,
+                    "Data": serializer_data(serializer),
                 },
                 status=status.HTTP_201_CREATED,
             )
@@ -252,7 +558,7 @@ class CollectViewSet(
                 {
                     "Succes": True,
                     "Message": "Сбор успешно активирован",
-                    "Data": serializer.data,
+                    "Data": serializer_data(serializer),
                 },
                 status=status.HTTP_200_OK,
             )
@@ -282,7 +588,7 @@ class CollectViewSet(
                 {
                     "Succes": True,
                     "Message": "Сбор успешно остановлен",
-                    "Data": serializer.data,
+                    "Data": serializer_data(serializer),
                 },
                 status=status.HTTP_200_OK,
             )
@@ -295,6 +601,52 @@ class CollectViewSet(
             status=status.HTTP_400_BAD_REQUEST,
         )
 
+    @action(
+        detail=True,
+        methods=["PUT"],
+        url_path="logo",
+        parser_classes=[MultiPartParser, ORJSONParser],
+    )
+    def logo(self, request, id=None):
+        """
+        Замена обложки сбора автором.
+        Файл передается в поле logo (multipart) или строкой base64,
+        размер файла ограничен при приеме, до записи на диск.
+        """
+        # Обработчик ставится до разбора тела запроса (request.data)
+        request.upload_handlers.insert(0, MaxSizeUploadHandler(request))
+        serializer = CollectLogoSerializer(
+            self.get_object(), data=request.data
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(
+            {
+                "Succes": True,
+                "Message": "Обложка сбора обновлена",
+                "Data": serializer_data(serializer),
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    @action(detail=True, methods=["GET"], url_path="leaderboard")
+    def leaderboard(self, request, id=None):
+        """
+        Рейтинг участников сбора по сумме платежей.
+        Читается из sorted set в Redis, параметр limit - размер рейтинга.
+        """
+        try:
+            limit = int(request.query_params.get("limit", LEADERBOARD_SIZE))
+        except ValueError:
+            limit = LEADERBOARD_SIZE
+        limit = min(max(limit, 1), LEADERBOARD_MAX_SIZE)
+        entries = get_leaderboard(id, limit)
+        if not entries and not Collect.objects.filter(id=id).exists():
+            raise NotFound("Сбор не найден")
+        return Response(
+            serializer_data(self.get_serializer(entries, many=True))
+        )
+
     def partial_update(self, request, *args, **kwargs):
         instance = self.get_object()
         serializer = self.get_serializer(
@@ -302,4 +654,155 @@ class CollectViewSet(
         )
         serializer.is_valid(raise_exception=True)
         serializer.save()
-        return Response(serializer.data)
+        return Response(serializer_data(serializer))
+
+
+@require_GET
+def metrics(request):
+    """
+    Метрики приложения в текстовом формате Prometheus.
+    Доступны только с разрешенных адресов или по токену.
+    """
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        render_metrics(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+def collect_not_modified(request, collect_id, version, variant=None):
+    """
+    Ответ 304, если версия сбора у клиента (If-None-Match) актуальна.
+    Проверка стоит одного чтения версии из кэша, без обращения к БД.
+    Без версии (сбор еще не читался или не существует) запрос
+    не проверяется: иначе If-None-Match: * дал бы 304 для
+    несуществующего сбора.
+    """
+    if version is None:
+        return None
+    etag = collect_etag(collect_id, version, variant)
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        response["ETag"] = etag
+        # Копия обложки в ответе зависит от Accept
+        patch_vary_headers(response, ["Accept"])
+    return response
+
+
+def collect_detail_response(collect_id, body, version, variant=None):
+    response = HttpResponse(body, content_type="application/json")
+    if version is not None:
+        response["ETag"] = collect_etag(collect_id, version, variant)
+    patch_vary_headers(response, ["Accept"])
+    return response
+
+
+collect_detail_sync = CollectViewSet.as_view(
+    {"get": "retrieve", "patch": "partial_update", "delete": "destroy"}
+)
+
+
+@csrf_exempt
+async def collect_detail(request, id):
+    """
+    Просмотр сбора без потока на соединение под ASGI.
+    Ответ из кэша отдается через асинхронный клиент Redis, при промахе
+    сбор читается асинхронным ORM, а сериализатор (с платежами)
+    выполняется в sync_to_async. Запросы через WSGI, изменение
+    и удаление сбора, а также 404 обрабатывает CollectViewSet.
+    """
+    if request.method != "GET" or not isinstance(request, ASGIRequest):
+        return await sync_to_async(collect_detail_sync)(request, id=id)
+
+    async def build():
+        # Тело попадает в общий кэш, поэтому читается с основной БД
+        with read_from_primary():
+            collect = await Collect.objects.aget(id=id)
+            return await sync_to_async(
+                lambda: render_json(
+                    serializer_data(
+                        CollectShowSerializer(
+                            collect, context={"request": request}
+                        )
+                    )
+                )
+            )()
+
+    variant = CollectShowSerializer.get_logo_cache_variant(request)
+    version = await afind_collect_version(id)
+    not_modified = collect_not_modified(request, id, version, variant)
+    if not_modified is not None:
+        return not_modified
+    if version is None:
+        version = await aget_collect_version(id)
+    try:
+        body, version = await aget_or_build_collect_detail(
+            id, await aget_collect_generation(id), version, build, variant
+        )
+    except Collect.DoesNotExist:
+        await sync_to_async(invalidate_collect_caches)([id])
+        return await sync_to_async(collect_detail_sync)(request, id=id)
+    return collect_detail_response(id, body, version, variant)
+
+
+# Для метрик и профилирования действие определяется как у вьюсета
+collect_detail.actions = collect_detail_sync.actions
+
+
+async def collect_events(request, id):
+    """
+    Поток событий сбора (Server-Sent Events), доступен только под ASGI:
+    - progress: собранная сумма, число платежей и статус сбора,
+      первым отправляется текущее состояние;
+    - payment: новый платеж;
+    - comment: новый комментарий;
+    - like: изменение числа лайков платежа (delta).
+    Соединение с Redis на процесс одно (CollectEventHub),
+    поток на подписчика не занимается.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(
+            render_json(
+                {
+                    "Succes": False,
+                    "Message": "Поток событий доступен только через ASGI",
+                }
+            ),
+            content_type="application/json",
+            status=status.HTTP_501_NOT_IMPLEMENTED,
+        )
+    hub = get_event_hub()
+    # Подписка до чтения состояния, чтобы не пропустить события между ними
+    queue = await hub.subscribe(id)
+    try:
+        progress = await Collect.objects.values(
+            "collected_amount", "payments_count", "is_active"
+        ).aget(id=id)
+    except Collect.DoesNotExist:
+        await hub.unsubscribe(id, queue)
+        return HttpResponse(
+            render_json({"detail": "Сбор не найден"}),
+            content_type="application/json",
+            status=status.HTTP_404_NOT_FOUND,
+        )
+
+    async def stream():
+        try:
+            yield sse_frame("progress", progress)
+            while True:
+                try:
+                    yield await asyncio.wait_for(
+                        queue.get(), COLLECT_EVENTS_KEEPALIVE
+                    )
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+        finally:
+            await hub.unsubscribe(id, queue)
+
+    response = StreamingHttpResponse(
+        stream(), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
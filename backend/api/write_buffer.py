@@ -0,0 +1,185 @@
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Case, F, Value, When
+
+from api.events import publish_collect_event
+from api.models import Comment, Like, Payment
+from api.serializers import CommentShowSerializer
+
+User = get_user_model()
+
+WRITE_BUFFER_STREAM = "write_buffer"
+WRITE_BUFFER_GROUP = "write_buffer"
+
+
+def decode_entry(fields):
+    """Поля записи потока: {"kind", "author", "payment", "collect", ...}."""
+    entry = {key.decode(): value.decode() for key, value in fields.items()}
+    for key in ("author", "payment", "collect"):
+        entry[key] = int(entry[key])
+    return entry
+
+
+def insert_likes(pairs):
+    """
+    Вставить лайки (автор, платеж) одним запросом.
+    Повторные лайки отбрасываются ограничением unique_like
+    (ON CONFLICT DO NOTHING). Возвращает платежи вставленных лайков.
+    """
+    if not pairs:
+        return []
+    like_table = connection.ops.quote_name(Like._meta.db_table)
+    values = ", ".join(["(%s, %s)"] * len(pairs))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {like_table} (author_id, payment_id) "
+            f"VALUES {values} "
+            "ON CONFLICT (author_id, payment_id) DO NOTHING "
+            "RETURNING payment_id",
+            [value for pair in pairs for value in pair],
+        )
+        return [payment_id for (payment_id,) in cursor.fetchall()]
+
+
+def delete_likes(pairs):
+    """
+    Удалить лайки (автор, платеж) одним запросом.
+    Возвращает платежи удаленных лайков.
+    """
+    if not pairs:
+        return []
+    like_table = connection.ops.quote_name(Like._meta.db_table)
+    condition = " OR ".join(
+        ["(author_id = %s AND payment_id = %s)"] * len(pairs)
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {like_table} WHERE {condition} "
+            "RETURNING payment_id",
+            [value for pair in pairs for value in pair],
+        )
+        return [payment_id for (payment_id,) in cursor.fetchall()]
+
+
+def add_to_counter(field, counts):
+    """Увеличить счетчик платежей одним UPDATE: {id платежа: прирост}."""
+    if counts:
+        Payment.objects.filter(id__in=counts).update(
+            **{
+                field: F(field)
+                + Case(
+                    *[
+                        When(id=payment_id, then=Value(count))
+                        for payment_id, count in counts.items()
+                    ]
+                )
+            }
+        )
+
+
+def persist_buffered_writes(entries):
+    """
+    Сохранить пакет лайков, снятий лайков и комментариев из потока
+    записи. Записи к несуществующим платежам, платежам другого сбора
+    и от удаленных пользователей отбрасываются: иначе ошибка внешнего
+    ключа не давала бы сохранить пакет и поток перестал бы разбираться.
+    Для пары (автор, платеж) сохраняется последнее состояние лайка
+    в пакете: лайки вставляются одним запросом (повторные отклоняются
+    при приеме, ограничение unique_like отбрасывает оставшиеся гонки),
+    снятые лайки удаляются одним запросом. Комментарии сохраняются
+    bulk_create, счетчики платежей обновляются одним UPDATE на каждый
+    счетчик. Кэш затронутых сборов не сбрасывается, а перестраивается
+    задачей после фиксации, как при записи через сигналы: во время
+    потока записей читатели получают текущее тело, а не строят его
+    заново. События сборов публикуются после фиксации.
+    Возвращает число сохраненных и удаленных лайков, комментариев
+    и отброшенных записей.
+    """
+    payments = dict(
+        Payment.objects.filter(
+            id__in={entry["payment"] for entry in entries}
+        ).values_list("id", "collect_id")
+    )
+    authors = User.objects.only(
+        "id", "username", "first_name", "last_name"
+    ).in_bulk({entry["author"] for entry in entries})
+    valid = [
+        entry
+        for entry in entries
+        if payments.get(entry["payment"]) == entry["collect"]
+        and entry["author"] in authors
+    ]
+    like_states = {
+        (entry["author"], entry["payment"]): entry["kind"] == "like"
+        for entry in valid
+        if entry["kind"] in ("like", "unlike")
+    }
+    comments = [
+        Comment(
+            author=authors[entry["author"]],
+            payment_id=entry["payment"],
+            comment=entry["comment"],
+        )
+        for entry in valid
+        if entry["kind"] == "comment"
+    ]
+    # Задачи импортируют этот модуль
+    from api.tasks import schedule_collect_rebuild
+
+    with transaction.atomic():
+        likes = Counter(
+            insert_likes(
+                [pair for pair, liked in like_states.items() if liked]
+            )
+        )
+        unlikes = Counter(
+            delete_likes(
+                [pair for pair, liked in like_states.items() if not liked]
+            )
+        )
+        Comment.objects.bulk_create(comments)
+        like_deltas = {
+            payment_id: likes[payment_id] - unlikes[payment_id]
+            for payment_id in likes.keys() | unlikes.keys()
+            if likes[payment_id] != unlikes[payment_id]
+        }
+        add_to_counter("like_count", like_deltas)
+        add_to_counter(
+            "comment_count",
+            Counter(comment.payment_id for comment in comments),
+        )
+        collect_ids = {
+            payments[payment_id] for payment_id in like_deltas
+        } | {payments[comment.payment_id] for comment in comments}
+        for collect_id in collect_ids:
+            schedule_collect_rebuild(collect_id)
+    saved_likes = sum(likes.values())
+    deleted_likes = sum(unlikes.values())
+    skipped = len(entries) - saved_likes - deleted_likes - len(comments)
+    if collect_ids:
+        publish_buffered_events(payments, like_deltas, comments)
+    return saved_likes, deleted_likes, len(comments), skipped
+
+
+def publish_buffered_events(payments, like_deltas, comments):
+    """
+    События сохраненного пакета: одно событие like на платеж
+    с суммарным изменением и по событию на каждый комментарий.
+    """
+    for payment_id, count in like_deltas.items():
+        publish_collect_event(
+            payments[payment_id],
+            "like",
+            {"payment": payment_id, "delta": count},
+        )
+    for comment in comments:
+        publish_collect_event(
+            payments[comment.payment_id],
+            "comment",
+            {
+                "payment": comment.payment_id,
+                **CommentShowSerializer(comment).data,
+            },
+        )
@@ -1,6 +1,7 @@
 # Константы для моделей
 NAME_MAX_LENGTH = 255
 MAX_DIGITS = 9
+TOTAL_MAX_DIGITS = 12
 DECIMAL_PLACES = 0
 
 # Наименования поводов сбора
@@ -15,3 +16,80 @@ FORMAT = [
 ]
 
 API_VERSION = "v1"
+
+# Логотипы сборов
+LOGO_MAX_SIZE = 5 * 1024**2
+LOGO_BASE64_CHUNK_SIZE = 64 * 1024
+LOGO_WIDTHS = (160, 480, 1024)
+LOGO_LIST_WIDTH = 160
+LOGO_DETAIL_WIDTH = 480
+LOGO_WEBP_QUALITY = 80
+LOGO_JPEG_QUALITY = 85
+
+# Импорт платежей
+BULK_PAYMENTS_BATCH_SIZE = 1000
+BULK_PAYMENTS_MAX_ROWS = 10000
+
+# Заполнение БД тестовыми данными
+POPULATE_BATCH_SIZE = 10000
+# Платежи распределяются по периоду до запуска команды, в секундах
+POPULATE_PAYMENTS_PERIOD = 30 * 24 * 60 * 60
+
+# Рассылка писем
+EMAIL_BATCH_SIZE = 100
+EMAIL_BATCH_WINDOW = 5
+EMAIL_DRAIN_TIMEOUT = 60
+# Ожидание ответа SMTP, меньше времени жизни блокировки разбора
+EMAIL_SEND_TIMEOUT = 20
+
+# Закрытие сборов по дате завершения
+EXPIRED_COLLECTS_BATCH_SIZE = 1000
+EXPIRED_COLLECTS_SWEEP_INTERVAL = 60
+
+# Пересчет итогов сборов
+UPDATE_COLLECTS_CHUNK_SIZE = 10000
+
+# Метрики: границы бакетов гистограмм в секундах
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+EMAIL_LATENCY_BUCKETS = (1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+# Базы данных: время жизни соединения (0 - соединение на запрос)
+# и время, в течение которого пользователь после записи читает
+# с основной БД, в секундах
+DATABASE_CONN_MAX_AGE = 0
+DATABASE_PRIMARY_STICKY_TIMEOUT = 10
+
+# Рейтинг участников сбора: размер по умолчанию и наибольший
+LEADERBOARD_SIZE = 10
+LEADERBOARD_MAX_SIZE = 100
+
+# События сборов (SSE): размер очереди подписчика и интервал
+# комментария keep-alive в секундах
+COLLECT_EVENTS_QUEUE_SIZE = 100
+COLLECT_EVENTS_KEEPALIVE = 15
+
+# Буфер записи лайков и комментариев: размер пакета, окно накопления
+# пакета, время блокировки планирования сброса и время, после которого
+# записи несохраненного пакета берутся повторно, в секундах
+WRITE_BUFFER_BATCH_SIZE = 500
+WRITE_BUFFER_FLUSH_WINDOW = 1
+WRITE_BUFFER_FLUSH_TIMEOUT = 60
+WRITE_BUFFER_CLAIM_IDLE = 60
+# Время хранения состояния лайка, ожидающего сохранения из потока записи,
+# в секундах
+WRITE_BUFFER_PENDING_LIKE_TIMEOUT = 60 * 10
+
+# Пагинация
+PAYMENTS_PAGE_SIZE = 20
+COLLECTS_PAGE_SIZE = 20
+
+# Кэширование
+COLLECT_CACHE_TIMEOUT = 60 * 5
+COLLECT_CACHE_STALE_TIMEOUT = 60 * 60
+# Генерации и версии сборов живут дольше устаревших тел ответа
+COLLECT_CACHE_COUNTER_TIMEOUT = 60 * 60 * 24
+COLLECT_CACHE_LOCK_TIMEOUT = 10
+COLLECT_CACHE_LOCK_WAIT = 1
+COLLECT_CACHE_LOCK_POLL_INTERVAL = 0.05
+COLLECT_CACHE_EARLY_REFRESH_BETA = 1.0
+COLLECT_REBUILD_DEBOUNCE = 2
@@ -16,6 +16,14 @@ from datetime import timedelta
 import os
 import json
 
+from proninteam.constants import (
+    DATABASE_CONN_MAX_AGE,
+    DATABASE_PRIMARY_STICKY_TIMEOUT,
+    EMAIL_DRAIN_TIMEOUT,
+    EXPIRED_COLLECTS_SWEEP_INTERVAL,
+    WRITE_BUFFER_CLAIM_IDLE,
+)
+
 load_dotenv()
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -51,6 +59,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.middleware.PerformanceMiddleware",
+    "api.middleware.DatabaseRoutingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -83,13 +93,6 @@ WSGI_APPLICATION = "proninteam.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-# DATABASES = {
-#     "default": {
-#         "ENGINE": "django.db.backends.sqlite3",
-#         "NAME": BASE_DIR / "db.sqlite3",
-#     }
-# }
-
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.postgresql",
@@ -101,6 +104,57 @@ DATABASES = {
     },
 }
 
+# Локальный запуск (например, тестов) без PostgreSQL
+if os.getenv("USE_SQLITE", "False") == "True":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / "db.sqlite3",
+        }
+    }
+# Пула соединений нет: psycopg2 не поддерживает OPTIONS["pool"].
+# Приложение работает под ASGI (uvicorn), где постоянные соединения
+# не рекомендуются, поэтому по умолчанию соединение открывается
+# на запрос (CONN_MAX_AGE=0). Пул при нагрузке - PgBouncer перед
+# PostgreSQL (POSTGRES_HOST/POSTGRES_PORT указывают на него).
+# DATABASE_CONN_MAX_AGE > 0 имеет смысл только для WSGI и Celery:
+# соединение на поток, проверяется перед повторным использованием
+DATABASES["default"]["CONN_MAX_AGE"] = int(
+    os.getenv("DATABASE_CONN_MAX_AGE", DATABASE_CONN_MAX_AGE)
+)
+DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+# PgBouncer в режиме transaction не поддерживает курсоры на сервере
+# (QuerySet.iterator)
+DATABASES["default"]["DISABLE_SERVER_SIDE_CURSORS"] = (
+    os.getenv("DATABASE_PGBOUNCER", "False") == "True"
+)
+
+# Реплики для чтения: хосты PostgreSQL (host или host:port)
+# или файлы SQLite через запятую
+DATABASE_REPLICAS = []
+for number, replica in enumerate(
+    filter(None, os.getenv("DATABASE_REPLICAS", "").split(",")), start=1
+):
+    alias = f"replica{number}"
+    DATABASES[alias] = {
+        **DATABASES["default"],
+        "TEST": {"MIRROR": "default"},
+    }
+    if DATABASES[alias]["ENGINE"] == "django.db.backends.sqlite3":
+        DATABASES[alias]["NAME"] = BASE_DIR / replica.strip()
+    else:
+        host, _, port = replica.strip().partition(":")
+        DATABASES[alias]["HOST"] = host
+        DATABASES[alias]["PORT"] = port or DATABASES["default"]["PORT"]
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ["api.db_routers.ReplicaRouter"]
+DATABASE_PRIMARY_STICKY_TIMEOUT = int(
+    os.getenv(
+        "DATABASE_PRIMARY_STICKY_TIMEOUT", DATABASE_PRIMARY_STICKY_TIMEOUT
+    )
+)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -153,6 +207,15 @@ REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework_simplejwt.authentication.JWTAuthentication",
     ),
+    "DEFAULT_RENDERER_CLASSES": (
+        "api.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
+    "DEFAULT_PARSER_CLASSES": (
+        "api.parsers.ORJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ),
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
 }
 
@@ -171,13 +234,33 @@ DJOSER = {
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
-        "LOCATION": "redis://redis:6379/1",
+        "LOCATION": os.getenv("REDIS_CACHE_URL", "redis://redis:6379/1"),
         "OPTIONS": {
-            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            "CLIENT_CLASS": "api.profiling.ProfilingRedisClient",
         },
     }
 }
 
+# Тесты работают с отдельной БД Redis, она очищается перед каждым тестом
+TEST_RUNNER = "proninteam.test_runner.RedisTestRunner"
+REDIS_TEST_CACHE_URL = os.getenv(
+    "REDIS_TEST_CACHE_URL", "redis://redis:6379/15"
+)
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "api": {
+            "handlers": ["console"],
+            "level": os.getenv("API_LOG_LEVEL", "INFO"),
+        },
+    },
+}
+
 # Настройка Celery
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND")
@@ -186,6 +269,40 @@ CELERY_ACCEPT_CONTENT = json.loads(
 )
 CELERY_TASK_SERIALIZER = os.getenv("CELERY_TASK_SERIALIZER")
 CELERY_RESULT_SERIALIZER = os.getenv("CELERY_RESULT_SERIALIZER")
+CELERY_TASK_ALWAYS_EAGER = (
+    os.getenv("CELERY_TASK_ALWAYS_EAGER", "False") == "True"
+)
+CELERY_BEAT_SCHEDULE = {
+    "close-expired-collects": {
+        "task": "api.tasks.close_expired_collects",
+        "schedule": EXPIRED_COLLECTS_SWEEP_INTERVAL,
+    },
+    # Подбирает записи буфера, пакет которых не был сохранен
+    "flush-write-buffer": {
+        "task": "api.tasks.flush_write_buffer",
+        "schedule": WRITE_BUFFER_CLAIM_IDLE,
+    },
+    # Запускает разбор писем, оставшихся в очереди после падения воркера
+    "sweep-email-queue": {
+        "task": "api.tasks.sweep_email_queue",
+        "schedule": EMAIL_DRAIN_TIMEOUT,
+    },
+}
+
+# Лайки и комментарии принимаются в поток Redis и сохраняются
+# пакетами задачей flush_write_buffer (ответ 202)
+WRITE_BUFFER_ENABLED = os.getenv("WRITE_BUFFER_ENABLED", "False") == "True"
+
+# Заголовок Server-Timing с замерами запроса для всех клиентов,
+# без этого флага он отдается только сотрудникам (is_staff)
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "False") == "True"
+
+# Доступ к /metrics/: адреса или подсети через запятую и/или токен
+# (заголовок Authorization: Bearer <токен>), остальным ответ 403
+METRICS_ALLOWED_IPS = list(
+    filter(None, os.getenv("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(","))
+)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
 
 # Настройка SMTP для отправки email
 EMAIL_BACKEND = os.getenv("EMAIL_BACKEND")
@@ -195,5 +312,10 @@ EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS")
 EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD")
 DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL")
+# Ограничение почтового провайдера, писем в секунду
+EMAIL_RATE_LIMIT = float(os.getenv("EMAIL_RATE_LIMIT", "5"))
 
 PROJECT_NAME = "ProninTeam"
+
+# Адрес сайта для абсолютных ссылок в ответах, собранных вне запроса
+SITE_URL = os.getenv("SITE_URL", "http://127.0.0.1:8000")
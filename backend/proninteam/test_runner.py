@@ -0,0 +1,76 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from proninteam.celery import app
+
+# Задачи Celery в тестах выполняются сразу в процессе теста,
+# без брокера и хранилища результатов из .env
+TEST_CELERY_SETTINGS = {
+    "task_always_eager": True,
+    "task_eager_propagates": True,
+    "broker_url": "memory://",
+    "result_backend": "cache+memory://",
+    "task_serializer": "json",
+    "result_serializer": "json",
+    "accept_content": ["json"],
+}
+
+
+class RedisTestRunner(DiscoverRunner):
+    """
+    Запуск тестов с отдельной БД Redis (settings.REDIS_TEST_CACHE_URL).
+    Кэш, рейтинги, метрики и потоки рабочей БД Redis тестами
+    не затрагиваются, тестовая БД очищается перед запуском
+    и перед каждым тестом (api.tests.RedisIsolationMixin).
+    Задачи Celery выполняются синхронно (TEST_CELERY_SETTINGS),
+    письма остаются в django.core.mail.outbox без ограничения скорости.
+    Замеры запросов (лог api.performance) в вывод тестов не пишутся,
+    тесты проверяют их через assertLogs.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        location = settings.REDIS_TEST_CACHE_URL
+        if location == settings.CACHES["default"]["LOCATION"]:
+            raise ImproperlyConfigured(
+                "REDIS_TEST_CACHE_URL must differ from REDIS_CACHE_URL"
+            )
+        self.settings_override = override_settings(
+            CACHES={
+                **settings.CACHES,
+                "default": {
+                    **settings.CACHES["default"],
+                    "LOCATION": location,
+                },
+            },
+            EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+            DEFAULT_FROM_EMAIL=settings.DEFAULT_FROM_EMAIL
+            or "test@example.com",
+            # Письма не уходят провайдеру, ограничение скорости не нужно
+            EMAIL_RATE_LIMIT=float("inf"),
+            **{
+                f"CELERY_{name.upper()}": value
+                for name, value in TEST_CELERY_SETTINGS.items()
+            },
+        )
+        self.settings_override.enable()
+        # Конфигурация приложения Celery уже прочитана из настроек
+        self.celery_conf = {
+            name: app.conf[name] for name in TEST_CELERY_SETTINGS
+        }
+        app.conf.update(TEST_CELERY_SETTINGS)
+        self.performance_logger = logging.getLogger("api.performance")
+        self.performance_level = self.performance_logger.level
+        self.performance_logger.setLevel(logging.WARNING)
+        cache.clear()
+
+    def teardown_test_environment(self, **kwargs):
+        self.performance_logger.setLevel(self.performance_level)
+        app.conf.update(self.celery_conf)
+        self.settings_override.disable()
+        super().teardown_test_environment(**kwargs)
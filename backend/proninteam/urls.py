@@ -24,10 +24,12 @@ from drf_spectacular.views import (
     SpectacularSwaggerView,
 )
 
+from api.views import metrics
 from proninteam.constants import API_VERSION
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("metrics/", metrics, name="metrics"),
     path(f"api/{API_VERSION}/", include("api.urls"), name="api"),
     path(f"api/{API_VERSION}/", include("djoser.urls")),
     path(f"api/{API_VERSION}/", include("djoser.urls.jwt")),